@@ -0,0 +1,163 @@
+import re
+
+import numpy as np
+
+from series import Series, to_float_array
+
+MINUTE_US = 60 * 1_000_000
+
+PERIODIC_OPERATIONS = (
+    "moyenne", "somme", "maximum", "minimum", "premiere", "derniere",
+    "mediane", "ecart_type", "percentile", "moyenne_ponderee",
+)
+
+# Opérations calculables par un GROUP BY SQL (agrégation poussée vers la base)
+SQL_AGGREGATES = {"moyenne": "AVG", "somme": "SUM", "maximum": "MAX", "minimum": "MIN"}
+
+_PERCENTILE_ALIAS = re.compile(r"^(?:percentile_?|p)(\d+(?:\.\d+)?)$")
+
+
+class PeriodicSpec:
+    """Parsed parameters of a PeriodicCalc block"""
+
+    def __init__(self, operation, period_us, offset_us=0, validity_rate=0, percentile=None):
+        self.operation = operation
+        self.period_us = period_us
+        self.offset_us = offset_us
+        self.validity_rate = validity_rate
+        self.percentile = percentile
+
+    def bucket_start(self, timestamps):
+        """Start (epoch µs) of the period containing each timestamp"""
+        return (timestamps - self.offset_us) // self.period_us * self.period_us + self.offset_us
+
+
+def periodic_spec(parameters):
+    """Read a PeriodicCalc block: operation, period and offset (minutes), validity_rate (%).
+
+    Percentiles are written "percentile" with a "percentile" parameter, or
+    as "percentile_90" / "p90".
+    """
+    operation = parameters["operation"].lower().strip()
+    percentile = parameters.get("percentile")
+    match = _PERCENTILE_ALIAS.match(operation)
+    if match:
+        operation, percentile = "percentile", float(match.group(1))
+    if operation not in PERIODIC_OPERATIONS:
+        raise ValueError(f"Opération périodique inconnue : {operation}")
+    if operation == "percentile":
+        if percentile is None or not 0 <= float(percentile) <= 100:
+            raise ValueError("Le percentile doit être compris entre 0 et 100")
+        percentile = float(percentile)
+
+    period_us = int(parameters.get("period", 60) * MINUTE_US)
+    if period_us <= 0:
+        raise ValueError("La période doit être strictement positive")
+    return PeriodicSpec(
+        operation,
+        period_us,
+        offset_us=int(parameters.get("offset", 0) * MINUTE_US),
+        validity_rate=parameters.get("validity_rate", 0),
+        percentile=percentile,
+    )
+
+
+def _segments(keys):
+    """Start indices and lengths of the runs of equal values in sorted `keys`"""
+    if not len(keys):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    lengths = np.diff(np.r_[starts, len(keys)])
+    return starts, lengths
+
+
+def _sorted_quantile(sorted_values, starts, lengths, fraction):
+    """Linearly interpolated quantile of each segment of per-segment sorted values"""
+    position = (lengths - 1) * fraction
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    low = sorted_values[starts + lower]
+    high = sorted_values[starts + upper]
+    return low + (high - low) * (position - lower)
+
+
+def aggregate(series, spec):
+    """Grouped aggregation of a series into periods of `spec.period_us`.
+
+    Bucket indices are computed once and every operation is a segmented
+    reduction over the valid points of each bucket. A bucket is kept when
+    it has at least one valid point and its share of valid points reaches
+    `validity_rate`; its output is stamped at the start of the period.
+    """
+    if not len(series):
+        return Series.empty()
+
+    timestamps, values, valid = series.timestamps, series.values, series.valid
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values, valid = timestamps[order], values[order], valid[order]
+
+    buckets = spec.bucket_start(timestamps)
+    starts, totals = _segments(buckets)
+    valid_counts = np.add.reduceat(valid.astype(np.int64), starts)
+    keep = (valid_counts > 0) & (valid_counts * 100 >= spec.validity_rate * totals)
+
+    # Réductions segmentées sur les seuls points valides
+    v_ts = timestamps[valid]
+    v_vals = values[valid]
+    v_buckets = buckets[valid]
+    v_starts, counts = _segments(v_buckets)
+    out_ts = v_buckets[v_starts]
+
+    operation = spec.operation
+    if operation == "moyenne":
+        res = np.add.reduceat(v_vals, v_starts) / counts
+    elif operation == "somme":
+        res = np.add.reduceat(v_vals, v_starts)
+    elif operation == "maximum":
+        res = np.maximum.reduceat(v_vals, v_starts)
+    elif operation == "minimum":
+        res = np.minimum.reduceat(v_vals, v_starts)
+    elif operation == "premiere":
+        res = v_vals[v_starts]
+    elif operation == "derniere":
+        res = v_vals[v_starts + counts - 1]
+    elif operation == "ecart_type":
+        # Écart type de population (ddof=0)
+        mean = np.add.reduceat(v_vals, v_starts) / counts
+        deviation = v_vals - np.repeat(mean, counts)
+        res = np.sqrt(np.add.reduceat(deviation * deviation, v_starts) / counts)
+    elif operation in ("mediane", "percentile"):
+        fraction = 0.5 if operation == "mediane" else spec.percentile / 100
+        order = np.lexsort((v_vals, v_buckets))
+        res = _sorted_quantile(v_vals[order], v_starts, counts, fraction)
+    elif operation == "moyenne_ponderee":
+        # Chaque valeur est pondérée par sa durée de validité : jusqu'au point
+        # valide suivant de la période, ou jusqu'à la fin de la période
+        ends = np.r_[v_ts[1:], 0]
+        last = v_starts + counts - 1
+        ends[last] = out_ts + spec.period_us
+        weights = (ends - v_ts).astype(np.float64)
+        res = np.add.reduceat(v_vals * weights, v_starts) / np.add.reduceat(weights, v_starts)
+    else:
+        raise ValueError(f"Opération périodique inconnue : {operation}")
+
+    # Les périodes sans point valide n'apparaissent pas dans out_ts
+    kept = keep[np.searchsorted(buckets[starts], out_ts)]
+    return Series(out_ts[kept], res[kept])
+
+
+def bucket_rows_to_series(rows, spec):
+    """Series from grouped SQL rows (bucket index, row count, non-null count, aggregate),
+    with the same validity_rate filter and period-start stamps as aggregate()"""
+    if not rows:
+        return Series.empty()
+    buckets = np.array([row[0] for row in rows], dtype=np.int64)
+    totals = np.array([row[1] for row in rows], dtype=np.int64)
+    valid_counts = np.array([row[2] for row in rows], dtype=np.int64)
+    values = to_float_array([row[3] for row in rows])
+
+    keep = (valid_counts > 0) & (valid_counts * 100 >= spec.validity_rate * totals)
+    timestamps = buckets[keep] * spec.period_us + spec.offset_us
+    order = np.argsort(timestamps, kind="stable")
+    return Series(timestamps[order], values[keep][order])
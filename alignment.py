@@ -0,0 +1,173 @@
+import numpy as np
+
+from interpolation import interpolate, interpolation_spec
+from series import Series
+
+# Jointure des entrées d'un bloc arithmétique qui ne partagent pas la timeline de la règle
+JOIN_MODES = ("inner", "outer", "asof")
+
+# Timeline d'un ReadVar : union des variables de la règle, ou ses propres échantillons
+READVAR_TIMELINES = ("shared", "own")
+
+# Attente maximale (µs) d'une entrée en retard lors d'une jointure par morceaux
+MAX_JOIN_LOOKAHEAD = 24 * 60 * 60 * 1_000_000
+
+
+def join_spec(parameters):
+    """Read the join settings of an arithmetic block: mode (default "outer") and,
+    for outer and as-of joins, the interpolation method and max_gap (minutes)"""
+    mode = str(parameters.get("join", "outer")).lower().strip()
+    if mode not in JOIN_MODES:
+        raise ValueError(f"Mode de jointure inconnu : {mode}")
+    method, max_gap = interpolation_spec(parameters)
+    return mode, method, max_gap
+
+
+def readvar_timeline(parameters):
+    """Timeline of a ReadVar block: "shared" (interpolated on the union) or "own" (raw samples)"""
+    timeline = str(parameters.get("timeline", "shared")).lower().strip()
+    if timeline not in READVAR_TIMELINES:
+        raise ValueError(f"Timeline de ReadVar inconnue : {timeline}")
+    return timeline
+
+
+def merge_timestamps(timestamp_arrays):
+    """Union of sorted timestamp arrays and, for each array, the slot of its points in it.
+
+    The arrays are concatenated and merged by a stable sort, which for
+    already sorted runs is a single merge pass (timsort).
+    """
+    lengths = [len(ts) for ts in timestamp_arrays]
+    merged = np.concatenate(timestamp_arrays) if timestamp_arrays else np.empty(0, dtype=np.int64)
+    order = np.argsort(merged, kind="stable")
+    merged = merged[order]
+
+    new = np.ones(len(merged), dtype=bool)
+    new[1:] = merged[1:] != merged[:-1]
+    slots = np.empty(len(merged), dtype=np.int64)
+    slots[order] = np.cumsum(new) - 1
+    return merged[new], np.split(slots, np.cumsum(lengths)[:-1])
+
+
+def align(series_list, mode="outer", method="linear", max_gap=None):
+    """Join series on their timestamps; returns (timeline, [(values, valid)] per series).
+
+    - inner: only the timestamps present in every series;
+    - outer: the union of the timestamps, each series interpolated on it
+      like a ReadVar (`method`, `max_gap` in µs);
+    - asof: the timestamps of the first series, the others taking their
+      last valid value at or before each of them (older than `max_gap` is
+      left empty).
+    """
+    timeline, slots = merge_timestamps([s.timestamps for s in series_list])
+
+    if mode == "inner":
+        counts = np.zeros(len(timeline), dtype=np.int64)
+        for series_slots in slots:
+            counts[series_slots] += 1
+        keep = counts == len(series_list)
+        positions = np.cumsum(keep) - 1
+        operands = []
+        for series, series_slots in zip(series_list, slots):
+            kept = keep[series_slots]
+            values = np.full(int(keep.sum()), np.nan)
+            valid = np.zeros(len(values), dtype=bool)
+            values[positions[series_slots[kept]]] = series.values[kept]
+            valid[positions[series_slots[kept]]] = series.valid[kept]
+            operands.append((values, valid))
+        return timeline[keep], operands
+
+    if mode == "outer":
+        operands = []
+        for series in series_list:
+            samples = np.where(series.valid, series.values, np.nan)
+            operands.append(interpolate(series.timestamps, samples, timeline, method, max_gap))
+        return timeline, operands
+
+    if mode == "asof":
+        left = series_list[0]
+        operands = [(left.values, left.valid)]
+        for series, series_slots in zip(series_list[1:], slots[1:]):
+            # Indice du dernier point valide à chaque date de l'union, propagé vers l'avant
+            last = np.full(len(timeline), -1, dtype=np.int64)
+            valid_points = np.flatnonzero(series.valid)
+            last[series_slots[valid_points]] = valid_points
+            last = np.maximum.accumulate(last)[slots[0]]
+            found = last >= 0
+            if max_gap is not None:
+                found[found] = left.timestamps[found] - series.timestamps[last[found]] <= max_gap
+            values = np.full(len(left), np.nan)
+            values[found] = series.values[last[found]]
+            operands.append((values, found))
+        return left.timestamps, operands
+
+    raise ValueError(f"Mode de jointure inconnu : {mode}")
+
+
+def release_limit(series_list, mode):
+    """Latest timestamp up to which later points of the inputs can no longer change the join.
+
+    Inputs arrive in time order, so a series adds nothing at or before its
+    last timestamp; an outer join also needs the next valid sample of every
+    series to interpolate. None when some input has nothing yet.
+    """
+    limit = None
+    for series in series_list:
+        timestamps = series.timestamps[series.valid] if mode == "outer" else series.timestamps
+        if not len(timestamps):
+            return None
+        limit = timestamps[-1] if limit is None else min(limit, timestamps[-1])
+    return int(limit)
+
+
+def _trim(series, limit):
+    """Points after `limit` plus the last valid one at or before it (interpolation context)"""
+    keep = series.timestamps > limit
+    known = np.flatnonzero(~keep & series.valid)
+    if len(known):
+        keep[known[-1]] = True
+    return Series(series.timestamps[keep], series.values[keep], series.valid[keep])
+
+
+def align_chunk(series_list, mode="outer", method="linear", max_gap=None, pending=None, final=True,
+                max_lookahead=MAX_JOIN_LOOKAHEAD):
+    """Chunked counterpart of align() for inputs arriving as time-ordered pieces.
+
+    `pending` is the state returned by the previous call (unjoined points,
+    last joined timestamp); only timestamps up to release_limit() are
+    joined until `final`. An input lagging more than `max_lookahead` µs
+    behind the newest point is treated as having no later sample up to
+    that span, so the buffered points stay bounded; with a gap wider than
+    it, the join may then differ from align() over the whole history.
+    Returns (timeline, operands, pending).
+    """
+    released_until = None
+    if pending is not None:
+        buffered, released_until = pending
+        series_list = [Series.concat([old, new]) for old, new in zip(buffered, series_list)]
+
+    limit = None if final else release_limit(series_list, mode)
+    if not final and max_lookahead is not None:
+        newest = max((int(series.timestamps[-1]) for series in series_list if len(series)), default=None)
+        if newest is not None:
+            # Politique « pas d'échantillon plus tardif » au-delà de l'attente maximale
+            floor = newest - max_lookahead
+            limit = floor if limit is None else max(limit, floor)
+            if released_until is not None:
+                limit = max(limit, released_until)
+    if not final and limit is None:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, [(np.empty(0), np.empty(0, dtype=bool)) for _ in series_list], (series_list, released_until)
+
+    timeline, operands = align(series_list, mode, method, max_gap)
+    keep = np.ones(len(timeline), dtype=bool)
+    if released_until is not None:
+        keep &= timeline > released_until
+    if limit is not None:
+        keep &= timeline <= limit
+    timeline = timeline[keep]
+    operands = [(values[keep], valid[keep]) for values, valid in operands]
+
+    if final:
+        return timeline, operands, None
+    return timeline, operands, ([_trim(series, limit) for series in series_list], limit)
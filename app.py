@@ -1,11 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
-import pyodbc
 import json
+from contextlib import contextmanager
 from datetime import datetime
+import hashlib
 import logging
-from collections import defaultdict
-import math
+import os
+import time
+from batch import run_batch, run_fused
+from database import RULE_VERSION_COLUMN, has_column
+from engine import compile_rule, execute_plan, simulate_plan
+from explain import explain_plan
+from history_cache import CachedStorage, HistoryCache
+from optimizer import optimize_plan
+from jobs import JobManager
+from metrics import Metrics
+from pool import ConnectionPool
+from preview import DOWNSAMPLING_METHODS, PREVIEW_POINTS, series_preview
+from profiling import Profile
+from rule_cache import RuleCache
+from storage import SqlServerStorage
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all domains
@@ -16,6 +30,8 @@ logger = logging.getLogger(__name__)
 
 def get_connection():
     """Establish connection to SQL Server database"""
+    # pyodbc n'est requis que pour SQL Server (le moteur tourne aussi sur SQLite)
+    import pyodbc
     return pyodbc.connect(
         'DRIVER={ODBC Driver 17 for SQL Server};'
         'SERVER=DESKTOP-FOIB0OT;'
@@ -23,254 +39,103 @@ def get_connection():
         'Trusted_Connection=yes;'
     )
 
-def get_rule_json(cursor, id_rule):
-    """Get rule JSON from ref_regle table"""
-    cursor.execute("SELECT text_json FROM ref_regle WHERE id_regle=?", id_rule)
-    row = cursor.fetchone()
-    return row[0] if row else None
-
-def interpolate_missing_values(cursor, variable_ids):
-    """Interpolate missing values for given variable IDs"""
-    dates_by_var = {}
-    all_dates = set()
-    values_by_var = {}
-
-    for var_id in variable_ids:
-        cursor.execute("""
-            SELECT date_acquisition, val_valide
-            FROM his_valeur
-            WHERE id_variable = ? AND id_qualification = 0
-        """, (var_id,))
-        rows = cursor.fetchall()
-        dates_by_var[var_id] = {r[0] for r in rows}
-        values_by_var[var_id] = {r[0]: r[1] for r in rows}
-        all_dates.update(dates_by_var[var_id])
-
-    all_dates = sorted(all_dates)
-
-    for var_id in variable_ids:
-        for date in all_dates:
-            if date not in values_by_var[var_id]:
-                prev_dates = [d for d in dates_by_var[var_id] if d < date]
-                next_dates = [d for d in dates_by_var[var_id] if d > date]
-
-                if prev_dates and next_dates:
-                    d1 = max(prev_dates)
-                    d2 = min(next_dates)
-                    v1 = values_by_var[var_id][d1]
-                    v2 = values_by_var[var_id][d2]
-
-                    t1 = d1.timestamp()
-                    t2 = d2.timestamp()
-                    t = date.timestamp()
-                    interpolated_value = v1 + (v2 - v1) * (t - t1) / (t2 - t1)
-                    values_by_var[var_id][date] = interpolated_value
-                elif prev_dates:
-                    values_by_var[var_id][date] = values_by_var[var_id][max(prev_dates)]
-                elif next_dates:
-                    values_by_var[var_id][date] = values_by_var[var_id][min(next_dates)]
-
-    complete_results = []
-    for date in all_dates:
-        row_values = [values_by_var[var_id][date] for var_id in variable_ids]
-        complete_results.append((date, row_values))
-
-    return complete_results
-
-def execute_rule_logic(cursor, json_data):
-    """Execute the rule logic from JSON data"""
+# Pool de connexions partagé par toutes les routes (réglable par variables d'environnement)
+connection_pool = ConnectionPool(
+    get_connection,
+    max_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+    max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+    checkout_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    ping_after=float(os.environ.get('DB_POOL_PING_AFTER', 60)),
+)
+
+# Cache des plans compilés (et optimisés), invalidé par save_rule et delete_rule
+RULE_OPTIMIZE = os.environ.get('RULE_OPTIMIZE', '1').lower() in ('1', 'true', 'yes')
+rule_cache = RuleCache(max_size=int(os.environ.get('RULE_CACHE_SIZE', 128)), optimize=RULE_OPTIMIZE)
+
+# Historiques chargés partagés entre les règles (0 Mo pour désactiver)
+history_cache = HistoryCache(
+    max_bytes=int(float(os.environ.get('HISTORY_CACHE_MB', 256)) * 2 ** 20),
+    max_age=float(os.environ.get('HISTORY_CACHE_TTL', 300)),
+)
+
+# Agrégations PeriodicCalc calculées par SQL Server quand la règle le permet
+RULE_PUSHDOWN = os.environ.get('RULE_PUSHDOWN', '1').lower() in ('1', 'true', 'yes')
+
+# Nombre de règles exécutées en parallèle par /api/execute-rules
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+
+# File d'exécution asynchrone des règles (?async=1)
+job_manager = JobManager(workers=int(os.environ.get('JOB_WORKERS', 2)))
+
+# Métriques agrégées sur la vie du processus, exposées par /api/metrics
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency per route')
+metrics.describe('rule_executions_total', 'counter', 'Rule executions by mode and status')
+metrics.describe('rule_block_duration_seconds', 'histogram', 'Time spent per block evaluation, by block class')
+metrics.describe('rule_block_output_points_total', 'counter', 'Points produced by blocks, by block class')
+metrics.describe('rule_phase_duration_seconds', 'histogram', 'Time per execution spent in each storage/interpolation phase')
+metrics.describe('rule_phase_queries_total', 'counter', 'SQL statements issued by each phase')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe(
+            'http_request_duration_seconds', time.perf_counter() - started,
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method, status=str(response.status_code),
+        )
+    return response
+
+def db_connection():
+    """Check out a pooled connection for the duration of a `with` block"""
+    return connection_pool.connection()
+
+@contextmanager
+def db_storage():
+    """Pooled connection wrapped in the engine's storage interface"""
+    with db_connection() as conn:
+        storage = SqlServerStorage(conn)
+        try:
+            yield CachedStorage(storage, history_cache) if history_cache.enabled else storage
+        finally:
+            storage.close()
+
+def execute_rule_logic(storage, json_data=None, plan=None, rule_id=None, incremental=False, chunk_rows=None,
+                       progress=None, profile=False):
+    """Execute the rule logic from JSON data (or from an already compiled plan).
+
+    Every execution is profiled for /api/metrics; with `profile` the per-block
+    and per-phase figures are also returned under "profile".
+    """
+    run_profile = Profile()
+    mode = 'chunked' if chunk_rows else 'incremental' if incremental else 'full'
     try:
-        blocks = json_data["blocks"]
-        links = json_data["links"]
-
-        # Créer un mapping des blocs par leur index (position dans le tableau)
-        # L'ID du bloc correspond à son index + 1
-        id_to_block = {i + 1: block for i, block in enumerate(blocks)}
-
-        # Création des maps d'entrées et de sorties basées sur les IDs des liens
-        inputs_map = defaultdict(list)
-        outputs_map = defaultdict(list)
-        for link in links:
-            inputs_map[link["child"]].append(link["parent"])
-            outputs_map[link["parent"]].append(link["child"])
-
-        # Récupération de tous les IDs des variables sources
-        variable_ids = []
-        for i, block in enumerate(blocks):
-            if block["class"] == "ReadVar":
-                variable_ids.append(block["parameters"]["Id"])
-
-        if not variable_ids:
-            return {"error": "No ReadVar blocks found in the rule"}
-
-        # Charger toutes les valeurs interpolées
-        dated_values = interpolate_missing_values(cursor, variable_ids)
-        var_index_map = {var_id: idx for idx, var_id in enumerate(variable_ids)}
+        # Compiler la règle en un plan ordonné (détection des cycles incluse)
+        if plan is None:
+            plan = compile_rule(json_data)
 
-        # Fonction récursive pour évaluer un bloc par son ID
-        def evaluate_block(block_id):
-            if block_id not in id_to_block:
-                raise ValueError(f"Block ID {block_id} not found")
-                
-            block = id_to_block[block_id]
-            cls = block["class"]
-
-            if cls == "ReadVar":
-                var_id = block["parameters"]["Id"]
-                if var_id not in var_index_map:
-                    raise ValueError(f"Variable ID {var_id} not found in data")
-                idx = var_index_map[var_id]
-                return [(date, values[idx]) for date, values in dated_values]
-
-            elif cls in ('+', '-', '*', '/'):
-                input_block_ids = inputs_map[block_id]
-                if not input_block_ids:
-                    raise ValueError(f"No inputs found for operation block {block_id}")
-                    
-                input_data_list = [evaluate_block(inp) for inp in input_block_ids]
-                
-                if not input_data_list:
-                    return []
-                    
-                results = []
-                min_length = min(len(data) for data in input_data_list)
-                
-                for i in range(min_length):
-                    date = input_data_list[0][i][0]
-                    vals = [inp[i][1] for inp in input_data_list if inp[i][1] is not None]
-                    
-                    if not vals:
-                        results.append((date, None))
-                        continue
-                    
-                    if cls == '+':
-                        res = sum(vals)
-                    elif cls == '-':
-                        res = vals[0] - sum(vals[1:]) if len(vals) > 1 else vals[0]
-                    elif cls == '*':
-                        res = math.prod(vals)
-                    elif cls == '/':
-                        res = vals[0]
-                        for v in vals[1:]:
-                            if v == 0:
-                                res = None
-                                break
-                            res /= v
-                    
-                    results.append((date, res))
-                return results
-
-            elif cls == "PeriodicCalc":
-                input_block_ids = inputs_map[block_id]
-                if not input_block_ids:
-                    raise ValueError(f"No input found for PeriodicCalc block {block_id}")
-                    
-                input_data = evaluate_block(input_block_ids[0])
-                operation = block["parameters"]["operation"].lower().strip()
-                period_minutes = block["parameters"].get("period", 60)
-                validity_rate = block["parameters"].get("validity_rate", 0)
-                period_seconds = period_minutes * 60
-
-                if not input_data:
-                    return []
-
-                grouped_data = defaultdict(list)
-                for date, value in input_data:
-                    period_index = math.floor(date.timestamp() / period_seconds)
-                    grouped_data[period_index].append((date, value))
-
-                results = []
-                for group_idx, group_values in grouped_data.items():
-                    dates = [d for d, _ in group_values]
-                    vals = [v for _, v in group_values if v is not None]
-
-                    total_points = len(group_values)
-                    valid_points = len(vals)
-                    if total_points == 0:
-                        continue
-                    percentage_valid = (valid_points / total_points) * 100
-                    if percentage_valid < validity_rate:
-                        continue
-
-                    if not vals:
-                        continue
-
-                    if operation == "moyenne":
-                        res = sum(vals) / len(vals)
-                    elif operation == "somme":
-                        res = sum(vals)
-                    elif operation == "maximum":
-                        res = max(vals)
-                    elif operation == "minimum":
-                        res = min(vals)
-                    elif operation == "premiere":
-                        res = vals[0]
-                    elif operation == "derniere":
-                        res = vals[-1]
-                    else:
-                        raise ValueError(f"Opération périodique inconnue : {operation}")
-
-                    # Utiliser la première date du groupe pour l'alignement
-                    aligned_date = min(dates).replace(minute=0, second=0, microsecond=0)
-                    results.append((aligned_date, res))
-
-                results.sort(key=lambda x: x[0])
-                return results
-
-            elif cls == "WriteVar":
-                input_block_ids = inputs_map[block_id]
-                if not input_block_ids:
-                    raise ValueError(f"No input found for WriteVar block {block_id}")
-                    
-                results = evaluate_block(input_block_ids[0])
-                var_id = block["parameters"]["Id"]
-                
-                for date, res in results:
-                    if res is not None:  # Only write non-null values
-                        cursor.execute("""
-                            IF NOT EXISTS (
-                                SELECT 1 FROM his_valeur 
-                                WHERE id_variable = ? AND date_acquisition = ?
-                            )
-                            INSERT INTO his_valeur (
-                                id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide
-                            )
-                            VALUES (?, ?, 1, GETDATE(), ?, ?)
-                        """, (var_id, date, var_id, date, res, res))
-                return results
+        if not plan.variable_ids:
+            return {"error": "No ReadVar blocks found in the rule"}
 
-            else:
-                raise ValueError(f"Type de bloc inconnu: {cls}")
-
-        # Lancer le calcul pour chaque WriteVar (identifier par leur ID)
-        end_block_ids = []
-        for i, block in enumerate(blocks):
-            if block["class"] == "WriteVar":
-                end_block_ids.append(i + 1)  # ID = index + 1
-        
-        execution_results = []
-        for end_block_id in end_block_ids:
-            block_results = evaluate_block(end_block_id)
-            execution_results.extend(block_results)
-
-        # Marquer les variables sources comme qualifiées
-        for date, _ in dated_values:
-            for var_id in variable_ids:
-                cursor.execute("""
-                    UPDATE his_valeur
-                    SET id_qualification = 1
-                    WHERE id_variable = ? AND date_acquisition = ? AND id_qualification = 0
-                """, (var_id, date))
-
-        return {
-            "success": True,
-            "processed_dates": len(dated_values),
-            "output_values": len(execution_results),
-            "variable_ids_processed": variable_ids
-        }
+        # Incremental mode only processes data newer than the rule's watermark,
+        # chunked mode bounds memory on long histories
+        result = execute_plan(
+            storage, plan, rule_id=rule_id, incremental=incremental, chunk_rows=chunk_rows,
+            progress=progress, profile=run_profile, pushdown=RULE_PUSHDOWN,
+        )
+        metrics.observe_profile(run_profile, result['mode'], 'success')
+        if profile:
+            result['profile'] = run_profile.to_dict()
+        return result
 
     except Exception as e:
         logger.error(f"Error executing rule logic: {str(e)}")
+        metrics.observe_profile(run_profile, mode, 'error')
         return {"error": str(e)}
 
 @app.route('/api/save-rule', methods=['POST'])
@@ -318,69 +183,69 @@ def save_rule():
         if not rule_name:
             rule_name = f'Rule_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        if id_regle:
-            # Check if rule exists for update
-            cursor.execute("SELECT COUNT(*) FROM ref_regle WHERE id_regle = ?", (id_regle,))
-            exists = cursor.fetchone()[0] > 0
+            if id_regle:
+                # Check if rule exists for update
+                cursor.execute("SELECT COUNT(*) FROM ref_regle WHERE id_regle = ?", (id_regle,))
+                exists = cursor.fetchone()[0] > 0
             
-            if exists:
-                # Update existing rule
-                # Update the JSON with the correct ID
-                if isinstance(json_data, dict):
-                    json_data['id'] = id_regle
-                    json_data_str = json.dumps(json_data, ensure_ascii=False)
+                if exists:
+                    # Update existing rule
+                    # Update the JSON with the correct ID
+                    if isinstance(json_data, dict):
+                        json_data['id'] = id_regle
+                        json_data_str = json.dumps(json_data, ensure_ascii=False)
                 
-                cursor.execute("""
-                    UPDATE ref_regle 
-                    SET text_json = ?, 
-                        lib_nom = ?
-                    WHERE id_regle = ?
-                """, (json_data_str, rule_name, id_regle))
-                message = f'Rule {id_regle} updated successfully'
-            else:
-                # Insert new rule with specified ID
-                # Update the JSON with the correct ID
-                if isinstance(json_data, dict):
-                    json_data['id'] = id_regle
-                    json_data_str = json.dumps(json_data, ensure_ascii=False)
+                    cursor.execute("""
+                        UPDATE ref_regle 
+                        SET text_json = ?, 
+                            lib_nom = ?
+                        WHERE id_regle = ?
+                    """, (json_data_str, rule_name, id_regle))
+                    message = f'Rule {id_regle} updated successfully'
+                else:
+                    # Insert new rule with specified ID
+                    # Update the JSON with the correct ID
+                    if isinstance(json_data, dict):
+                        json_data['id'] = id_regle
+                        json_data_str = json.dumps(json_data, ensure_ascii=False)
                 
+                    cursor.execute("""
+                        INSERT INTO ref_regle (id_regle, lib_nom, est_modele, text_json)
+                        VALUES (?, ?, 0, ?)
+                    """, (id_regle, rule_name, json_data_str))
+                    message = f'Rule {id_regle} created successfully'
+            else:
+                # Insert new rule with auto-generated ID
                 cursor.execute("""
-                    INSERT INTO ref_regle (id_regle, lib_nom, est_modele, text_json)
-                    VALUES (?, ?, 0, ?)
-                """, (id_regle, rule_name, json_data_str))
-                message = f'Rule {id_regle} created successfully'
-        else:
-            # Insert new rule with auto-generated ID
-            cursor.execute("""
-                INSERT INTO ref_regle (lib_nom, est_modele, text_json)
-                VALUES (?, 0, ?)
-            """, (rule_name, json_data_str))
+                    INSERT INTO ref_regle (lib_nom, est_modele, text_json)
+                    VALUES (?, 0, ?)
+                """, (rule_name, json_data_str))
             
-            # Get the generated ID
-            cursor.execute("SELECT @@IDENTITY")
-            id_regle = cursor.fetchone()[0]
+                # Get the generated ID
+                cursor.execute("SELECT @@IDENTITY")
+                id_regle = cursor.fetchone()[0]
             
-            # Update the JSON with the generated ID
-            if isinstance(json_data, dict):
-                json_data['id'] = int(id_regle)
-                json_data_str = json.dumps(json_data, ensure_ascii=False)
+                # Update the JSON with the generated ID
+                if isinstance(json_data, dict):
+                    json_data['id'] = int(id_regle)
+                    json_data_str = json.dumps(json_data, ensure_ascii=False)
                 
-                # Update the record with the correct JSON
-                cursor.execute("""
-                    UPDATE ref_regle 
-                    SET text_json = ?
-                    WHERE id_regle = ?
-                """, (json_data_str, id_regle))
+                    # Update the record with the correct JSON
+                    cursor.execute("""
+                        UPDATE ref_regle 
+                        SET text_json = ?
+                        WHERE id_regle = ?
+                    """, (json_data_str, id_regle))
             
-            message = f'New rule created successfully with ID: {id_regle}'
+                message = f'New rule created successfully with ID: {id_regle}'
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
+        rule_cache.invalidate(int(id_regle))
         logger.info(f"Rule {id_regle} saved successfully")
         
         return jsonify({
@@ -401,32 +266,30 @@ def save_rule():
 def get_rule(rule_id):
     """Retrieve a specific rule by ID from ref_regle table"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("SELECT * FROM ref_regle WHERE id_regle = ?", (rule_id,))
-        row = cursor.fetchone()
+            cursor.execute("SELECT * FROM ref_regle WHERE id_regle = ?", (rule_id,))
+            row = cursor.fetchone()
         
-        if not row:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': 'Rule not found'}), 404
+            if not row:
+                cursor.close()
+                return jsonify({'error': 'Rule not found'}), 404
         
-        # Get column names
-        columns = [column[0] for column in cursor.description]
+            # Get column names
+            columns = [column[0] for column in cursor.description]
         
-        # Create rule dictionary
-        rule = dict(zip(columns, row))
+            # Create rule dictionary (sans la colonne rowversion, binaire)
+            rule = {column: value for column, value in zip(columns, row) if column != RULE_VERSION_COLUMN}
         
-        # Parse JSON data if it exists
-        if rule.get('text_json'):
-            try:
-                rule['json_data'] = json.loads(rule['text_json'])
-            except json.JSONDecodeError:
-                rule['json_data'] = rule['text_json']
+            # Parse JSON data if it exists
+            if rule.get('text_json'):
+                try:
+                    rule['json_data'] = json.loads(rule['text_json'])
+                except json.JSONDecodeError:
+                    rule['json_data'] = rule['text_json']
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
         return jsonify(rule), 200
         
@@ -437,50 +300,110 @@ def get_rule(rule_id):
             'details': str(e)
         }), 500
 
+def rules_version(cursor):
+    """Version marker of ref_regle: changes whenever a rule is added, edited, cleared or deleted.
+
+    Every INSERT/UPDATE bumps the rowversion column, so the latest one
+    (an index seek) and the row count cover all changes without reading
+    any text_json. None while migrate.py has not added that column.
+    """
+    if not has_column(cursor, 'ref_regle', RULE_VERSION_COLUMN):
+        return None
+    cursor.execute(f"SELECT COUNT(*), MAX({RULE_VERSION_COLUMN}) FROM ref_regle")
+    count, version = cursor.fetchone()
+    return f"{count}:{version.hex() if version is not None else ''}"
+
+def rule_columns(cursor):
+    """Column names of ref_regle, without reading any row (the rowversion column excluded)"""
+    cursor.execute("SELECT TOP 0 * FROM ref_regle")
+    cursor.fetchall()
+    return [column[0] for column in cursor.description if column[0] != RULE_VERSION_COLUMN]
+
 @app.route('/api/get-rules', methods=['GET'])
 def get_rules():
-    """Retrieve all rules from ref_regle table"""
+    """Retrieve rules from ref_regle table.
+
+    Query parameters: limit and after (keyset pagination on id_regle),
+    summary=1 (every column but text_json) and fields=a,b,c. Responses carry
+    an ETag, and If-None-Match answers 304 while no rule has changed.
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM ref_regle ORDER BY id_regle")
-        rows = cursor.fetchall()
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('after', type=int)
+        summary = request.args.get('summary', '0').lower() in ('1', 'true', 'yes')
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+        if limit is not None and limit <= 0:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        
+        with db_connection() as conn:
+            cursor = conn.cursor()
+        
+            # ETag : version des règles + paramètres de la requête (aucun sans colonne de version)
+            version = rules_version(cursor)
+            etag = hashlib.sha1(
+                f"{version}|{request.query_string.decode()}".encode("utf-8")
+            ).hexdigest() if version is not None else None
+            if etag is not None and request.if_none_match.contains(etag):
+                cursor.close()
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+        
+            columns = rule_columns(cursor)
+            if fields:
+                unknown = [f for f in fields if f not in columns]
+                if unknown:
+                    cursor.close()
+                    return jsonify({'error': f'Unknown fields: {unknown}', 'available_fields': columns}), 400
+                # id_regle est toujours renvoyé (clé de pagination)
+                selected = ['id_regle'] + [f for f in fields if f != 'id_regle']
+            else:
+                selected = list(columns)
+            if summary:
+                selected = [c for c in selected if c.lower() != 'text_json']
+        
+            query = "SELECT {top}{columns}{has_json} FROM ref_regle{where} ORDER BY id_regle".format(
+                top=f"TOP ({limit + 1}) " if limit is not None else "",
+                columns=", ".join(f"[{c}]" for c in selected),
+                has_json=", CASE WHEN text_json IS NULL THEN 0 ELSE 1 END" if summary else "",
+                where=" WHERE id_regle > ?" if after is not None else "",
+            )
+            cursor.execute(query, *([after] if after is not None else []))
+            rows = cursor.fetchall()
         
-        if not rows:
             cursor.close()
-            conn.close()
-            return jsonify({
-                'rules': [],
-                'count': 0
-            }), 200
         
-        # Get column names
-        columns = [column[0] for column in cursor.description]
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
         
         rules = []
         for row in rows:
-            rule = dict(zip(columns, row))
-            
+            rule = dict(zip(selected, row))
+        
+            if summary:
+                rule['has_json'] = bool(row[-1])
             # Parse JSON data if it exists
-            if rule.get('text_json'):
+            elif rule.get('text_json'):
                 try:
                     rule['json_data'] = json.loads(rule['text_json'])
                     rule['has_json'] = True
                 except json.JSONDecodeError:
                     rule['has_json'] = False
-            else:
+            elif 'text_json' in rule:
                 rule['has_json'] = False
-            
-            rules.append(rule)
         
-        cursor.close()
-        conn.close()
+            rules.append(rule)
         
-        return jsonify({
+        response = jsonify({
             'rules': rules,
-            'count': len(rules)
-        }), 200
+            'count': len(rules),
+            'has_more': has_more,
+            'next_after': rules[-1]['id_regle'] if has_more else None
+        })
+        if etag is not None:
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, 200
         
     except Exception as e:
         logger.error(f"Error retrieving rules: {str(e)}")
@@ -489,33 +412,90 @@ def get_rules():
             'details': str(e)
         }), 500
 
+def rule_job(rule_id, incremental=False, chunk_rows=None, profile=False):
+    """Build the function run by the job queue for an asynchronous execution"""
+    def run(progress):
+        with db_storage() as storage:
+            json_text = storage.get_rule_json(rule_id)
+            if not json_text:
+                return {'error': f'Rule with ID {rule_id} not found'}
+
+            plan = rule_cache.get_plan(rule_id, json_text)
+            result = execute_rule_logic(
+                storage, plan=plan, rule_id=rule_id, incremental=incremental, chunk_rows=chunk_rows,
+                progress=progress, profile=profile,
+            )
+            if "error" not in result:
+                storage.commit()
+
+        logger.info(f"Rule {rule_id} executed asynchronously")
+        return result
+    return run
+
+def chunk_rows_param(value):
+    """chunk_rows from a query string or JSON body: None when absent, else a positive int"""
+    if value is None or value == '':
+        return None
+    # Les booléens et flottants JSON sont refusés plutôt que tronqués
+    if not isinstance(value, (int, str)) or isinstance(value, bool):
+        raise ValueError('chunk_rows must be a positive integer')
+    try:
+        chunk_rows = int(value)
+    except ValueError:
+        raise ValueError('chunk_rows must be a positive integer') from None
+    if chunk_rows <= 0:
+        raise ValueError('chunk_rows must be a positive integer')
+    return chunk_rows
+
 @app.route('/api/execute-rule/<int:rule_id>', methods=['POST'])
 def execute_rule_by_id(rule_id):
-    """Execute a rule from ref_regle table by ID"""
+    """Execute a rule from ref_regle table by ID (?async=1 to queue it and return a job ID)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Get rule JSON from ref_regle
-        json_text = get_rule_json(cursor, rule_id)
-        if not json_text:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': f'Rule with ID {rule_id} not found'}), 404
-
-        json_data = json.loads(json_text)
-        
-        # Execute the rule logic
-        result = execute_rule_logic(cursor, json_data)
-        
-        if "error" in result:
-            cursor.close()
-            conn.close()
-            return jsonify(result), 500
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # ?incremental=1 to only process new data, ?chunk_rows=N to stream long
+        # histories in bounded memory
+        incremental = request.args.get('incremental', '').lower() in ('1', 'true', 'yes')
+        try:
+            chunk_rows = chunk_rows_param(request.args.get('chunk_rows'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # ?profile=1 adds per-block and per-phase timings to execution_details
+        profile = request.args.get('profile', '').lower() in ('1', 'true', 'yes')
+
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            # Seule une soumission aux mêmes options rejoint le job en cours
+            options = {'incremental': incremental, 'chunk_rows': chunk_rows, 'profile': profile}
+            job, coalesced = job_manager.submit(
+                rule_id, rule_job(rule_id, incremental, chunk_rows, profile), options,
+            )
+            return jsonify({
+                'success': True,
+                'message': f'Rule {rule_id} already queued or running with the same options' if coalesced
+                           else f'Rule {rule_id} queued for execution',
+                'job_id': job.job_id,
+                'coalesced': coalesced,
+                'status_url': f'/api/jobs/{job.job_id}',
+                'job': job.to_dict()
+            }), 202
+
+        with db_storage() as storage:
+            # Get rule JSON from ref_regle
+            json_text = storage.get_rule_json(rule_id)
+            if not json_text:
+                return jsonify({'error': f'Rule with ID {rule_id} not found'}), 404
+
+            # Compiled plans are cached by rule ID and JSON content hash
+            plan = rule_cache.get_plan(rule_id, json_text)
+        
+            # Execute the rule logic
+            result = execute_rule_logic(
+                storage, plan=plan, rule_id=rule_id, incremental=incremental, chunk_rows=chunk_rows,
+                profile=profile,
+            )
+        
+            if "error" in result:
+                return jsonify(result), 500
+        
+            storage.commit()
         
         logger.info(f"Rule {rule_id} executed successfully")
         
@@ -533,6 +513,76 @@ def execute_rule_by_id(rule_id):
             'details': str(e)
         }), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, progress, duration and result of an asynchronous execution"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return jsonify(job), 200
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """Recent asynchronous executions, newest first (optionally ?rule_id=N)"""
+    jobs = job_manager.list(rule_id=request.args.get('rule_id', type=int))
+    return jsonify({'jobs': jobs, 'count': len(jobs)}), 200
+
+@app.route('/api/execute-rules', methods=['POST'])
+def execute_rules_batch():
+    """Execute several rules, independent ones concurrently, in WriteVar -> ReadVar dependency order
+    ("fused": each dependency level evaluated as one merged graph)"""
+    try:
+        data = request.get_json() or {}
+        rule_ids = data.get('rule_ids')
+
+        if not rule_ids:
+            return jsonify({'error': 'rule_ids is required'}), 400
+
+        rule_ids = list(dict.fromkeys(int(rule_id) for rule_id in rule_ids))
+        workers = int(data.get('workers', BATCH_WORKERS))
+        try:
+            chunk_rows = chunk_rows_param(data.get('chunk_rows'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        plans = {}
+        with db_storage() as storage:
+            for rule_id in rule_ids:
+                json_text = storage.get_rule_json(rule_id)
+                if json_text:
+                    plans[rule_id] = rule_cache.get_plan(rule_id, json_text)
+
+        missing = [rule_id for rule_id in rule_ids if rule_id not in plans]
+        if missing:
+            return jsonify({'error': f'Rules not found: {missing}'}), 404
+
+        incremental = bool(data.get('incremental', False))
+        if data.get('fused'):
+            # Règles d'un même niveau évaluées comme un seul graphe : mode complet uniquement
+            if incremental or chunk_rows:
+                return jsonify({'error': 'fused cannot be combined with incremental or chunk_rows'}), 400
+            result = run_fused(plans, db_storage)
+        else:
+            result = run_batch(
+                plans,
+                db_storage,
+                workers=workers,
+                incremental=incremental,
+                chunk_rows=chunk_rows,
+                pushdown=RULE_PUSHDOWN,
+            )
+
+        logger.info(f"Batch of {len(rule_ids)} rules executed in {result['duration_ms']} ms")
+
+        return jsonify(result), 200 if result['success'] else 500
+
+    except Exception as e:
+        logger.error(f"Error executing rule batch: {str(e)}")
+        return jsonify({
+            'error': 'Failed to execute rules',
+            'details': str(e)
+        }), 500
+
 @app.route('/api/simulate-rule', methods=['POST'])
 def simulate_rule():
     """Simulate a rule from JSON data without saving to database"""
@@ -543,18 +593,29 @@ def simulate_rule():
             return jsonify({'error': 'json_data is required'}), 400
         
         json_data = data['json_data']
-        
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Execute the rule logic in simulation mode (no commits)
-        result = execute_rule_logic(cursor, json_data)
-        
-        cursor.close()
-        conn.close()
-        
-        if "error" in result:
-            return jsonify(result), 500
+        max_points = int(data.get('max_points', PREVIEW_POINTS))
+        method = data.get('downsampling', 'lttb')
+        if max_points < 2 or method not in DOWNSAMPLING_METHODS:
+            return jsonify({
+                'error': f'max_points must be >= 2 and downsampling one of {list(DOWNSAMPLING_METHODS)}'
+            }), 400
+        
+        # Aperçu sous-échantillonné de la sortie de chaque bloc, calculé au fil de l'évaluation
+        plan = compile_rule(json_data)
+        if not plan.variable_ids:
+            return jsonify({"error": "No ReadVar blocks found in the rule"}), 500
+        blocks = {}
+        def observe(block_id, series):
+            blocks[str(block_id)] = {
+                'class': plan.id_to_block[block_id]['class'],
+                **series_preview(series, max_points, method),
+            }
+        
+        with db_storage() as storage:
+            # Dry run: lectures seules, ni écriture ni qualification
+            result = simulate_plan(storage, plan, observer=observe)
+        
+        result['blocks'] = blocks
         
         logger.info("Rule simulation completed successfully")
         
@@ -571,33 +632,72 @@ def simulate_rule():
             'details': str(e)
         }), 500
 
+@app.route('/api/explain-rule', methods=['POST'])
+@app.route('/api/explain-rule/<int:rule_id>', methods=['GET'])
+def explain_rule(rule_id=None):
+    """Evaluation order and cost estimates of a rule (by ID, or inline json_data / rule_id in the body)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        if rule_id is None:
+            rule_id = data.get('rule_id')
+        json_data = data.get('json_data')
+        
+        if rule_id is None and not json_data:
+            return jsonify({'error': 'rule_id or json_data is required'}), 400
+        
+        with db_storage() as storage:
+            if json_data:
+                plan = compile_rule(json_data)
+                if RULE_OPTIMIZE:
+                    plan = optimize_plan(plan)
+            else:
+                json_text = storage.get_rule_json(int(rule_id))
+                if not json_text:
+                    return jsonify({'error': f'Rule with ID {rule_id} not found'}), 404
+                plan = rule_cache.get_plan(int(rule_id), json_text)
+        
+            # Seules des requêtes COUNT/MIN/MAX sont exécutées, aucun historique n'est chargé
+            explanation = explain_plan(storage, plan)
+        
+        return jsonify({
+            'success': True,
+            'rule_id': rule_id,
+            'explain': explanation
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error explaining rule: {str(e)}")
+        return jsonify({
+            'error': 'Failed to explain rule',
+            'details': str(e)
+        }), 500
+
 @app.route('/api/delete-rule/<int:rule_id>', methods=['DELETE'])
 def delete_rule(rule_id):
     """Delete a rule from ref_regle table (only clears text_JSON)"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Check if rule exists
-        cursor.execute("SELECT COUNT(*) FROM ref_regle WHERE id_regle = ?", (rule_id,))
-        exists = cursor.fetchone()[0] > 0
+            # Check if rule exists
+            cursor.execute("SELECT COUNT(*) FROM ref_regle WHERE id_regle = ?", (rule_id,))
+            exists = cursor.fetchone()[0] > 0
         
-        if not exists:
-            cursor.close()
-            conn.close()
-            return jsonify({'error': f'Rule with ID {rule_id} not found'}), 404
+            if not exists:
+                cursor.close()
+                return jsonify({'error': f'Rule with ID {rule_id} not found'}), 404
         
-        # Clear the JSON data (or delete the entire row if needed)
-        cursor.execute("""
-            UPDATE ref_regle 
-            SET text_json = NULL
-            WHERE id_regle = ?
-        """, (rule_id,))
+            # Clear the JSON data (or delete the entire row if needed)
+            cursor.execute("""
+                UPDATE ref_regle 
+                SET text_json = NULL
+                WHERE id_regle = ?
+            """, (rule_id,))
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
+        rule_cache.invalidate(rule_id)
         logger.info(f"Rule {rule_id} JSON data cleared successfully")
         
         return jsonify({
@@ -617,16 +717,16 @@ def delete_rule(rule_id):
 def health_check():
     """Health check endpoint"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
         
         return jsonify({
             'status': 'healthy',
             'database': 'connected',
+            'pool': connection_pool.stats(),
             'timestamp': datetime.now().isoformat()
         }), 200
         
@@ -634,9 +734,39 @@ def health_check():
         return jsonify({
             'status': 'unhealthy',
             'error': str(e),
+            'pool': connection_pool.stats(),
             'timestamp': datetime.now().isoformat()
         }), 503
 
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Compiled rule and history cache statistics (hits, misses, evictions, bytes)"""
+    return jsonify({'rules': rule_cache.stats(), 'histories': history_cache.stats()}), 200
+
+@app.route('/api/pool-stats', methods=['GET'])
+def pool_stats():
+    """Connection pool statistics (in use, idle, wait times)"""
+    return jsonify(connection_pool.stats()), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition: request latencies, rule profiles, pool and cache gauges"""
+    pool = connection_pool.stats()
+    cache = rule_cache.stats()
+    histories = history_cache.stats()
+    gauges = {
+        'db_pool_connections_in_use': pool['in_use'],
+        'db_pool_connections_idle': pool['idle'],
+        'db_pool_checkout_timeouts': pool['timeouts'],
+        'rule_cache_entries': cache['size'],
+        'rule_cache_hits': cache['hits'],
+        'rule_cache_misses': cache['misses'],
+        'history_cache_bytes': histories['bytes'],
+        'history_cache_hits': histories['hits'],
+        'history_cache_misses': histories['misses'],
+    }
+    return app.response_class(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     logger.info("Starting Flask API - Direct ref_regle integration")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
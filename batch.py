@@ -0,0 +1,289 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from collections import defaultdict
+import logging
+import time
+
+import numpy as np
+
+from database import WRITE_BATCH_SIZE
+from engine import ExecutionContext, count_dates, execute_plan, run_plan
+from interpolation import build_timeline, interpolate
+from optimizer import merge_plans
+from series import Series
+
+logger = logging.getLogger(__name__)
+
+
+def written_variables(plan):
+    return {plan.id_to_block[bid]["parameters"]["Id"] for bid in plan.end_block_ids}
+
+
+def rule_dependencies(plans):
+    """{rule_id: set of rule_ids it depends on}: a rule reading a variable
+    written by another rule of the batch runs after it"""
+    writers = defaultdict(set)
+    for rule_id, plan in plans.items():
+        for var_id in written_variables(plan):
+            writers[var_id].add(rule_id)
+
+    dependencies = {}
+    for rule_id, plan in plans.items():
+        dependencies[rule_id] = {
+            writer
+            for var_id in set(plan.variable_ids)
+            for writer in writers.get(var_id, ())
+            if writer != rule_id
+        }
+    return dependencies
+
+
+def execution_levels(dependencies):
+    """Group rules into levels that can run concurrently; raises on cyclic dependencies"""
+    remaining = {rule_id: set(deps) for rule_id, deps in dependencies.items()}
+    levels = []
+    while remaining:
+        level = sorted(rule_id for rule_id, deps in remaining.items() if not deps)
+        if not level:
+            raise ValueError(f"Dépendance circulaire entre les règles {sorted(remaining)}")
+        levels.append(level)
+        for rule_id in level:
+            del remaining[rule_id]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
+
+
+def rule_conflicts(plans, levels):
+    """{rule_id: set of rule_ids it waits for}: rules reading or writing the same
+    variable would race on its qualification and staging writes, so they run
+    one after the other, in the order of `levels` (rule ID within a level)"""
+    rank = {rule_id: i for i, rule_id in enumerate(r for level in levels for r in level)}
+    users = defaultdict(set)
+    for rule_id, plan in plans.items():
+        for var_id in set(plan.variable_ids) | written_variables(plan):
+            users[var_id].add(rule_id)
+
+    conflicts = {rule_id: set() for rule_id in plans}
+    for rule_ids in users.values():
+        ordered = sorted(rule_ids, key=rank.get)
+        for previous, rule_id in zip(ordered, ordered[1:]):
+            conflicts[rule_id].add(previous)
+    return conflicts
+
+
+def _run_one(rule_id, plan, open_storage, options):
+    started = time.perf_counter()
+    try:
+        with open_storage() as storage:
+            result = execute_plan(storage, plan, rule_id=rule_id, **options)
+            storage.commit()
+        status = "success"
+    except Exception as e:
+        logger.error(f"Error executing rule {rule_id} in batch: {str(e)}")
+        result = {"error": str(e)}
+        status = "failed"
+    return {
+        "rule_id": rule_id,
+        "status": status,
+        "duration_ms": round(1000 * (time.perf_counter() - started), 3),
+        "result": result,
+    }
+
+
+def run_batch(plans, open_storage, workers=4, incremental=False, chunk_rows=None, pushdown=True):
+    """Execute many compiled rules, each on its own storage and transaction.
+
+    `plans` maps rule IDs to RulePlans and `open_storage` is a callable
+    returning a context manager that yields a Storage. A rule starts
+    as soon as every rule it depends on has succeeded and the rules sharing
+    a variable with it (rule_conflicts) have finished, with at most `workers`
+    rules running at once; dependents of a failed rule are skipped.
+    """
+    dependencies = rule_dependencies(plans)
+    conflicts = rule_conflicts(plans, execution_levels(dependencies))
+    # Les niveaux tiennent compte des règles qui partagent une variable
+    levels = execution_levels({rule_id: dependencies[rule_id] | conflicts[rule_id] for rule_id in plans})
+    options = {"incremental": incremental, "chunk_rows": chunk_rows, "pushdown": pushdown}
+
+    started = time.perf_counter()
+    results = {}
+    pending = {rule_id: dependencies[rule_id] | conflicts[rule_id] for rule_id in plans}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending or running:
+            for rule_id in sorted(rule_id for rule_id, deps in pending.items() if not deps):
+                del pending[rule_id]
+                future = executor.submit(_run_one, rule_id, plans[rule_id], open_storage, options)
+                running[future] = rule_id
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                rule_id = running.pop(future)
+                results[rule_id] = future.result()
+                failed = results[rule_id]["status"] != "success"
+
+                # Les règles dépendantes d'une règle en échec ne sont pas exécutées
+                finished = [rule_id]
+                blocked = [rule_id] if failed else []
+                while blocked:
+                    failed_id = blocked.pop()
+                    for other_id in [r for r in pending if failed_id in dependencies[r]]:
+                        del pending[other_id]
+                        results[other_id] = {
+                            "rule_id": other_id,
+                            "status": "skipped",
+                            "duration_ms": 0.0,
+                            "result": {"error": f"Dependency rule {failed_id} did not succeed"},
+                        }
+                        blocked.append(other_id)
+                        finished.append(other_id)
+                for deps in pending.values():
+                    deps.difference_update(finished)
+
+    return {
+        "success": all(r["status"] == "success" for r in results.values()),
+        "duration_ms": round(1000 * (time.perf_counter() - started), 3),
+        "workers": workers,
+        "levels": levels,
+        "dependencies": {rule_id: sorted(deps) for rule_id, deps in dependencies.items()},
+        "conflicts": {rule_id: sorted(waits) for rule_id, waits in conflicts.items()},
+        "rules": [results[rule_id] for level in levels for rule_id in level],
+    }
+
+
+def execute_fused(storage, plans, write_batch_size=WRITE_BATCH_SIZE):
+    """Full run of several compiled rules as one merged graph.
+
+    The variables of every rule are loaded in one pass and interpolated
+    once per distinct rule timeline, identical blocks are evaluated once
+    (optimizer.merge_plans), the WriteVar outputs are flushed in a single
+    write and the rows read qualified together. Returns ({rule_id: result},
+    summary of the merged run).
+    """
+    merged, mapping = merge_plans(plans)
+    variable_ids = list(dict.fromkeys(var_id for rule_id in sorted(plans) for var_id in plans[rule_id].variable_ids))
+    histories = storage.load_histories(variable_ids)
+
+    # Une timeline par ensemble de variables lues, une colonne par ReadVar fusionné
+    timelines = {}
+    columns = {}
+    dates = {}
+    for rule_id in sorted(plans):
+        plan = plans[rule_id]
+        key = tuple(sorted(set(plan.timeline_variable_ids)))
+        if key not in timelines:
+            timelines[key] = build_timeline([histories[var_id][0] for var_id in key])
+        timeline = timelines[key]
+
+        rule_columns = []
+        for bid, var_id, (method, max_gap) in zip(plan.read_block_ids, plan.variable_ids, plan.interpolation_specs):
+            merged_bid = mapping.get((rule_id, bid))
+            if merged_bid in columns:
+                column = columns[merged_bid]
+            elif bid in plan.own_timeline_block_ids:
+                column = Series(*histories[var_id])
+            else:
+                column = Series(timeline, *interpolate(*histories[var_id], timeline, method, max_gap))
+            if merged_bid is not None:
+                columns[merged_bid] = column
+            rule_columns.append(column)
+        dates[rule_id] = count_dates(plan, timeline, rule_columns)
+
+    context = ExecutionContext(
+        storage, np.empty(0, dtype=np.int64), [columns[bid] for bid in merged.read_block_ids],
+        merged.read_block_ids, write_batch_size, dry_run=True,
+    )
+    outputs = run_plan(merged, context)
+
+    rows_written = storage.write_many(
+        [(merged.id_to_block[bid]["parameters"]["Id"], outputs[bid]) for bid in merged.end_block_ids],
+        write_batch_size,
+    )
+    qualified_rows = storage.qualify_histories(histories)
+
+    results = {}
+    for rule_id, plan in plans.items():
+        results[rule_id] = {
+            "success": True,
+            "mode": "fused",
+            "processed_dates": dates[rule_id],
+            "output_values": sum(len(outputs[mapping[(rule_id, bid)]]) for bid in plan.end_block_ids),
+            "variable_ids_processed": plan.variable_ids,
+        }
+    summary = {
+        "rules": sorted(plans),
+        "variables": len(variable_ids),
+        "rows_read": sum(len(timestamps) for timestamps, _ in histories.values()),
+        "blocks": sum(len(plan.order) for plan in plans.values()),
+        "evaluated_blocks": len(merged.order),
+        "rows_written": rows_written,
+        "qualified_rows": qualified_rows,
+    }
+    return results, summary
+
+
+def run_fused(plans, open_storage, write_batch_size=WRITE_BATCH_SIZE):
+    """Execute many compiled rules (full mode) as one merged graph per dependency level.
+
+    Levels run in order on a single storage, each in its own transaction
+    (execute_fused), so a rule sees what the rules it depends on wrote. A
+    failure rolls the whole level back and the rules depending on it are
+    skipped; the result has the shape of run_batch's plus a summary per level.
+    """
+    dependencies = rule_dependencies(plans)
+    levels = execution_levels(dependencies)
+
+    started = time.perf_counter()
+    results = {}
+    summaries = []
+    failed = set()
+    with open_storage() as storage:
+        for level in levels:
+            runnable = []
+            for rule_id in level:
+                blocking = sorted(dependencies[rule_id] & failed)
+                if blocking:
+                    failed.add(rule_id)
+                    results[rule_id] = {
+                        "rule_id": rule_id,
+                        "status": "skipped",
+                        "duration_ms": 0.0,
+                        "result": {"error": f"Dependency rule {blocking[0]} did not succeed"},
+                    }
+                else:
+                    runnable.append(rule_id)
+            if not runnable:
+                continue
+
+            level_started = time.perf_counter()
+            try:
+                rule_results, summary = execute_fused(storage, {r: plans[r] for r in runnable}, write_batch_size)
+                storage.commit()
+                status = "success"
+                summaries.append(summary)
+            except Exception as e:
+                storage.rollback()
+                logger.error(f"Error executing fused rules {runnable}: {str(e)}")
+                rule_results = {rule_id: {"error": str(e)} for rule_id in runnable}
+                status = "failed"
+                failed.update(runnable)
+
+            duration_ms = round(1000 * (time.perf_counter() - level_started), 3)
+            for rule_id in runnable:
+                results[rule_id] = {
+                    "rule_id": rule_id,
+                    "status": status,
+                    "duration_ms": duration_ms,
+                    "result": rule_results[rule_id],
+                }
+
+    return {
+        "success": all(r["status"] == "success" for r in results.values()),
+        "mode": "fused",
+        "duration_ms": round(1000 * (time.perf_counter() - started), 3),
+        "levels": levels,
+        "dependencies": {rule_id: sorted(deps) for rule_id, deps in dependencies.items()},
+        "fused_levels": summaries,
+        "rules": [results[rule_id] for level in levels for rule_id in level],
+    }
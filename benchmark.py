@@ -0,0 +1,258 @@
+import argparse
+from datetime import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from engine import ExecutionContext, compile_rule, fill_columns, run_plan
+from optimizer import optimize_plan
+from series import to_epoch_us
+from storage import SqliteStorage
+
+MINUTE_US = 60 * 1_000_000
+PHASES = ("load", "interpolation", "evaluation", "write", "qualification")
+
+
+def synthetic_histories(variables=10, years=1.0, sampling_minutes=(1, 5, 15), gap_ratio=0.01,
+                        jitter=0.1, null_ratio=0.0, start=datetime(2024, 1, 1), seed=0):
+    """Random-walk histories {var_id: (timestamps, values)} for variables 1..`variables`.
+
+    Variable i is sampled every sampling_minutes[i % len] minutes, each date
+    shifted by up to ±jitter/2 of the step. About `gap_ratio` of the samples
+    are removed as contiguous holes and `null_ratio` are stored as NULL.
+    """
+    rng = np.random.default_rng(seed)
+    origin = int(to_epoch_us([start])[0])
+    histories = {}
+    for var_id in range(1, variables + 1):
+        step = int(sampling_minutes[(var_id - 1) % len(sampling_minutes)] * MINUTE_US)
+        count = int(years * 365 * 24 * 60 * MINUTE_US // step)
+        timestamps = origin + np.arange(count, dtype=np.int64) * step
+        if jitter:
+            timestamps += (rng.uniform(-0.5, 0.5, count) * jitter * step).astype(np.int64)
+        values = 50.0 + np.cumsum(rng.normal(0.0, 1.0, count))
+
+        # Trous contigus de longueur moyenne 30 échantillons
+        keep = np.ones(count, dtype=bool)
+        holes = int(count * gap_ratio / 30)
+        if holes:
+            starts = rng.integers(0, count, holes)
+            lengths = rng.geometric(1 / 30, holes)
+            edges = np.zeros(count + 1, dtype=np.int64)
+            np.add.at(edges, starts, 1)
+            np.add.at(edges, np.minimum(starts + lengths, count), -1)
+            keep = np.cumsum(edges[:-1]) == 0
+        if null_ratio:
+            values[rng.random(count) < null_ratio] = np.nan
+        histories[var_id] = (timestamps[keep], values[keep])
+    return histories
+
+
+def synthetic_rule(variable_ids, arithmetic_blocks=4, periodic_blocks=2, output_start=1000, seed=0):
+    """Rule JSON in the editor format (see tets.json): one ReadVar per variable,
+    random binary arithmetic blocks, PeriodicCalc blocks and their WriteVars"""
+    rng = np.random.default_rng(seed)
+    blocks, links = [], []
+
+    def add(cls, parameters, parents=()):
+        blocks.append({"class": cls, "center": [150 * len(blocks), 0], "parameters": parameters})
+        block_id = len(blocks)
+        for position, parent in enumerate(parents, start=1):
+            links.append({"parent": parent, "output": 1, "child": block_id, "input": position})
+        return block_id
+
+    sources = [add("ReadVar", {"Id": var_id, "Name": f"Variable {var_id}"}) for var_id in variable_ids]
+    computed = []
+    for _ in range(arithmetic_blocks):
+        candidates = sources + computed
+        parents = [int(p) for p in rng.choice(candidates, size=2, replace=len(candidates) < 2)]
+        computed.append(add(str(rng.choice(["+", "-", "*", "/"])), {}, parents))
+
+    outputs = []
+    operations = ["moyenne", "somme", "maximum", "minimum", "mediane", "moyenne_ponderee"]
+    for _ in range(periodic_blocks):
+        parent = int(rng.choice(computed or sources))
+        outputs.append(add("PeriodicCalc", {
+            "operation": str(rng.choice(operations)),
+            "period": int(rng.choice([15, 60, 1440])),
+            "validity_rate": 50,
+        }, [parent]))
+    if computed:
+        outputs.append(computed[-1])
+
+    for index, parent in enumerate(outputs):
+        var_id = output_start + index
+        add("WriteVar", {"Id": var_id, "Name": f"Variable {var_id}"}, [parent])
+    return {"id": -1, "name": "benchmark", "description": "", "blocks": blocks, "links": links}
+
+
+def seeded_storage(histories, rule):
+    """In-memory SQLite database holding the histories (unqualified) and the rule as id 1"""
+    storage = SqliteStorage()
+    for var_id, (timestamps, values) in histories.items():
+        storage.insert_history(var_id, timestamps, values)
+    storage.save_rule(json.dumps(rule), "benchmark", rule_id=1)
+    storage.commit()
+    return storage
+
+
+def run_phases(storage, plan, measure_memory=False):
+    """Run one full execution phase by phase; returns {phase: (seconds, peak bytes, volume)}"""
+    results = {}
+
+    def measure(phase, volume_of, step):
+        if measure_memory:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        value = step()
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - current if measure_memory else None
+        results[phase] = (seconds, peak, volume_of(value))
+        return value
+
+    histories = measure(
+        "load", lambda h: sum(len(ts) for ts, _ in h.values()),
+        lambda: storage.load_histories(plan.variable_ids),
+    )
+    timeline, columns = measure(
+        "interpolation", lambda r: len(r[0]) * len(r[1]),
+        lambda: fill_columns(plan, histories),
+    )
+    context = ExecutionContext(storage, timeline, columns, plan.read_block_ids, dry_run=True)
+    outputs = measure(
+        "evaluation", lambda _: len(timeline) * len(plan.order),
+        lambda: run_plan(plan, context),
+    )
+    measure(
+        "write", lambda rows: rows,
+        lambda: sum(
+            storage.write_series(plan.id_to_block[bid]["parameters"]["Id"], outputs[bid])
+            for bid in plan.end_block_ids
+        ),
+    )
+    measure("qualification", lambda rows: rows, lambda: storage.qualify_histories(histories))
+    storage.commit()
+    return results
+
+
+def run_benchmark(histories, rule, repeat=3, measure_memory=True, optimize=False):
+    """Best time of `repeat` runs per phase (each on a fresh database) and, in an
+    extra traced run, the peak memory allocated by each phase"""
+    plan = compile_rule(rule)
+    if optimize:
+        plan = optimize_plan(plan)
+    runs = []
+    for _ in range(repeat):
+        storage = seeded_storage(histories, rule)
+        runs.append(run_phases(storage, plan))
+        storage.close()
+
+    peaks = {}
+    if measure_memory:
+        storage = seeded_storage(histories, rule)
+        tracemalloc.start()
+        try:
+            peaks = {phase: peak for phase, (_, peak, _) in run_phases(storage, plan, True).items()}
+        finally:
+            tracemalloc.stop()
+            storage.close()
+
+    phases = {}
+    for phase in PHASES:
+        seconds = min(run[phase][0] for run in runs)
+        volume = runs[0][phase][2]
+        phases[phase] = {
+            "seconds": round(seconds, 6),
+            "volume": volume,
+            "throughput_per_s": round(volume / seconds, 1) if seconds else None,
+            "peak_memory_mb": round(peaks[phase] / 2 ** 20, 3) if phase in peaks else None,
+        }
+    return {
+        "rows": sum(len(ts) for ts, _ in histories.values()),
+        "variables": len(histories),
+        "blocks": len(plan.order),
+        "total_seconds": round(sum(p["seconds"] for p in phases.values()), 6),
+        "phases": phases,
+    }
+
+
+def regressions(result, baseline, tolerance=0.2):
+    """Phases slower, or using more memory, than the baseline by more than `tolerance`"""
+    found = []
+    for phase, current in result["phases"].items():
+        previous = baseline["phases"].get(phase)
+        if not previous:
+            continue
+        for metric in ("seconds", "peak_memory_mb"):
+            if current.get(metric) is None or not previous.get(metric):
+                continue
+            if current[metric] > previous[metric] * (1 + tolerance):
+                found.append(f"{phase}.{metric}: {previous[metric]} -> {current[metric]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesurer les performances du moteur sur des données synthétiques")
+    parser.add_argument("--variables", type=int, default=10, help="Nombre de variables lues")
+    parser.add_argument("--years", type=float, default=0.25, help="Profondeur d'historique en années")
+    parser.add_argument("--sampling", default="1,5,15", help="Pas d'échantillonnage en minutes (par variable)")
+    parser.add_argument("--gap-ratio", type=float, default=0.01, help="Part d'échantillons manquants")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Décalage aléatoire des dates (part du pas)")
+    parser.add_argument("--null-ratio", type=float, default=0.0, help="Part de valeurs NULL")
+    parser.add_argument("--arithmetic-blocks", type=int, default=4, help="Blocs arithmétiques de la règle")
+    parser.add_argument("--periodic-blocks", type=int, default=2, help="Blocs PeriodicCalc de la règle")
+    parser.add_argument("--rule", default=None, help="Fichier JSON de règle lisant les variables 1..N (ex. tets.json)")
+    parser.add_argument("--repeat", type=int, default=3, help="Exécutions chronométrées (meilleur temps retenu)")
+    parser.add_argument("--no-memory", action="store_true", help="Ne pas mesurer le pic mémoire")
+    parser.add_argument("--optimize", action="store_true", help="Optimiser le graphe de la règle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Fichier JSON de résultats")
+    parser.add_argument("--baseline", default=None, help="Résultats de référence à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Dégradation tolérée (0.2 = 20 %%)")
+    args = parser.parse_args()
+
+    sampling = tuple(float(step) for step in args.sampling.split(","))
+    histories = synthetic_histories(
+        args.variables, args.years, sampling, args.gap_ratio, args.jitter, args.null_ratio, seed=args.seed,
+    )
+    if args.rule:
+        with open(args.rule, encoding="utf-8") as f:
+            rule = json.load(f)
+    else:
+        rule = synthetic_rule(
+            list(histories), args.arithmetic_blocks, args.periodic_blocks, seed=args.seed,
+        )
+
+    result = run_benchmark(
+        histories, rule, repeat=max(1, args.repeat), measure_memory=not args.no_memory, optimize=args.optimize,
+    )
+    result["parameters"] = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    result["environment"] = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+    }
+
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    print(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for line in found:
+            print(f"Régression : {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
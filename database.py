@@ -1,6 +1,13 @@
-import pyodbc
+from collections import defaultdict
+
+import numpy as np
+from aggregation import SQL_AGGREGATES
+from interpolation import fill_missing
+from series import from_epoch_us, to_epoch_us, to_float_array
 
 def get_connection():
+    # pyodbc n'est requis que pour SQL Server (le moteur tourne aussi sur SQLite)
+    import pyodbc
     return pyodbc.connect(
         'DRIVER={ODBC Driver 17 for SQL Server};'
         'SERVER=DESKTOP-FOIB0OT;'
@@ -13,49 +20,491 @@ def get_rule_json(cursor, id_rule):
     row = cursor.fetchone()
     return row[0] if row else None
 
-def interpolate_missing_values(cursor, variable_ids):
-    dates_by_var = {}
-    all_dates = set()
-    values_by_var = {}
+# SQL Server limite une requête à 2100 paramètres
+IN_LIST_CHUNK_SIZE = 1000
+FETCH_SIZE = 10000
 
-    for var_id in variable_ids:
-        cursor.execute("""
-            SELECT date_acquisition, val_valide
+# Version de ligne de his_valeur : incrémentée à chaque insertion ou changement de valeur
+HISTORY_VERSION_COLUMN = "version_ligne"
+
+def _group_rows(batches, histories):
+    """Group batches of rows ordered by (id_variable, date_acquisition) into per-variable arrays"""
+    current_id, dates, values = None, [], []
+    for rows in batches:
+        for var_id, date, value in rows:
+            if var_id != current_id:
+                if current_id is not None:
+                    histories[current_id] = (to_epoch_us(dates), to_float_array(values))
+                current_id, dates, values = var_id, [], []
+            dates.append(date)
+            values.append(value)
+    if current_id is not None:
+        histories[current_id] = (to_epoch_us(dates), to_float_array(values))
+
+def _fetch_batches(cursor, fetch_size):
+    return iter(lambda: cursor.fetchmany(fetch_size), [])
+
+def _record_versions(batches, versions):
+    """Batches of (id_variable, date, value, version) rows without their version, the
+    highest version of each variable being recorded in `versions`"""
+    for rows in batches:
+        for var_id, _, _, version in rows:
+            if versions.get(var_id) is None or version > versions[var_id]:
+                versions[var_id] = version
+        yield [row[:3] for row in rows]
+
+def load_histories(cursor, variable_ids, since=None, with_version=False,
+                   chunk_size=IN_LIST_CHUNK_SIZE, fetch_size=FETCH_SIZE):
+    """Load the history of every variable with one query per chunk of ids.
+
+    By default only unqualified rows are read; with `since` (datetime) every
+    row acquired at or after that date is read, whatever its qualification.
+    Rows are streamed with fetchmany in (id_variable, date_acquisition) order and
+    returned as {var_id: (timestamps, values)} numpy arrays. With `with_version`,
+    returns (histories, {var_id: highest version_ligne read, None without rows}).
+    """
+    unique_ids = list(dict.fromkeys(variable_ids))
+    histories = {}
+    versions = dict.fromkeys(unique_ids)
+    version = f", {HISTORY_VERSION_COLUMN}" if with_version else ""
+
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        if since is None:
+            condition, params = "id_qualification = 0", chunk
+        else:
+            condition, params = "date_acquisition >= ?", chunk + [since]
+        cursor.execute(f"""
+            SELECT id_variable, date_acquisition, val_valide{version}
+            FROM his_valeur
+            WHERE id_variable IN ({placeholders}) AND {condition}
+            ORDER BY id_variable, date_acquisition
+        """, params)
+        batches = _fetch_batches(cursor, fetch_size)
+        _group_rows(_record_versions(batches, versions) if with_version else batches, histories)
+
+    for var_id in unique_ids:
+        if var_id not in histories:
+            histories[var_id] = (to_epoch_us([]), to_float_array([]))
+    return (histories, versions) if with_version else histories
+
+CHUNK_ROWS = 100000
+
+def load_history_chunk(cursor, variable_ids, after=None, chunk_rows=CHUNK_ROWS):
+    """Next time-ordered chunk of unqualified rows acquired after `after`.
+
+    Uses TOP (n) WITH TIES so that a chunk never splits a timestamp. Returns
+    (histories, last date read or None, True when the history is exhausted).
+    """
+    unique_ids = list(dict.fromkeys(variable_ids))
+    if len(unique_ids) > IN_LIST_CHUNK_SIZE:
+        raise ValueError(f"Chunked execution supports at most {IN_LIST_CHUNK_SIZE} variables")
+
+    placeholders = ", ".join("?" for _ in unique_ids)
+    if after is None:
+        condition, params = "", list(unique_ids)
+    else:
+        condition, params = "AND date_acquisition > ?", list(unique_ids) + [after]
+    cursor.execute(f"""
+        SELECT TOP ({int(chunk_rows)}) WITH TIES id_variable, date_acquisition, val_valide
+        FROM his_valeur
+        WHERE id_variable IN ({placeholders}) AND id_qualification = 0 {condition}
+        ORDER BY date_acquisition
+    """, params)
+    rows = cursor.fetchall()
+    last_date = rows[-1][1] if rows else None
+
+    # Regrouper par variable (le morceau est borné, le tri en mémoire reste léger)
+    histories = {}
+    rows.sort(key=lambda row: (row[0], row[1]))
+    _group_rows([rows], histories)
+    for var_id in unique_ids:
+        if var_id not in histories:
+            histories[var_id] = (to_epoch_us([]), to_float_array([]))
+    return histories, last_date, len(rows) < chunk_rows
+
+def load_last_values(cursor, variable_ids, before, inclusive=False, chunk_size=IN_LIST_CHUNK_SIZE):
+    """Last non-null sample of each variable before `before` (or at it when `inclusive`),
+    as load_histories arrays"""
+    unique_ids = list(dict.fromkeys(variable_ids))
+    operator = "<=" if inclusive else "<"
+    histories = {}
+
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor.execute(f"""
+            SELECT id_variable, date_acquisition, val_valide
+            FROM (
+                SELECT id_variable, date_acquisition, val_valide,
+                       ROW_NUMBER() OVER (PARTITION BY id_variable ORDER BY date_acquisition DESC) AS rang
+                FROM his_valeur
+                WHERE id_variable IN ({placeholders})
+                  AND date_acquisition {operator} ? AND val_valide IS NOT NULL
+            ) t
+            WHERE rang = 1
+            ORDER BY id_variable
+        """, chunk + [before])
+        _group_rows(_fetch_batches(cursor, FETCH_SIZE), histories)
+
+    for var_id in unique_ids:
+        if var_id not in histories:
+            histories[var_id] = (to_epoch_us([]), to_float_array([]))
+    return histories
+
+def load_next_values(cursor, variable_ids, after, chunk_size=IN_LIST_CHUNK_SIZE):
+    """First non-null unqualified sample of each variable after `after`, as
+    load_histories arrays (empty when there is none)"""
+    unique_ids = list(dict.fromkeys(variable_ids))
+    histories = {}
+
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor.execute(f"""
+            SELECT id_variable, date_acquisition, val_valide
+            FROM (
+                SELECT id_variable, date_acquisition, val_valide,
+                       ROW_NUMBER() OVER (PARTITION BY id_variable ORDER BY date_acquisition) AS rang
+                FROM his_valeur
+                WHERE id_variable IN ({placeholders})
+                  AND date_acquisition > ? AND id_qualification = 0 AND val_valide IS NOT NULL
+            ) t
+            WHERE rang = 1
+            ORDER BY id_variable
+        """, chunk + [after])
+        _group_rows(_fetch_batches(cursor, FETCH_SIZE), histories)
+
+    for var_id in unique_ids:
+        if var_id not in histories:
+            histories[var_id] = (to_epoch_us([]), to_float_array([]))
+    return histories
+
+def ensure_history_version_column(cursor):
+    """Add version_ligne to his_valeur if it does not exist yet: a BIGINT drawn from a
+    sequence on insert and, through a trigger, on every change of value, so that
+    qualifying rows leaves it alone. Schema change run by migrate.py (it rewrites
+    the table), never while serving a request.
+    """
+    cursor.execute("""
+        IF OBJECT_ID('seq_his_valeur_version') IS NULL
+            CREATE SEQUENCE seq_his_valeur_version AS BIGINT START WITH 1
+    """)
+    cursor.execute(f"""
+        IF COL_LENGTH('his_valeur', '{HISTORY_VERSION_COLUMN}') IS NULL
+            ALTER TABLE his_valeur ADD {HISTORY_VERSION_COLUMN} BIGINT NOT NULL
+                CONSTRAINT df_his_valeur_version DEFAULT (NEXT VALUE FOR seq_his_valeur_version)
+    """)
+    # CREATE TRIGGER doit être seul dans son lot : passé par EXEC
+    cursor.execute(f"""
+        IF OBJECT_ID('tr_his_valeur_version') IS NULL
+            EXEC('CREATE TRIGGER tr_his_valeur_version ON his_valeur AFTER UPDATE AS
+            BEGIN
+                SET NOCOUNT ON;
+                IF UPDATE(val_valide) OR UPDATE(val_brute)
+                    UPDATE h SET {HISTORY_VERSION_COLUMN} = NEXT VALUE FOR seq_his_valeur_version
+                    FROM his_valeur h
+                    JOIN inserted i ON i.id_variable = h.id_variable AND i.date_acquisition = h.date_acquisition;
+            END')
+    """)
+
+def load_history_stats(cursor, variable_ids, since=None, with_version=False, chunk_size=IN_LIST_CHUNK_SIZE):
+    """{var_id: (row count, first date, last date)} of the rows load_histories would
+    return (unqualified, or acquired at or after `since`), without reading them.
+
+    With `with_version`, the tuples end with the highest version_ligne of these
+    rows, which grows whenever one of them is inserted or its value changes.
+    """
+    unique_ids = list(dict.fromkeys(variable_ids))
+    stats = {var_id: (0, None, None) + ((None,) if with_version else ()) for var_id in unique_ids}
+    version = f", MAX({HISTORY_VERSION_COLUMN})" if with_version else ""
+
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size]
+        placeholders = ", ".join("?" for _ in chunk)
+        if since is None:
+            condition, params = "id_qualification = 0", chunk
+        else:
+            condition, params = "date_acquisition >= ?", chunk + [since]
+        cursor.execute(f"""
+            SELECT id_variable, COUNT(*), MIN(date_acquisition), MAX(date_acquisition){version}
             FROM his_valeur
-            WHERE id_variable = ? AND id_qualification = 0
-        """, (var_id,))
-        rows = cursor.fetchall()
-        dates_by_var[var_id] = {r[0] for r in rows}
-        values_by_var[var_id] = {r[0]: r[1] for r in rows}
-        all_dates.update(dates_by_var[var_id])
-
-    all_dates = sorted(all_dates)
-
-    for var_id in variable_ids:
-        for date in all_dates:
-            if date not in values_by_var[var_id]:
-                prev_dates = [d for d in dates_by_var[var_id] if d < date]
-                next_dates = [d for d in dates_by_var[var_id] if d > date]
-
-                if prev_dates and next_dates:
-                    d1 = max(prev_dates)
-                    d2 = min(next_dates)
-                    v1 = values_by_var[var_id][d1]
-                    v2 = values_by_var[var_id][d2]
-
-                    t1 = d1.timestamp()
-                    t2 = d2.timestamp()
-                    t = date.timestamp()
-                    interpolated_value = v1 + (v2 - v1) * (t - t1) / (t2 - t1)
-                    values_by_var[var_id][date] = interpolated_value
-                elif prev_dates:
-                    values_by_var[var_id][date] = values_by_var[var_id][max(prev_dates)]
-                elif next_dates:
-                    values_by_var[var_id][date] = values_by_var[var_id][min(next_dates)]
-
-    complete_results = []
-    for date in all_dates:
-        row_values = [values_by_var[var_id][date] for var_id in variable_ids]
-        complete_results.append((date, row_values))
-
-    return complete_results
+            WHERE id_variable IN ({placeholders}) AND {condition}
+            GROUP BY id_variable
+        """, params)
+        for var_id, count, first, last, *marker in cursor.fetchall():
+            stats[var_id] = (count, first, last, *marker)
+    return stats
+
+def load_new_row_stats(cursor, watermarks, chunk_size=IN_LIST_CHUNK_SIZE):
+    """{var_id: (row count, first date, last date)} of the rows acquired after the
+    watermark of their variable ({var_id: datetime}) or still unqualified, the
+    latter catching rows that arrived late with an older acquisition date"""
+    items = list(watermarks.items())
+    stats = {var_id: (0, None, None) for var_id, _ in items}
+
+    # Deux paramètres par variable : moitié de la limite de la clause IN
+    for start in range(0, len(items), chunk_size // 2):
+        chunk = items[start:start + chunk_size // 2]
+        values = ", ".join("(?, ?)" for _ in chunk)
+        cursor.execute(f"""
+            SELECT h.id_variable, COUNT(*), MIN(h.date_acquisition), MAX(h.date_acquisition)
+            FROM his_valeur h
+            JOIN (VALUES {values}) AS w (id_variable, date_watermark)
+                ON w.id_variable = h.id_variable
+            WHERE h.date_acquisition > w.date_watermark OR h.id_qualification = 0
+            GROUP BY h.id_variable
+        """, [param for item in chunk for param in item])
+        for var_id, count, first, last in cursor.fetchall():
+            stats[var_id] = (count, first, last)
+    return stats
+
+def aggregate_history(cursor, var_id, specs):
+    """Grouped aggregation of the unqualified rows of one variable, then their qualification.
+
+    The keys of the rows are snapshotted server-side, each PeriodicSpec
+    (operation in SQL_AGGREGATES) becomes one GROUP BY on the period index,
+    and exactly the snapshotted rows are qualified. Returns ([rows per spec],
+    qualified row count); rows are (bucket index, row count, non-null count,
+    aggregate).
+    """
+    cursor.execute("""
+        IF OBJECT_ID('tempdb..#his_valeur_agg_keys') IS NOT NULL
+            DROP TABLE #his_valeur_agg_keys;
+        SELECT id_variable, date_acquisition
+        INTO #his_valeur_agg_keys
+        FROM his_valeur
+        WHERE id_variable = ? AND id_qualification = 0
+    """, (var_id,))
+
+    results = []
+    for spec in specs:
+        cursor.execute(f"""
+            SELECT b.bucket, COUNT(*), COUNT(b.val_valide), {SQL_AGGREGATES[spec.operation]}(b.val_valide)
+            FROM (
+                SELECT (DATEDIFF_BIG(MICROSECOND, '19700101', h.date_acquisition) - ?) / ? AS bucket,
+                       CAST(h.val_valide AS FLOAT) AS val_valide
+                FROM his_valeur h
+                JOIN #his_valeur_agg_keys k
+                    ON k.id_variable = h.id_variable AND k.date_acquisition = h.date_acquisition
+            ) b
+            GROUP BY b.bucket
+            ORDER BY b.bucket
+        """, (spec.offset_us, spec.period_us))
+        results.append(cursor.fetchall())
+
+    cursor.execute("""
+        UPDATE h
+        SET id_qualification = 1
+        FROM his_valeur h
+        JOIN #his_valeur_agg_keys k
+            ON k.id_variable = h.id_variable AND k.date_acquisition = h.date_acquisition
+        WHERE h.id_qualification = 0
+    """)
+    qualified = cursor.rowcount
+    cursor.execute("DROP TABLE #his_valeur_agg_keys")
+    return results, qualified
+
+def has_column(cursor, table, column):
+    """Whether `table` has `column` (a metadata lookup, no lock on the table)"""
+    cursor.execute("SELECT COL_LENGTH(?, ?)", (table, column))
+    return cursor.fetchone()[0] is not None
+
+# Colonne rowversion de ref_regle, incrémentée par SQL Server à chaque INSERT/UPDATE
+RULE_VERSION_COLUMN = "version_ligne"
+
+def ensure_rule_version_column(cursor):
+    """Add the rowversion column (and its index) to ref_regle if it does not exist yet.
+
+    Schema change run by migrate.py, never while serving a request.
+    """
+    cursor.execute(f"""
+        IF COL_LENGTH('ref_regle', '{RULE_VERSION_COLUMN}') IS NULL
+            ALTER TABLE ref_regle ADD {RULE_VERSION_COLUMN} ROWVERSION
+    """)
+    cursor.execute(f"""
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'ix_ref_regle_version')
+            CREATE INDEX ix_ref_regle_version ON ref_regle ({RULE_VERSION_COLUMN})
+    """)
+
+def ensure_watermark_table(cursor):
+    """Create ref_regle_watermark (one watermark per rule) if it does not exist yet"""
+    cursor.execute("""
+        IF OBJECT_ID('ref_regle_watermark') IS NULL
+            CREATE TABLE ref_regle_watermark (
+                id_regle INT NOT NULL PRIMARY KEY,
+                date_watermark DATETIME2 NOT NULL,
+                date_maj DATETIME NOT NULL
+            )
+    """)
+
+def get_watermark(cursor, id_rule):
+    """Latest source date already processed by a rule, or None"""
+    ensure_watermark_table(cursor)
+    cursor.execute("SELECT date_watermark FROM ref_regle_watermark WHERE id_regle = ?", (id_rule,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def ensure_variable_watermark_table(cursor):
+    """Create ref_regle_watermark_variable (one watermark per rule and source variable)"""
+    cursor.execute("""
+        IF OBJECT_ID('ref_regle_watermark_variable') IS NULL
+            CREATE TABLE ref_regle_watermark_variable (
+                id_regle INT NOT NULL,
+                id_variable INT NOT NULL,
+                date_watermark DATETIME2 NOT NULL,
+                date_maj DATETIME NOT NULL,
+                PRIMARY KEY (id_regle, id_variable)
+            )
+    """)
+
+def get_variable_watermarks(cursor, id_rule):
+    """{id_variable: latest acquisition date already processed by the rule}"""
+    ensure_variable_watermark_table(cursor)
+    cursor.execute(
+        "SELECT id_variable, date_watermark FROM ref_regle_watermark_variable WHERE id_regle = ?", (id_rule,)
+    )
+    return dict(cursor.fetchall())
+
+def set_variable_watermarks(cursor, id_rule, watermarks):
+    if not watermarks:
+        return
+    ensure_variable_watermark_table(cursor)
+    cursor.executemany("""
+        MERGE ref_regle_watermark_variable AS w
+        USING (SELECT ? AS id_regle, ? AS id_variable, ? AS date_watermark) AS s
+        ON w.id_regle = s.id_regle AND w.id_variable = s.id_variable
+        WHEN MATCHED THEN
+            UPDATE SET date_watermark = s.date_watermark, date_maj = GETDATE()
+        WHEN NOT MATCHED THEN
+            INSERT (id_regle, id_variable, date_watermark, date_maj)
+            VALUES (s.id_regle, s.id_variable, s.date_watermark, GETDATE());
+    """, [(id_rule, var_id, date) for var_id, date in watermarks.items()])
+
+def set_watermark(cursor, id_rule, date):
+    ensure_watermark_table(cursor)
+    cursor.execute("""
+        MERGE ref_regle_watermark AS w
+        USING (SELECT ? AS id_regle, ? AS date_watermark) AS s
+        ON w.id_regle = s.id_regle
+        WHEN MATCHED THEN
+            UPDATE SET date_watermark = s.date_watermark, date_maj = GETDATE()
+        WHEN NOT MATCHED THEN
+            INSERT (id_regle, date_watermark, date_maj) VALUES (s.id_regle, s.date_watermark, GETDATE());
+    """, (id_rule, date))
+
+WRITE_BATCH_SIZE = 5000
+
+def stage_rows(cursor, table, columns, rows, batch_size=WRITE_BATCH_SIZE):
+    """(Re)create the temporary table `table` with the his_valeur types of `columns`
+    and fill it with fast_executemany by batches of `batch_size`"""
+    column_list = ", ".join(columns)
+    cursor.execute(f"""
+        IF OBJECT_ID('tempdb..{table}') IS NOT NULL
+            DROP TABLE {table};
+        SELECT TOP 0 {column_list}
+        INTO {table}
+        FROM his_valeur
+    """)
+
+    placeholders = ", ".join("?" for _ in columns)
+    fast_executemany = cursor.fast_executemany
+    cursor.fast_executemany = True
+    try:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(
+                f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})",
+                rows[start:start + batch_size],
+            )
+    finally:
+        cursor.fast_executemany = fast_executemany
+
+def write_series(cursor, var_id, series, batch_size=WRITE_BATCH_SIZE, replace=False):
+    """Insert the valid points of a series for var_id, skipping dates already stored.
+
+    Points are staged in a temporary table, then copied in a single
+    INSERT ... WHERE NOT EXISTS. With `replace`, existing rows are
+    overwritten through a MERGE instead (used to recompute open periods).
+    Returns the number of inserted or updated rows.
+    """
+    return write_many(cursor, [(var_id, series)], batch_size, replace)
+
+def unique_points(outputs):
+    """Valid (var_id, timestamps, values) of [(var_id, series)]; when several points share a
+    variable and a date, the first one wins, as with IF NOT EXISTS"""
+    points = defaultdict(list)
+    for var_id, series in outputs:
+        points[var_id].append((series.timestamps[series.valid], series.values[series.valid]))
+    for var_id, parts in points.items():
+        timestamps, first = np.unique(np.concatenate([ts for ts, _ in parts]), return_index=True)
+        yield var_id, timestamps, np.concatenate([values for _, values in parts])[first]
+
+def write_many(cursor, outputs, batch_size=WRITE_BATCH_SIZE, replace=False):
+    """write_series for a list of (var_id, series) through a single staging table and statement"""
+    rows = []
+    for var_id, timestamps, values in unique_points(outputs):
+        rows.extend(zip([var_id] * len(timestamps), from_epoch_us(timestamps), values.tolist()))
+    if not rows:
+        return 0
+
+    stage_rows(
+        cursor, "#his_valeur_staging",
+        ("id_variable", "date_acquisition", "val_valide"), rows, batch_size,
+    )
+
+    if replace:
+        cursor.execute("""
+            MERGE his_valeur AS h
+            USING #his_valeur_staging AS s
+            ON h.id_variable = s.id_variable AND h.date_acquisition = s.date_acquisition
+            WHEN MATCHED AND (h.val_valide IS NULL OR h.val_valide <> s.val_valide) THEN
+                UPDATE SET val_brute = s.val_valide, val_valide = s.val_valide, date_insertion = GETDATE()
+            WHEN NOT MATCHED THEN
+                INSERT (id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide)
+                VALUES (s.id_variable, s.date_acquisition, 1, GETDATE(), s.val_valide, s.val_valide);
+        """)
+    else:
+        cursor.execute("""
+            INSERT INTO his_valeur (
+                id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide
+            )
+            SELECT s.id_variable, s.date_acquisition, 1, GETDATE(), s.val_valide, s.val_valide
+            FROM #his_valeur_staging s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM his_valeur h
+                WHERE h.id_variable = s.id_variable AND h.date_acquisition = s.date_acquisition
+            )
+        """)
+    inserted = cursor.rowcount
+    cursor.execute("DROP TABLE #his_valeur_staging")
+    return inserted
+
+def qualify_histories(cursor, histories, batch_size=WRITE_BATCH_SIZE):
+    """Flag exactly the rows returned by load_histories as qualified.
+
+    The (id_variable, date_acquisition) keys are staged in a temporary table
+    and joined in a single UPDATE. Returns the number of qualified rows.
+    """
+    rows = []
+    for var_id, (timestamps, _) in histories.items():
+        rows.extend(zip([var_id] * len(timestamps), from_epoch_us(timestamps)))
+    if not rows:
+        return 0
+
+    stage_rows(cursor, "#his_valeur_keys", ("id_variable", "date_acquisition"), rows, batch_size)
+    cursor.execute("""
+        UPDATE h
+        SET id_qualification = 1
+        FROM his_valeur h
+        JOIN #his_valeur_keys k
+            ON k.id_variable = h.id_variable AND k.date_acquisition = h.date_acquisition
+        WHERE h.id_qualification = 0
+    """)
+    qualified = cursor.rowcount
+    cursor.execute("DROP TABLE #his_valeur_keys")
+    return qualified
+
+def interpolate_missing_values(cursor, variable_ids, specs=None):
+    histories = load_histories(cursor, variable_ids)
+    return fill_missing(histories, variable_ids, specs)
@@ -0,0 +1,795 @@
+from collections import defaultdict, deque
+from contextlib import nullcontext
+import time
+
+import numpy as np
+
+from alignment import align_chunk, join_spec, readvar_timeline
+from aggregation import SQL_AGGREGATES, aggregate, bucket_rows_to_series, periodic_spec
+from database import CHUNK_ROWS, WRITE_BATCH_SIZE
+from interpolation import TimelineStream, build_timeline, fill_series, interpolation_spec
+from rolling import rolling, rolling_spec
+from series import Series, from_epoch_us, to_epoch_us
+
+ARITHMETIC_CLASSES = ('+', '-', '*', '/')
+
+
+class RulePlan:
+    """Compiled form of a rule: block graph, evaluation order and consumer counts"""
+
+    def __init__(self, id_to_block, inputs_map, outputs_map, order):
+        self.id_to_block = id_to_block
+        self.inputs_map = inputs_map
+        self.outputs_map = outputs_map
+        # Ordre topologique des blocs nécessaires aux WriteVar
+        self.order = order
+        self.end_block_ids = sorted(bid for bid in order if id_to_block[bid]["class"] == "WriteVar")
+
+        # Nombre de consommateurs de chaque bloc (pour libérer les résultats au plus tôt)
+        needed = set(order)
+        self.consumer_counts = defaultdict(int)
+        for bid in order:
+            for parent in inputs_map[bid]:
+                self.consumer_counts[parent] += 1
+
+        # Une colonne interpolée par bloc ReadVar de la règle
+        self.read_block_ids = [
+            bid for bid, block in id_to_block.items() if block["class"] == "ReadVar"
+        ]
+        self.variable_ids = [id_to_block[bid]["parameters"]["Id"] for bid in self.read_block_ids]
+        self.interpolation_specs = [
+            interpolation_spec(id_to_block[bid]["parameters"]) for bid in self.read_block_ids
+        ]
+        # Les ReadVar "own" gardent leurs échantillons bruts, hors de la timeline commune
+        self.own_timeline_block_ids = {
+            bid for bid in self.read_block_ids
+            if readvar_timeline(id_to_block[bid]["parameters"]) == "own"
+        }
+        shared = [i for i, bid in enumerate(self.read_block_ids) if bid not in self.own_timeline_block_ids]
+        self.timeline_variable_ids = [self.variable_ids[i] for i in shared]
+        self.timeline_interpolation_specs = [self.interpolation_specs[i] for i in shared]
+        self.join_specs = self._join_specs()
+        self.shared_block_ids = [bid for bid in needed if self.consumer_counts[bid] > 1]
+        self.periodic_specs = {
+            bid: periodic_spec(id_to_block[bid]["parameters"])
+            for bid in order if id_to_block[bid]["class"] == "PeriodicCalc"
+        }
+        self.rolling_specs = {
+            bid: rolling_spec(id_to_block[bid]["parameters"])
+            for bid in order if id_to_block[bid]["class"] == "RollingCalc"
+        }
+        self.pushdown_block_ids = self._pushdown_block_ids()
+        self.interpolated_periodic_block_ids = self._interpolated_periodic_block_ids()
+        # Rempli par optimizer.optimize_plan
+        self.optimizations = []
+
+    def _pushdown_block_ids(self):
+        """PeriodicCalc blocks that can be aggregated by the database instead of in Python.
+
+        Only when the rule reads a single variable: the union timeline is then
+        exactly its samples and the interpolated column equals the raw rows
+        (NULL stays invalid), so a GROUP BY over his_valeur gives the same
+        buckets. Every consumer of the ReadVars must be such a PeriodicCalc
+        (operation in SQL_AGGREGATES), otherwise the raw history is loaded
+        anyway and nothing is pushed down.
+        """
+        if len(set(self.variable_ids)) != 1:
+            return []
+        blocks = []
+        for bid in self.order:
+            if self.id_to_block[bid]["class"] != "ReadVar":
+                continue
+            for child in self.outputs_map[bid]:
+                spec = self.periodic_specs.get(child)
+                if spec is None or spec.operation not in SQL_AGGREGATES:
+                    return []
+                blocks.append(child)
+        return sorted(set(blocks))
+
+    def _join_specs(self):
+        """Join settings of the arithmetic blocks whose inputs may not share a timeline.
+
+        Shared ReadVars, and arithmetic blocks fed only by such blocks, all
+        carry the union timeline and keep their inputs paired by position;
+        a RollingCalc keeps the timestamps of its input. Any other arithmetic
+        block (fed by a PeriodicCalc, an "own" ReadVar or another joined
+        block) joins its inputs on their timestamps.
+        """
+        on_timeline = {bid: bid not in self.own_timeline_block_ids for bid in self.read_block_ids}
+        specs = {}
+        for bid in self.order:
+            block = self.id_to_block[bid]
+            if block["class"] == "RollingCalc":
+                on_timeline[bid] = all(on_timeline.get(parent, False) for parent in self.inputs_map[bid])
+                continue
+            if block["class"] not in ARITHMETIC_CLASSES and block["class"] != "Expression":
+                continue
+            on_timeline[bid] = all(on_timeline.get(parent, False) for parent in self.inputs_map[bid])
+            if not on_timeline[bid] and block["class"] in ARITHMETIC_CLASSES:
+                specs[bid] = join_spec(block["parameters"])
+        return specs
+
+    def _interpolated_periodic_block_ids(self):
+        """PeriodicCalc blocks whose output reaches an outer or as-of join.
+
+        The join spreads each period value over the dates before the next
+        one (interpolation toward it, or as-of carry), so dates up to a
+        period's start also depend on it.
+        """
+        blocks = set()
+        stack = [bid for bid, (mode, _, _) in self.join_specs.items() if mode in ("outer", "asof")]
+        seen = set()
+        while stack:
+            bid = stack.pop()
+            if bid in seen:
+                continue
+            seen.add(bid)
+            if bid in self.periodic_specs:
+                blocks.add(bid)
+            stack.extend(self.inputs_map[bid])
+        return sorted(blocks)
+
+    def period_start(self, timestamp):
+        """Start (epoch µs) of the earliest aggregation period containing `timestamp`.
+
+        For a PeriodicCalc feeding an outer or as-of join this is the start
+        of the previous period: the dates between the two period values are
+        joined toward the still-open one and must be rewritten with it.
+        """
+        starts = [timestamp]
+        for bid, spec in self.periodic_specs.items():
+            start = int(spec.bucket_start(timestamp))
+            if bid in self.interpolated_periodic_block_ids:
+                start -= spec.period_us
+            starts.append(start)
+        return min(starts)
+
+    def lookback_start(self, timestamp):
+        """Earliest source date (epoch µs) the outputs from `timestamp` on depend on.
+
+        Walks the graph back from the WriteVars, each RollingCalc reaching
+        one window earlier and each PeriodicCalc back to its period start.
+        """
+        starts = {bid: timestamp for bid in self.end_block_ids}
+        for bid in reversed(self.order):
+            needed = starts[bid]
+            if bid in self.rolling_specs:
+                needed = int(self.rolling_specs[bid].window_start(needed))
+            elif bid in self.periodic_specs:
+                needed = int(self.periodic_specs[bid].bucket_start(needed))
+            for parent in self.inputs_map[bid]:
+                starts[parent] = min(starts.get(parent, needed), needed)
+        return min(starts.values(), default=timestamp)
+
+
+def compile_rule(json_data):
+    """Turn the blocks/links of a rule into a topologically ordered RulePlan"""
+    blocks = json_data["blocks"]
+    links = json_data["links"]
+
+    # L'ID du bloc correspond à son index + 1
+    id_to_block = {i + 1: block for i, block in enumerate(blocks)}
+
+    inputs_map = defaultdict(list)
+    outputs_map = defaultdict(list)
+    for link in links:
+        for bid in (link["parent"], link["child"]):
+            if bid not in id_to_block:
+                raise ValueError(f"Block ID {bid} not found")
+        inputs_map[link["child"]].append(link["parent"])
+        outputs_map[link["parent"]].append(link["child"])
+
+    # Seuls les ancêtres des WriteVar sont évalués
+    needed = set()
+    stack = [bid for bid, block in id_to_block.items() if block["class"] == "WriteVar"]
+    while stack:
+        bid = stack.pop()
+        if bid in needed:
+            continue
+        needed.add(bid)
+        stack.extend(inputs_map[bid])
+
+    # Tri topologique (Kahn), en conservant l'ordre des blocs à égalité
+    pending = {bid: len(inputs_map[bid]) for bid in needed}
+    ready = deque(sorted(bid for bid, count in pending.items() if count == 0))
+    order = []
+    while ready:
+        bid = ready.popleft()
+        order.append(bid)
+        for child in outputs_map[bid]:
+            if child in pending:
+                pending[child] -= 1
+                if pending[child] == 0:
+                    ready.append(child)
+
+    if len(order) != len(needed):
+        cycle = sorted(bid for bid in needed if bid not in order)
+        raise ValueError(f"Cycle détecté impliquant les blocs {cycle}")
+
+    return RulePlan(id_to_block, inputs_map, outputs_map, order)
+
+
+class ExecutionContext:
+    """Data shared by the blocks during one execution.
+
+    `write_from` (epoch µs) restricts what WriteVar blocks persist and
+    `replace_existing` makes them overwrite stored values (incremental runs).
+    In chunked runs `state` carries per-block data from one chunk to the
+    next and `final` is only set for the last chunk. `progress`, when given,
+    is called as progress(blocks_done, blocks_total, rows_written) after
+    each block and `observer` as observer(block_id, series) with each block
+    output. With `dry_run` WriteVar blocks write nothing, and a `profile`
+    (profiling.Profile) records the time and point counts of each block.
+    `precomputed` holds the outputs of blocks aggregated by the database.
+    """
+
+    def __init__(self, storage, timeline, columns, read_block_ids, write_batch_size=WRITE_BATCH_SIZE,
+                 write_from=None, replace_existing=False, progress=None, observer=None, dry_run=False,
+                 profile=None):
+        self.storage = storage
+        self.progress = progress
+        self.observer = observer
+        self.dry_run = dry_run
+        self.profile = profile
+        self.read_block_ids = read_block_ids
+        self.write_batch_size = write_batch_size
+        self.write_from = write_from
+        self.replace_existing = replace_existing
+        self.rows_written = 0
+        self.state = {}
+        self.precomputed = {}
+        self.final = True
+        self.set_columns(timeline, columns)
+
+    def set_columns(self, timeline, columns, final=True):
+        self.timeline = timeline
+        # Série interpolée de chaque bloc ReadVar
+        self.columns = dict(zip(self.read_block_ids, columns))
+        self.final = final
+
+
+def _read_columns(plan, timeline_columns, histories):
+    """One Series per ReadVar: its interpolated column on the shared timeline, or its raw samples"""
+    shared = iter(timeline_columns)
+    return [
+        Series(*histories[var_id]) if bid in plan.own_timeline_block_ids else next(shared, Series.empty())
+        for bid, var_id in zip(plan.read_block_ids, plan.variable_ids)
+    ]
+
+
+def fill_columns(plan, histories):
+    """Union timeline of the shared ReadVars and the column of every ReadVar of the plan"""
+    timeline, columns = fill_series(histories, plan.timeline_variable_ids, plan.timeline_interpolation_specs)
+    return timeline, _read_columns(plan, columns, histories)
+
+
+def count_dates(plan, timeline, columns):
+    """Distinct dates evaluated: the shared timeline and the samples of "own" ReadVars"""
+    own = [
+        column.timestamps for bid, column in zip(plan.read_block_ids, columns)
+        if bid in plan.own_timeline_block_ids
+    ]
+    return len(build_timeline([timeline] + own)) if own else len(timeline)
+
+
+def _phase(profile, name):
+    return profile.phase(name) if profile is not None else nullcontext()
+
+
+def _since(history, timestamp):
+    timestamps, values = history
+    keep = timestamps >= timestamp
+    return timestamps[keep], values[keep]
+
+
+def _watermarks(storage, rule_id, variable_ids):
+    """Watermark of each source variable of a rule, or None while some variable has none.
+
+    Variables without their own watermark fall back on the rule-level one
+    kept by earlier runs.
+    """
+    by_variable = storage.get_variable_watermarks(rule_id)
+    fallback = storage.get_watermark(rule_id)
+    watermarks = {}
+    for var_id in dict.fromkeys(variable_ids):
+        watermarks[var_id] = by_variable.get(var_id, fallback)
+        if watermarks[var_id] is None:
+            return None
+    return watermarks
+
+
+def _concat(first, second):
+    return np.concatenate([first[0], second[0]]), np.concatenate([first[1], second[1]])
+
+
+def execute_rule(storage, plan, rule_id=None, incremental=False, write_batch_size=WRITE_BATCH_SIZE,
+                 progress=None, profile=None):
+    """Load the sources, run the plan, qualify the rows read and report the counts.
+
+    In incremental mode the rule keeps a watermark per source variable
+    (latest acquisition date processed). New rows are those acquired after
+    it, plus the unqualified rows that arrived late with an older date;
+    variables without new rows are left out. Outputs are rewritten from
+    the open aggregation period of the last known point before the first
+    new row of each changed variable, and the load reaches back far enough
+    (lookback_start) to give them their full periods, rolling windows and
+    interpolation context. Without watermarks yet, a full run is done.
+    """
+    variable_ids = plan.variable_ids
+    watermarks = _watermarks(storage, rule_id, variable_ids) if incremental else None
+
+    if watermarks is None:
+        histories = storage.load_histories(variable_ids)
+        new_rows = histories
+        write_from = None
+    else:
+        stats = storage.load_new_row_stats(watermarks)
+        firsts = {var_id: int(to_epoch_us([first])[0]) for var_id, (count, first, _) in stats.items() if count}
+
+        if not firsts:
+            return {
+                "success": True,
+                "mode": "incremental",
+                "processed_dates": 0,
+                "output_values": 0,
+                "rows_written": 0,
+                "qualified_rows": 0,
+                "variable_ids_processed": variable_ids,
+                "watermark": max(watermarks.values()).isoformat(),
+            }
+
+        # Les sorties changent dès le dernier point connu avant la première nouvelle
+        # ligne de chaque variable concernée (interpolation vers ce nouveau point)
+        changed = []
+        for var_id, first in firsts.items():
+            timestamps, _ = storage.load_last_values([var_id], from_epoch_us([first])[0])[var_id]
+            changed.append(int(timestamps[0]) if len(timestamps) else first)
+        write_from = plan.period_start(min(changed))
+        start = from_epoch_us([plan.lookback_start(write_from)])[0]
+        histories = storage.load_histories(variable_ids, since=start)
+        # Les lignes qualifiées situées après la première nouvelle ligne ne changent pas
+        new_rows = {var_id: _since(histories[var_id], first) for var_id, first in firsts.items()}
+
+        # Dernier point connu avant la fenêtre, pour interpoler au bord
+        previous = storage.load_last_values(variable_ids, start)
+        histories = {var_id: _concat(previous[var_id], history) for var_id, history in histories.items()}
+
+    with _phase(profile, "interpolation"):
+        timeline, columns = fill_columns(plan, histories)
+
+    # Chaque bloc est évalué une seule fois, dans l'ordre topologique
+    context = ExecutionContext(
+        storage, timeline, columns, plan.read_block_ids, write_batch_size,
+        write_from=write_from, replace_existing=write_from is not None, progress=progress,
+        profile=profile,
+    )
+    outputs = run_plan(plan, context)
+    output_values = sum(len(outputs[end_block_id]) for end_block_id in plan.end_block_ids)
+
+    # Marquer comme qualifiées exactement les lignes sources lues
+    qualified_rows = storage.qualify_histories(new_rows)
+
+    result = {
+        "success": True,
+        "mode": "incremental" if write_from is not None else "full",
+        "processed_dates": count_dates(plan, timeline, columns),
+        "output_values": output_values,
+        "rows_written": context.rows_written,
+        "qualified_rows": qualified_rows,
+        "variable_ids_processed": variable_ids,
+    }
+
+    if incremental:
+        # Seules les variables ayant reçu de nouvelles lignes avancent leur filigrane
+        if watermarks is None:
+            advanced = {
+                var_id: from_epoch_us([ts[-1]])[0] for var_id, (ts, _) in histories.items() if len(ts)
+            }
+        else:
+            advanced = {var_id: max(watermarks[var_id], stats[var_id][2]) for var_id in firsts}
+        if advanced:
+            storage.set_variable_watermarks(rule_id, advanced)
+            new_watermark = max({**(watermarks or {}), **advanced}.values())
+            storage.set_watermark(rule_id, new_watermark)
+            result["watermark"] = new_watermark.isoformat()
+
+    return result
+
+
+def execute_rule_pushdown(storage, plan, write_batch_size=WRITE_BATCH_SIZE, progress=None, profile=None):
+    """Full run of a plan whose PeriodicCalc blocks are all computed by the database.
+
+    Only the aggregated rows of plan.pushdown_block_ids are read (one
+    grouped query per block); the rows aggregated are qualified by the same
+    storage call and the rest of the graph runs on the bucketed Series.
+    """
+    specs = [plan.periodic_specs[bid] for bid in plan.pushdown_block_ids]
+    bucket_rows, qualified_rows = storage.aggregate_history(plan.variable_ids[0], specs)
+
+    context = ExecutionContext(
+        storage, np.empty(0, dtype=np.int64), [Series.empty() for _ in plan.read_block_ids],
+        plan.read_block_ids, write_batch_size, progress=progress, profile=profile,
+    )
+    context.precomputed = {
+        bid: bucket_rows_to_series(rows, spec)
+        for bid, rows, spec in zip(plan.pushdown_block_ids, bucket_rows, specs)
+    }
+    outputs = run_plan(plan, context)
+
+    return {
+        "success": True,
+        "mode": "full",
+        "processed_dates": sum(row[1] for row in bucket_rows[0]),
+        "output_values": sum(len(outputs[end_block_id]) for end_block_id in plan.end_block_ids),
+        "rows_written": context.rows_written,
+        "qualified_rows": qualified_rows,
+        "variable_ids_processed": plan.variable_ids,
+        "pushdown_blocks": list(plan.pushdown_block_ids),
+    }
+
+
+def execute_plan(storage, plan, rule_id=None, incremental=False, chunk_rows=None, progress=None,
+                 profile=None, pushdown=True):
+    """Run a compiled rule in full, incremental (watermark) or chunked mode.
+
+    With a `profile`, storage calls, interpolation and blocks are timed into it.
+    Full runs of plans with pushdown blocks aggregate in the database unless
+    `pushdown` is False.
+    """
+    if profile is not None:
+        storage = profile.wrap(storage)
+    if chunk_rows:
+        if incremental:
+            raise ValueError("Chunked execution cannot be combined with incremental mode")
+        return execute_rule_chunked(storage, plan, chunk_rows=chunk_rows, progress=progress, profile=profile)
+    if pushdown and plan.pushdown_block_ids and not incremental:
+        return execute_rule_pushdown(storage, plan, progress=progress, profile=profile)
+    return execute_rule(
+        storage, plan, rule_id=rule_id, incremental=incremental, progress=progress, profile=profile,
+    )
+
+
+def execute_rule_chunked(storage, plan, chunk_rows=CHUNK_ROWS, write_batch_size=WRITE_BATCH_SIZE,
+                         progress=None, profile=None):
+    """Full run processing the history in time-ordered chunks of about `chunk_rows` rows.
+
+    Each chunk is read, qualified, interpolated, pushed through the whole
+    block graph and written before the next one is loaded, so peak memory
+    depends on the chunk size instead of the history length. PeriodicCalc
+    blocks keep their open period across chunks, RollingCalc blocks the
+    points still inside their window, and joined arithmetic blocks the
+    points they cannot join yet (MAX_JOIN_LOOKAHEAD at most). A source
+    without a recent sample has its next one read ahead (load_next_values),
+    so that it never holds back the union timeline.
+    """
+    variable_ids = plan.variable_ids
+    stream = TimelineStream(plan.timeline_variable_ids, plan.timeline_interpolation_specs)
+    # Échantillons des ReadVar "own" reçus depuis la dernière évaluation du graphe
+    own_ids = {
+        var_id for bid, var_id in zip(plan.read_block_ids, variable_ids) if bid in plan.own_timeline_block_ids
+    }
+    no_rows = (np.empty(0, dtype=np.int64), np.empty(0))
+    own_rows = dict.fromkeys(own_ids, no_rows)
+    context = ExecutionContext(
+        storage, np.empty(0, dtype=np.int64), [], plan.read_block_ids, write_batch_size, progress=progress,
+        profile=profile,
+    )
+
+    after = None
+    exhausted = False
+    chunks = processed_dates = output_values = qualified_rows = 0
+    while not exhausted:
+        histories, last_date, exhausted = storage.load_history_chunk(variable_ids, after, chunk_rows)
+        if last_date is not None:
+            after = last_date
+        qualified_rows += storage.qualify_histories(histories)
+
+        lookahead = None
+        if plan.timeline_variable_ids:
+            stream.push({var_id: histories[var_id] for var_id in set(plan.timeline_variable_ids)})
+            # Toutes les lignes jusqu'à `after` sont lues : le prochain échantillon d'une
+            # variable en retard (ou son absence) suffit pour publier la timeline jusque-là
+            lagging = stream.lagging(int(to_epoch_us([after])[0])) if not exhausted and after is not None else []
+            if lagging:
+                lookahead = storage.load_next_values(lagging, after)
+
+        with _phase(profile, "interpolation"):
+            if plan.timeline_variable_ids:
+                timeline, columns = stream.pop_ready(final=exhausted, lookahead=lookahead)
+            else:
+                timeline, columns = np.empty(0, dtype=np.int64), []
+        for var_id in own_ids:
+            own_rows[var_id] = _concat(own_rows[var_id], histories[var_id])
+        if not len(timeline) and not exhausted and not any(len(ts) for ts, _ in own_rows.values()):
+            continue
+
+        columns = _read_columns(plan, columns, own_rows)
+        context.set_columns(timeline, columns, final=exhausted)
+        own_rows = dict.fromkeys(own_ids, no_rows)
+        outputs = run_plan(plan, context)
+        chunks += 1
+        processed_dates += count_dates(plan, timeline, columns)
+        output_values += sum(len(outputs[end_block_id]) for end_block_id in plan.end_block_ids)
+
+    return {
+        "success": True,
+        "mode": "chunked",
+        "chunks": chunks,
+        "processed_dates": processed_dates,
+        "output_values": output_values,
+        "rows_written": context.rows_written,
+        "qualified_rows": qualified_rows,
+        "variable_ids_processed": variable_ids,
+    }
+
+
+def simulate_plan(storage, plan, observer=None):
+    """Dry run of a rule: sources are read and every block evaluated, but
+    nothing is written to his_valeur and no row is qualified"""
+    variable_ids = plan.variable_ids
+    histories = storage.load_histories(variable_ids)
+    timeline, columns = fill_columns(plan, histories)
+
+    context = ExecutionContext(
+        storage, timeline, columns, plan.read_block_ids, observer=observer, dry_run=True,
+    )
+    outputs = run_plan(plan, context)
+
+    return {
+        "success": True,
+        "mode": "dry_run",
+        "processed_dates": count_dates(plan, timeline, columns),
+        "output_values": sum(len(outputs[end_block_id]) for end_block_id in plan.end_block_ids),
+        "rows_written": 0,
+        "qualified_rows": 0,
+        "variable_ids_processed": variable_ids,
+    }
+
+
+def run_plan(plan, context):
+    """Evaluate every block once in topological order.
+
+    Intermediate results are dropped as soon as their last consumer has run;
+    returns the results of the WriteVar blocks keyed by block ID.
+    """
+    results = {}
+    remaining = dict(plan.consumer_counts)
+    outputs = {}
+
+    for done, bid in enumerate(plan.order, start=1):
+        input_data_list = [results[parent] for parent in plan.inputs_map[bid]]
+        if context.profile is None:
+            results[bid] = evaluate_block(plan, bid, input_data_list, context)
+        else:
+            started = time.perf_counter()
+            results[bid] = evaluate_block(plan, bid, input_data_list, context)
+            context.profile.record_block(
+                bid, plan.id_to_block[bid]["class"], time.perf_counter() - started,
+                sum(len(data) for data in input_data_list), results[bid],
+            )
+        if context.observer is not None:
+            context.observer(bid, results[bid])
+
+        for parent in plan.inputs_map[bid]:
+            remaining[parent] -= 1
+            if remaining[parent] == 0:
+                del results[parent]
+
+        if plan.id_to_block[bid]["class"] == "WriteVar":
+            outputs[bid] = results[bid]
+            if not remaining.get(bid):
+                del results[bid]
+
+        if context.progress is not None:
+            context.progress(done, len(plan.order), context.rows_written)
+
+    return outputs
+
+
+def evaluate_block(plan, block_id, input_data_list, context):
+    """Compute the output Series of one block from the Series of its inputs"""
+    block = plan.id_to_block[block_id]
+    cls = block["class"]
+
+    if cls == "ReadVar":
+        return context.columns[block_id]
+
+    elif cls in ARITHMETIC_CLASSES:
+        if not input_data_list:
+            raise ValueError(f"No inputs found for operation block {block_id}")
+        if block_id in plan.join_specs:
+            # Entrées sur des timelines différentes : jointure sur les dates
+            timeline, operands, pending = align_chunk(
+                input_data_list, *plan.join_specs[block_id],
+                pending=context.state.pop(block_id, None), final=context.final,
+            )
+            if pending is not None:
+                context.state[block_id] = pending
+            values, valid = _combine(cls, operands)
+            return Series(timeline, values, valid)
+        return apply_arithmetic(cls, input_data_list)
+
+    elif cls == "Expression":
+        return apply_expression(block["parameters"]["expression"], input_data_list)
+
+    elif cls == "PeriodicCalc":
+        if block_id in context.precomputed:
+            return context.precomputed[block_id]
+        if not input_data_list:
+            raise ValueError(f"No input found for PeriodicCalc block {block_id}")
+
+        input_data = input_data_list[0]
+        spec = plan.periodic_specs[block_id]
+
+        # En exécution par morceaux, la dernière période reste ouverte jusqu'au morceau suivant
+        carry = context.state.pop(block_id, None)
+        if carry is not None:
+            input_data = Series.concat([carry, input_data])
+        if not context.final and len(input_data):
+            open_period = int(spec.bucket_start(input_data.timestamps[-1]))
+            context.state[block_id] = input_data.since(open_period)
+            input_data = input_data.before(open_period)
+
+        return aggregate(input_data, spec)
+
+    elif cls == "RollingCalc":
+        if not input_data_list:
+            raise ValueError(f"No input found for RollingCalc block {block_id}")
+
+        input_data = input_data_list[0]
+        spec = plan.rolling_specs[block_id]
+
+        # En exécution par morceaux, les points encore dans la fenêtre sont repris
+        # au morceau suivant ; leurs résultats ont déjà été produits
+        window = context.state.pop(block_id, None)
+        carried = len(window) if window is not None else 0
+        if carried:
+            input_data = Series.concat([window, input_data])
+        if not context.final and len(input_data):
+            context.state[block_id] = input_data.since(int(spec.window_start(input_data.timestamps[-1])) + 1)
+
+        result = rolling(input_data, spec)
+        return Series(result.timestamps[carried:], result.values[carried:], result.valid[carried:])
+
+    elif cls == "WriteVar":
+        if not input_data_list:
+            raise ValueError(f"No input found for WriteVar block {block_id}")
+
+        results = input_data_list[0]
+        var_id = block["parameters"]["Id"]
+        if context.dry_run:
+            return results
+
+        # Only write non-null values, in bulk
+        to_write = results if context.write_from is None else results.since(context.write_from)
+        context.rows_written += context.storage.write_series(
+            var_id, to_write, context.write_batch_size, context.replace_existing
+        )
+        return results
+
+    else:
+        raise ValueError(f"Type de bloc inconnu: {cls}")
+
+
+class _Buffers:
+    """Pool of work arrays of one length, reused from one expression node to the next"""
+
+    def __init__(self, length):
+        self.length = length
+        self._free = {np.float64: [], np.bool_: []}
+
+    def take(self, dtype):
+        free = self._free[dtype]
+        return free.pop() if free else np.empty(self.length, dtype=dtype)
+
+    def release(self, *arrays):
+        for array in arrays:
+            self._free[array.dtype.type].append(array)
+
+
+def _combine(cls, operands, buffers=None):
+    """Position-wise '+', '-', '*', '/' over (values, valid) arrays of equal length.
+
+    Invalid operands are ignored at each position; '-' and '/' start from the
+    first valid operand. The result is invalid when no operand is valid, or
+    on a division by zero. Every step writes into arrays taken from
+    `buffers` (out= / where= ufuncs), so no temporary array is created.
+    """
+    if buffers is None:
+        buffers = _Buffers(len(operands[0][1]))
+    res = buffers.take(np.float64)
+    res.fill(1.0 if cls in ('*', '/') else 0.0)
+    any_valid = buffers.take(np.bool_)
+    any_valid.fill(False)
+    mask = buffers.take(np.bool_)
+    if cls in ('-', '/'):
+        first = buffers.take(np.float64)
+    if cls == '/':
+        zero_division = buffers.take(np.bool_)
+        zero_division.fill(False)
+        is_zero = buffers.take(np.bool_)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for values, valid in operands:
+            if cls == '+':
+                np.add(res, values, out=res, where=valid)
+            elif cls == '*':
+                np.multiply(res, values, out=res, where=valid)
+            else:
+                # Première entrée valide (valid & ~any_valid), puis les suivantes
+                np.greater(valid, any_valid, out=mask)
+                np.copyto(first, values, where=mask)
+                np.logical_and(valid, any_valid, out=mask)
+                if cls == '-':
+                    np.add(res, values, out=res, where=mask)
+                else:
+                    np.multiply(res, values, out=res, where=mask)
+                    np.equal(values, 0, out=is_zero)
+                    is_zero &= mask
+                    zero_division |= is_zero
+            any_valid |= valid
+
+        if cls == '-':
+            np.subtract(first, res, out=res, where=any_valid)
+        elif cls == '/':
+            np.greater(any_valid, zero_division, out=any_valid)
+            np.divide(first, res, out=res, where=any_valid)
+
+    np.logical_not(any_valid, out=mask)
+    np.copyto(res, np.nan, where=mask)
+    buffers.release(mask)
+    if cls in ('-', '/'):
+        buffers.release(first)
+    if cls == '/':
+        buffers.release(zero_division, is_zero)
+    return res, any_valid
+
+
+def apply_arithmetic(cls, input_data_list):
+    """Whole-array '+', '-', '*', '/' over inputs paired by position (inputs on the
+    shared timeline; the others are joined on their dates, see RulePlan.join_specs).
+
+    As before, invalid inputs are ignored at each position and the result is
+    invalid only when no input is valid (or on a division by zero).
+    """
+    length = min(len(data) for data in input_data_list)
+    values, valid = _combine(cls, [(data.values[:length], data.valid[:length]) for data in input_data_list])
+    return Series(input_data_list[0].timestamps[:length], values, valid)
+
+
+def apply_expression(expression, input_data_list):
+    """Evaluate a fused tree of arithmetic blocks (optimizer "Expression" block).
+
+    Nodes are ["input", index] or [operator, [children]]. The result equals
+    nested apply_arithmetic calls without materializing the intermediate
+    Series: every operand is truncated once to the shortest input, and each
+    node accumulates its children one at a time into work arrays shared by
+    the whole tree (a child's arrays go back to the pool as soon as its
+    parent has consumed them), so at most one pending operand per tree
+    level is held in memory. Timestamps come from the leftmost input as
+    with chained blocks.
+    """
+    length = min(len(data) for data in input_data_list)
+    buffers = _Buffers(length)
+
+    def evaluate(node):
+        """(values, valid, arrays to release after use)"""
+        if node[0] == "input":
+            data = input_data_list[node[1]]
+            return data.values[:length], data.valid[:length], ()
+        values, valid = _combine(node[0], operands(node[1]), buffers)
+        return values, valid, (values, valid)
+
+    def operands(children):
+        # Chaque enfant est évalué au moment où son parent le consomme
+        for child in children:
+            values, valid, owned = evaluate(child)
+            yield values, valid
+            buffers.release(*owned)
+
+    leftmost = expression
+    while leftmost[0] != "input":
+        leftmost = leftmost[1][0]
+
+    values, valid, _ = evaluate(expression)
+    return Series(input_data_list[leftmost[1]].timestamps[:length], values, valid)
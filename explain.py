@@ -0,0 +1,114 @@
+from engine import ARITHMETIC_CLASSES
+from optimizer import describe_plan
+from series import to_epoch_us
+
+
+def explain_plan(storage, plan):
+    """Execution plan of a compiled rule with cost estimates, without loading any history.
+
+    Row counts and date ranges come from one grouped COUNT/MIN/MAX query on
+    the unqualified rows of his_valeur. The union timeline has between
+    max(counts) and sum(counts) points; block estimates propagate the upper
+    bound (distinct sampling dates), PeriodicCalc blocks being capped at the
+    number of periods spanned by the timeline and RollingCalc blocks keeping
+    their input estimate. "own" ReadVars keep their row count and joined
+    blocks take the smallest (inner), first (asof) or summed (outer) input
+    estimate.
+    """
+    stats = storage.load_history_stats(plan.variable_ids)
+
+    read_vars = []
+    for bid, var_id, (method, max_gap) in zip(plan.read_block_ids, plan.variable_ids, plan.interpolation_specs):
+        count, first, last = stats[var_id]
+        read_vars.append({
+            "block_id": bid,
+            "variable_id": var_id,
+            "rows": count,
+            "first_date": first.isoformat() if first else None,
+            "last_date": last.isoformat() if last else None,
+            "interpolation": method,
+            "max_gap_minutes": max_gap / 60_000_000 if max_gap is not None else None,
+        })
+
+    shared = [stats[var_id] for var_id in dict.fromkeys(plan.timeline_variable_ids)]
+    counts = [count for count, _, _ in shared]
+    firsts = [first for _, first, _ in stats.values() if first is not None]
+    lasts = [last for _, _, last in stats.values() if last is not None]
+    timeline_points = sum(counts)
+    timeline = {
+        "lower_bound": max(counts, default=0),
+        "upper_bound": timeline_points,
+        "first_date": min(firsts).isoformat() if firsts else None,
+        "last_date": max(lasts).isoformat() if lasts else None,
+    }
+    if firsts:
+        start_us, end_us = to_epoch_us([min(firsts), max(lasts)]).tolist()
+
+    estimates = {}
+    blocks = []
+    write_rows = 0
+    for step, bid in enumerate(plan.order, start=1):
+        block = plan.id_to_block[bid]
+        cls = block["class"]
+        inputs = plan.inputs_map[bid]
+        entry = {"step": step, "block_id": bid, "class": cls, "inputs": list(inputs)}
+
+        if cls == "ReadVar":
+            if bid in plan.own_timeline_block_ids:
+                estimate = stats[block["parameters"]["Id"]][0]
+                entry["timeline"] = "own"
+            else:
+                estimate = timeline_points
+        elif cls in ARITHMETIC_CLASSES or cls == "Expression":
+            sizes = [estimates[parent] for parent in inputs]
+            join = plan.join_specs.get(bid)
+            if join is None or join[0] == "inner":
+                estimate = min(sizes, default=0)
+            elif join[0] == "asof":
+                estimate = sizes[0]
+            else:
+                estimate = sum(sizes)
+            if join is not None:
+                entry["join"] = join[0]
+        elif cls == "PeriodicCalc":
+            spec = plan.periodic_specs[bid]
+            buckets = 0
+            if firsts:
+                buckets = int((spec.bucket_start(end_us) - spec.bucket_start(start_us)) // spec.period_us) + 1
+            source = estimates[inputs[0]] if inputs else 0
+            estimate = min(buckets, source)
+            entry.update({
+                "operation": spec.operation,
+                "period_minutes": spec.period_us / 60_000_000,
+                "expected_buckets": buckets,
+                "pushdown": bid in plan.pushdown_block_ids,
+            })
+        elif cls == "RollingCalc":
+            # Une valeur par point d'entrée
+            spec = plan.rolling_specs[bid]
+            estimate = estimates[inputs[0]] if inputs else 0
+            entry.update({"operation": spec.operation, "window_minutes": spec.window_us / 60_000_000})
+        elif cls == "WriteVar":
+            estimate = estimates[inputs[0]] if inputs else 0
+            entry["variable_id"] = block["parameters"]["Id"]
+            write_rows += estimate
+        else:
+            raise ValueError(f"Type de bloc inconnu: {cls}")
+
+        estimates[bid] = estimate
+        entry["estimated_points"] = estimate
+        entry["shared"] = bid in plan.shared_block_ids
+        blocks.append(entry)
+
+    return {
+        "evaluation_order": list(plan.order),
+        "shared_blocks": sorted(plan.shared_block_ids),
+        "skipped_blocks": sorted(bid for bid in plan.id_to_block if bid not in estimates),
+        "pushdown_blocks": list(plan.pushdown_block_ids),
+        "read_vars": read_vars,
+        "timeline": timeline,
+        "blocks": blocks,
+        "estimated_rows_written": write_rows,
+        "estimated_rows_qualified": sum(count for count, _, _ in stats.values()),
+        "plan": describe_plan(plan),
+    }
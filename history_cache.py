@@ -0,0 +1,273 @@
+from collections import OrderedDict, defaultdict
+import threading
+import time
+
+import numpy as np
+
+from series import from_epoch_us, to_epoch_us
+
+
+class HistoryCache:
+    """Process-wide LRU cache of loaded variable histories, bounded in bytes.
+
+    Entries are keyed by (id_variable, since): `since` None holds the
+    unqualified rows, otherwise every row acquired at or after `since`
+    (epoch µs), and a request for a later `since` is served by slicing such
+    an entry. Each entry keeps the highest row version among its loaded rows.
+    Entries older than `max_age` seconds are not served. Cached arrays are
+    read-only and shared by every reader.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, max_age=300.0):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._keys = defaultdict(set)
+        # Incrémenté à chaque invalidation : un chargement commencé avant n'est pas mis en cache
+        self._versions = defaultdict(int)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes_served = 0
+        self.bytes_loaded = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _lookup(self, var_id, since):
+        if since is None:
+            return (var_id, None) if (var_id, None) in self._entries else None
+        # Entrée couvrant la plage demandée la plus étroite
+        starts = [start for _, start in self._keys[var_id] if start is not None and start <= since]
+        return (var_id, max(starts)) if starts else None
+
+    def _drop(self, key):
+        timestamps, values, _, _ = self._entries.pop(key)
+        self._keys[key[0]].discard(key)
+        if not self._keys[key[0]]:
+            del self._keys[key[0]]
+        self._bytes -= timestamps.nbytes + values.nbytes
+
+    def get(self, var_id, since=None):
+        """(timestamps, values, row version) cached for a load_histories request, or None"""
+        with self._lock:
+            key = self._lookup(var_id, since)
+            if key is None:
+                return None
+            timestamps, values, row_version, stored_at = self._entries[key]
+            if self.max_age is not None and time.monotonic() - stored_at > self.max_age:
+                self._drop(key)
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+        if since is not None and key[1] != since:
+            start = np.searchsorted(timestamps, since)
+            timestamps, values = timestamps[start:], values[start:]
+        return timestamps, values, row_version
+
+    def version(self, var_id):
+        with self._lock:
+            return self._versions[var_id]
+
+    def put(self, var_id, since, timestamps, values, version=None, row_version=None):
+        """Store a loaded history, evicting the least recently used entries beyond max_bytes.
+
+        With `version` (taken before loading), nothing is stored if the
+        variable was invalidated meanwhile. `row_version` is the highest row
+        version of the loaded rows (None without the version column).
+        """
+        nbytes = timestamps.nbytes + values.nbytes
+        with self._lock:
+            self.bytes_loaded += nbytes
+            if nbytes > self.max_bytes or version is not None and version != self._versions[var_id]:
+                return
+            key = (var_id, since)
+            if key in self._entries:
+                self._drop(key)
+            timestamps.flags.writeable = False
+            values.flags.writeable = False
+            self._entries[key] = (timestamps, values, row_version, time.monotonic())
+            self._keys[var_id].add(key)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def record(self, served, misses):
+        """Count the histories served from the cache and the ones that had to be loaded"""
+        with self._lock:
+            for timestamps, values in served:
+                self.hits += 1
+                self.bytes_served += timestamps.nbytes + values.nbytes
+            self.misses += misses
+
+    def invalidate(self, var_id, unqualified_only=False, stale=False):
+        """Drop the entries of a variable (only its unqualified rows with `unqualified_only`)"""
+        with self._lock:
+            self._versions[var_id] += 1
+            for key in list(self._keys.get(var_id, ())):
+                if unqualified_only and key[1] is not None:
+                    continue
+                self._drop(key)
+                if stale:
+                    self.stale += 1
+                else:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "variables": len(self._keys),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "bytes_served": self.bytes_served,
+                "bytes_loaded": self.bytes_loaded,
+            }
+
+
+def _fingerprint(history):
+    """(count, first date, last date) of a history, as returned by load_history_stats"""
+    timestamps = history[0]
+    if not len(timestamps):
+        return 0, None, None
+    return (len(timestamps), *from_epoch_us([timestamps[0], timestamps[-1]]))
+
+
+def _unchanged(history, row_version, stats):
+    """Whether load_history_stats still matches a cached history.
+
+    Row versions only grow, so a row inserted or corrected since the load
+    has a version above the highest one it read; deleted rows change the
+    count. Without the version column, only the count and dates are compared.
+    """
+    if _fingerprint(history) != tuple(stats[:3]):
+        return False
+    if len(stats) == 3:
+        return True
+    current = stats[3]
+    return current is None or row_version is not None and current <= row_version
+
+
+class CachedStorage:
+    """Storage proxy reading histories through a HistoryCache.
+
+    A cached history is only served once a COUNT/MIN/MAX query on its rows
+    (load_history_stats) still matches it and finds no row version above the
+    highest one it loaded, so rows inserted, qualified or corrected in place
+    by other processes are not missed; qualification does not change row
+    versions, so entries of qualified rows stay valid. Without the version
+    column (see migrate.py) corrections that keep the count and first/last
+    dates go unnoticed until `max_age`. Writes invalidate every entry of the
+    variable and qualification its unqualified rows; until the end of the
+    transaction these entries bypass the cache, so that a rollback never
+    leaves uncommitted data cached.
+    """
+
+    def __init__(self, storage, cache):
+        self._storage = storage
+        self._cache = cache
+        self._written = set()
+        self._qualified = set()
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    def _bypass(self, var_id, since):
+        return var_id in self._written or since is None and var_id in self._qualified
+
+    def load_histories(self, variable_ids, since=None):
+        unique_ids = list(dict.fromkeys(variable_ids))
+        since_us = int(to_epoch_us([since])[0]) if since is not None else None
+
+        candidates = {}
+        for var_id in unique_ids:
+            if not self._bypass(var_id, since):
+                entry = self._cache.get(var_id, since_us)
+                if entry is not None:
+                    candidates[var_id] = entry
+
+        versioned = self._storage.has_history_versions()
+        histories = {}
+        if candidates:
+            stats = self._storage.load_history_stats(list(candidates), since=since, with_version=versioned)
+            for var_id, (timestamps, values, row_version) in candidates.items():
+                if _unchanged((timestamps, values), row_version, tuple(stats[var_id])):
+                    histories[var_id] = timestamps, values
+                else:
+                    self._cache.invalidate(var_id, stale=True)
+        self._cache.record(histories.values(), len(unique_ids) - len(histories))
+
+        missing = [var_id for var_id in unique_ids if var_id not in histories]
+        if missing:
+            versions = {var_id: self._cache.version(var_id) for var_id in missing}
+            # Versions lues avec les lignes : toute correction ultérieure en pose une plus grande
+            if versioned:
+                loaded, row_versions = self._storage.load_histories(missing, since=since, with_version=True)
+            else:
+                loaded, row_versions = self._storage.load_histories(missing, since=since), {}
+            for var_id, history in loaded.items():
+                if not self._bypass(var_id, since):
+                    self._cache.put(
+                        var_id, since_us, *history, version=versions[var_id], row_version=row_versions.get(var_id)
+                    )
+                histories[var_id] = history
+        return histories
+
+    def write_series(self, var_id, series, *args, **kwargs):
+        self._written.add(var_id)
+        self._cache.invalidate(var_id)
+        return self._storage.write_series(var_id, series, *args, **kwargs)
+
+    def write_many(self, outputs, *args, **kwargs):
+        for var_id, _ in outputs:
+            self._written.add(var_id)
+            self._cache.invalidate(var_id)
+        return self._storage.write_many(outputs, *args, **kwargs)
+
+    def qualify_histories(self, histories, *args, **kwargs):
+        for var_id, (timestamps, _) in histories.items():
+            if len(timestamps):
+                self._qualified.add(var_id)
+                self._cache.invalidate(var_id, unqualified_only=True)
+        return self._storage.qualify_histories(histories, *args, **kwargs)
+
+    def aggregate_history(self, var_id, specs):
+        self._qualified.add(var_id)
+        self._cache.invalidate(var_id, unqualified_only=True)
+        return self._storage.aggregate_history(var_id, specs)
+
+    def _end_transaction(self):
+        # Les lectures concurrentes faites avant la fin de la transaction ne restent pas en cache
+        for var_id in self._written:
+            self._cache.invalidate(var_id)
+        for var_id in self._qualified - self._written:
+            self._cache.invalidate(var_id, unqualified_only=True)
+        self._written.clear()
+        self._qualified.clear()
+
+    def commit(self):
+        self._storage.commit()
+        self._end_transaction()
+
+    def rollback(self):
+        self._storage.rollback()
+        self._end_transaction()
@@ -0,0 +1,194 @@
+import numpy as np
+
+from series import Series, from_epoch_us
+
+INTERPOLATION_METHODS = ("linear", "step", "nearest")
+
+
+def interpolation_spec(parameters):
+    """Read the interpolation settings of a ReadVar block (max_gap is in minutes)"""
+    method = str(parameters.get("interpolation", "linear")).lower().strip()
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError(f"Méthode d'interpolation inconnue : {method}")
+    max_gap = parameters.get("max_gap")
+    max_gap_us = int(float(max_gap) * 60 * 1_000_000) if max_gap is not None else None
+    return method, max_gap_us
+
+
+def build_timeline(timestamp_arrays):
+    """Sorted union of every timestamp array"""
+    if not timestamp_arrays:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(timestamp_arrays))
+
+
+def interpolate(sample_ts, sample_vals, timeline, method="linear", max_gap=None):
+    """Fill `timeline` from sorted samples in a single vectorized pass.
+
+    Timestamps present in the samples keep their value (NULL stays NULL).
+    The others are computed from the surrounding non-null samples; before the
+    first or after the last sample the nearest value is repeated. When
+    `max_gap` (µs) is given, holes wider than it are left empty.
+    Returns (values, valid) where invalid entries are NaN.
+    """
+    timeline = np.asarray(timeline, dtype=np.int64)
+    values = np.full(len(timeline), np.nan)
+    if len(timeline) == 0 or len(sample_ts) == 0:
+        return values, np.zeros(len(timeline), dtype=bool)
+
+    pos = np.searchsorted(sample_ts, timeline)
+    exact = np.zeros(len(timeline), dtype=bool)
+    in_range = pos < len(sample_ts)
+    exact[in_range] = sample_ts[pos[in_range]] == timeline[in_range]
+    values[exact] = sample_vals[pos[exact]]
+
+    known = ~np.isnan(sample_vals)
+    known_ts = sample_ts[known]
+    known_vals = sample_vals[known]
+    missing = ~exact
+    if len(known_ts) and missing.any():
+        t = timeline[missing]
+        right = np.searchsorted(known_ts, t)
+        left = right - 1
+        has_prev = left >= 0
+        has_next = right < len(known_ts)
+        prev_ts = known_ts[np.clip(left, 0, None)]
+        next_ts = known_ts[np.clip(right, None, len(known_ts) - 1)]
+        prev_vals = known_vals[np.clip(left, 0, None)]
+        next_vals = known_vals[np.clip(right, None, len(known_ts) - 1)]
+
+        if method == "linear":
+            filled = np.interp(t.astype(np.float64), known_ts.astype(np.float64), known_vals)
+        elif method == "step":
+            filled = np.where(has_prev, prev_vals, next_vals)
+        elif method == "nearest":
+            take_prev = has_prev & (~has_next | (t - prev_ts <= next_ts - t))
+            filled = np.where(take_prev, prev_vals, next_vals)
+        else:
+            raise ValueError(f"Méthode d'interpolation inconnue : {method}")
+
+        if max_gap is not None:
+            gap = np.where(
+                has_prev & has_next,
+                next_ts - prev_ts,
+                np.where(has_prev, t - prev_ts, next_ts - t),
+            )
+            filled = np.where(gap <= max_gap, filled, np.nan)
+        values[missing] = filled
+
+    return values, ~np.isnan(values)
+
+
+def fill_series(histories, variable_ids, specs=None):
+    """Align every variable on the union timeline.
+
+    `histories` maps a variable id to its sorted (timestamps, values) arrays,
+    `specs` is an optional list parallel to `variable_ids` of
+    (method, max_gap) tuples. Returns the timeline and one Series per
+    entry of `variable_ids`, all sharing the same timestamp array.
+    """
+    if specs is None:
+        specs = [("linear", None)] * len(variable_ids)
+    timeline = build_timeline([histories[var_id][0] for var_id in set(variable_ids)])
+
+    columns = []
+    for var_id, (method, max_gap) in zip(variable_ids, specs):
+        sample_ts, sample_vals = histories[var_id]
+        values, valid = interpolate(sample_ts, sample_vals, timeline, method, max_gap)
+        columns.append(Series(timeline, values, valid))
+    return timeline, columns
+
+
+def fill_missing(histories, variable_ids, specs=None):
+    """Same as fill_series, as [(date, [value per variable]), ...] with None for gaps"""
+    timeline, columns = fill_series(histories, variable_ids, specs)
+    values = [np.where(column.valid, column.values, None).tolist() for column in columns]
+    dates = from_epoch_us(timeline)
+    return [(date, [column[i] for column in values]) for i, date in enumerate(dates)]
+
+
+class TimelineStream:
+    """Chunked counterpart of fill_series for time-ordered batches of samples.
+
+    A point of the union timeline is only released once every variable has
+    a non-null sample at or after it (or when the stream ends), so each
+    point is interpolated from the same neighbours as with the whole
+    history. For a variable lagging behind the chunks (see lagging()),
+    that sample is its next one read ahead from the database, or known not
+    to exist. Only the unreleased samples and the last known one per
+    variable are kept in memory.
+    """
+
+    def __init__(self, variable_ids, specs=None):
+        self.variable_ids = variable_ids
+        self.specs = specs if specs is not None else [("linear", None)] * len(variable_ids)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0))
+        self.buffers = {var_id: empty for var_id in set(variable_ids)}
+        self.released_until = None
+
+    def push(self, histories):
+        """Append a chunk {var_id: (timestamps, values)} later than everything pushed before"""
+        for var_id, (timestamps, values) in histories.items():
+            buffered_ts, buffered_vals = self.buffers[var_id]
+            self.buffers[var_id] = (
+                np.concatenate([buffered_ts, timestamps]),
+                np.concatenate([buffered_vals, values]),
+            )
+
+    def lagging(self, horizon):
+        """Variables whose last buffered non-null sample is before `horizon` (epoch µs)"""
+        lagging = []
+        for var_id, (timestamps, values) in self.buffers.items():
+            known = timestamps[~np.isnan(values)]
+            if not len(known) or known[-1] < horizon:
+                lagging.append(var_id)
+        return lagging
+
+    def pop_ready(self, final=False, lookahead=None):
+        """Release the timeline points that can be interpolated: (timeline, [Series]).
+
+        `lookahead` maps lagging variables to their next non-null sample after
+        everything pushed (empty arrays when there is none); it takes part in
+        the interpolation but is not buffered, the real row coming in a later chunk.
+        """
+        lookahead = lookahead or {}
+        samples = dict(self.buffers)
+        for var_id, (timestamps, values) in lookahead.items():
+            if len(timestamps):
+                buffered_ts, buffered_vals = samples[var_id]
+                samples[var_id] = (np.concatenate([buffered_ts, timestamps]), np.concatenate([buffered_vals, values]))
+
+        limit = np.iinfo(np.int64).max
+        if not final:
+            for var_id, (timestamps, values) in samples.items():
+                if var_id in lookahead and not len(lookahead[var_id][0]):
+                    # Aucun échantillon à venir : la variable ne retient rien
+                    continue
+                known = timestamps[~np.isnan(values)]
+                if not len(known):
+                    return np.empty(0, dtype=np.int64), []
+                limit = min(limit, known[-1])
+
+        timeline = build_timeline([timestamps for timestamps, _ in self.buffers.values()])
+        if self.released_until is not None:
+            timeline = timeline[timeline > self.released_until]
+        timeline = timeline[timeline <= limit]
+
+        columns = []
+        for var_id, (method, max_gap) in zip(self.variable_ids, self.specs):
+            sample_ts, sample_vals = samples[var_id]
+            values, valid = interpolate(sample_ts, sample_vals, timeline, method, max_gap)
+            columns.append(Series(timeline, values, valid))
+
+        if len(timeline):
+            self.released_until = timeline[-1]
+            # Garder le dernier point connu comme contexte et tout ce qui n'est pas encore publié
+            for var_id, (timestamps, values) in self.buffers.items():
+                released = timestamps <= self.released_until
+                known = np.flatnonzero(released & ~np.isnan(values))
+                keep = ~released
+                if len(known):
+                    keep[known[-1]] = True
+                self.buffers[var_id] = (timestamps[keep], values[keep])
+
+        return timeline, columns
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job:
+    """State of one asynchronous rule execution"""
+
+    def __init__(self, rule_id, options=None):
+        self.job_id = uuid.uuid4().hex
+        self.rule_id = rule_id
+        self.options = dict(options or {})
+        self.status = QUEUED
+        self.submitted_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._started = None
+        self.duration_ms = None
+        self.progress = {"blocks_done": 0, "blocks_total": None, "rows_written": 0}
+        self.result = None
+        self.error = None
+        self.coalesced = 0
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def to_dict(self):
+        duration_ms = self.duration_ms
+        if duration_ms is None and self._started is not None:
+            duration_ms = round(1000 * (time.perf_counter() - self._started), 3)
+        return {
+            "job_id": self.job_id,
+            "rule_id": self.rule_id,
+            "options": dict(self.options),
+            "status": self.status,
+            "submitted_at": self.submitted_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "duration_ms": duration_ms,
+            "progress": dict(self.progress),
+            "coalesced_submissions": self.coalesced,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs rule executions on a local worker pool and keeps their status.
+
+    Submitting a rule that already has a queued or running job with the
+    same options returns that job instead of starting a second execution.
+    Only the `max_history` most recent finished jobs are kept.
+    """
+
+    def __init__(self, workers=2, max_history=500):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rule-job")
+        self._jobs = OrderedDict()
+        # Job actif par (règle, options)
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, rule_id, run, options=None):
+        """Queue run(progress) for a rule executed with `options` (dict); returns (job, coalesced)"""
+        key = (rule_id, tuple(sorted((options or {}).items())))
+        with self._lock:
+            active_id = self._active.get(key)
+            if active_id is not None:
+                job = self._jobs[active_id]
+                job.coalesced += 1
+                return job, True
+
+            job = Job(rule_id, options)
+            self._jobs[job.job_id] = job
+            self._active[key] = job.job_id
+            self._prune()
+
+        self._executor.submit(self._run, job, run, key)
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list(self, rule_id=None):
+        with self._lock:
+            return [
+                job.to_dict() for job in reversed(self._jobs.values())
+                if rule_id is None or job.rule_id == rule_id
+            ]
+
+    def _run(self, job, run, key):
+        job.status = RUNNING
+        job.started_at = datetime.now()
+        job._started = time.perf_counter()
+
+        def progress(blocks_done, blocks_total, rows_written):
+            job.progress = {
+                "blocks_done": blocks_done,
+                "blocks_total": blocks_total,
+                "rows_written": rows_written,
+            }
+
+        try:
+            result = run(progress)
+            if "error" in result:
+                job.error = result["error"]
+                job.status = FAILED
+            else:
+                job.status = SUCCEEDED
+            job.result = result
+        except Exception as e:
+            logger.error(f"Job {job.job_id} for rule {job.rule_id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = datetime.now()
+            job.duration_ms = round(1000 * (time.perf_counter() - job._started), 3)
+            with self._lock:
+                if self._active.get(key) == job.job_id:
+                    del self._active[key]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
@@ -1,172 +1,82 @@
+import argparse
+from contextlib import closing, contextmanager
 import json
-from database import get_connection, get_rule_json, interpolate_missing_values
-from collections import defaultdict
-import math
+from batch import run_batch, run_fused
+from database import get_connection
+from engine import compile_rule
+from history_cache import CachedStorage, HistoryCache
+from optimizer import optimize_plan
+from storage import SqliteStorage, SqlServerStorage
+
+def storage_opener(sqlite_path=None, history_cache=None):
+    """Callable opening a storage per rule: SQL Server, or an SQLite file,
+    reading histories through `history_cache` when given"""
+    def cached(storage):
+        return CachedStorage(storage, history_cache) if history_cache is not None else storage
+
+    @contextmanager
+    def open_storage():
+        if sqlite_path:
+            with closing(SqliteStorage(sqlite_path)) as storage:
+                yield cached(storage)
+        else:
+            with closing(get_connection()) as conn, closing(SqlServerStorage(conn)) as storage:
+                yield cached(storage)
+    return open_storage
 
 def main():
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Charger la règle depuis la base
-    json_text = get_rule_json(cursor, 1)
-    if not json_text:
-        raise Exception("Aucune règle trouvée dans la base")
-
-    json_data = json.loads(json_text)
-    blocks = json_data["blocks"]
-    links = json_data["links"]
-
-    # Associer un ID interne à chaque bloc
-    id_to_block = {i + 1: block for i, block in enumerate(blocks)}
-
-    # Création des maps d'entrées et de sorties
-    inputs_map = defaultdict(list)
-    outputs_map = defaultdict(list)
-    for link in links:
-        inputs_map[link["child"]].append(link["parent"])
-        outputs_map[link["parent"]].append(link["child"])
-
-    # Récupération de tous les IDs des variables sources
-    variable_ids = [
-        block["parameters"]["Id"]
-        for block in blocks
-        if block["class"] == "ReadVar"
-    ]
-
-    # Charger toutes les valeurs interpolées
-    dated_values = interpolate_missing_values(cursor, variable_ids)
-    var_index_map = {var_id: idx for idx, var_id in enumerate(variable_ids)}
-
-    # Fonction récursive pour évaluer un bloc
-    def evaluate_block(bid):
-        block = id_to_block[bid]
-        cls = block["class"]
-
-        if cls == "ReadVar":
-            var_id = block["parameters"]["Id"]
-            idx = var_index_map[var_id]
-            return [(date, values[idx]) for date, values in dated_values]
-
-        elif cls in ('+', '-', '*', '/'):
-            input_data_list = [evaluate_block(inp) for inp in inputs_map[bid]] 
-        # input_data_list = [
-        # [(2025-08-01, 10), (2025-08-02, 12)],   
-        # [(2025-08-01, 5),  (2025-08-02, 7)] 
-        # ]
-            results = []
-            for i in range(len(input_data_list[0])):
-                date = input_data_list[0][i][0]
-                vals = [inp[i][1] for inp in input_data_list]
-                #le but ici c de rassembler les valeurs de chaque variable pour une date donnee afin d'appliquer operation sur eux
-                if cls == '+':
-                    res = sum(vals)
-                elif cls == '-':
-                    res = vals[0] - sum(vals[1:])
-                elif cls == '*':
-                    res = math.prod(vals)
-                elif cls == '/':
-                    res = vals[0]
-                    for v in vals[1:]:
-                        if v == 0:
-                            res = None
-                            break
-                        res /= v
-                results.append((date, res))
-            return results
-
-        elif cls == "PeriodicCalc":
-            input_data = evaluate_block(inputs_map[bid][0])
-            operation = block["parameters"]["operation"].lower().strip()
-            period_minutes = block["parameters"].get("period", 60)
-            validity_rate = block["parameters"].get("validity_rate", 0)  # %
-            period_seconds = period_minutes * 60
-
-            if not input_data:
-                return []
-
-            grouped_data = defaultdict(list)
-            for date, value in input_data:
-                period_index = math.floor(date.timestamp() / period_seconds)
-                grouped_data[period_index].append((date, value))
-
-            results = []
-            for group_idx, group_values in grouped_data.items():
-                dates = [d for d, _ in group_values]
-                vals = [v for _, v in group_values if v is not None]
-
-                total_points = len(group_values)
-                valid_points = len(vals)
-                if total_points == 0:
-                    continue
-                percentage_valid = (valid_points / total_points) * 100
-                if percentage_valid < validity_rate:
-                    continue  
-
-                if not vals:
-                    continue
-
-                if operation == "moyenne":
-                    res = sum(vals) / len(vals)
-                elif operation == "somme":
-                    res = sum(vals)
-                elif operation == "maximum":
-                    res = max(vals)
-                elif operation == "minimum":
-                    res = min(vals)
-                elif operation == "premiere":
-                    res = vals[0]
-                elif operation == "derniere":
-                    res = vals[-1]
-                else:
-                    raise ValueError(f"Opération périodique inconnue : {operation}")
-
-                # ⚠ Arrondir la date au début de l'heure (ex: 13:27 -> 13:00)
-                aligned_date = dates[0].replace(minute=0, second=0, microsecond=0)
-                results.append((aligned_date, res))
-
-            results.sort(key=lambda x: x[0])
-            return results
-
-
-        elif cls == "WriteVar":
-            results = evaluate_block(inputs_map[bid][0])
-            var_id = block["parameters"]["Id"]
-            for date, res in results:
-                # On s'assure de ne pas dupliquer si déjà présent
-                cursor.execute("""
-                    IF NOT EXISTS (
-                        SELECT 1 FROM his_valeur 
-                        WHERE id_variable = ? AND date_acquisition = ?
-                    )
-                    INSERT INTO his_valeur (
-                        id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide
-                    )
-                    VALUES (?, ?, 1, GETDATE(), ?, ?)
-                """, (var_id, date, var_id, date, res, res))
-            return results
-
-
+    parser = argparse.ArgumentParser(description="Exécuter des règles de ref_regle")
+    parser.add_argument("rule_ids", nargs="*", type=int, default=[1], help="IDs des règles (défaut : 1)")
+    parser.add_argument("--workers", type=int, default=4, help="Règles exécutées en parallèle")
+    parser.add_argument("--incremental", action="store_true", help="Ne traiter que les nouvelles données")
+    parser.add_argument("--chunk-rows", type=int, default=None, help="Taille des morceaux (mémoire bornée)")
+    parser.add_argument("--sqlite", default=None, help="Fichier SQLite à utiliser à la place de SQL Server")
+    parser.add_argument("--no-optimize", action="store_true", help="Exécuter le graphe tel que dessiné")
+    parser.add_argument("--no-pushdown", action="store_true", help="Agréger en Python plutôt qu'en SQL")
+    parser.add_argument("--history-cache-mb", type=float, default=256,
+                        help="Mémoire du cache des historiques partagé entre les règles (0 : désactivé)")
+    parser.add_argument("--fused", action="store_true",
+                        help="Évaluer les règles d'un même niveau comme un seul graphe (entrées lues une fois)")
+    args = parser.parse_args()
+    if args.fused and (args.incremental or args.chunk_rows):
+        parser.error("--fused ne s'utilise qu'en mode complet (sans --incremental ni --chunk-rows)")
+    history_cache = HistoryCache(int(args.history_cache_mb * 2 ** 20)) if args.history_cache_mb > 0 else None
+    open_storage = storage_opener(args.sqlite, history_cache)
+
+    # Charger et compiler les règles depuis la base
+    plans = {}
+    with open_storage() as storage:
+        for rule_id in dict.fromkeys(args.rule_ids):
+            json_text = storage.get_rule_json(rule_id)
+            if not json_text:
+                raise Exception(f"Aucune règle {rule_id} trouvée dans la base")
+            plan = compile_rule(json.loads(json_text))
+            plans[rule_id] = plan if args.no_optimize else optimize_plan(plan)
+
+    if args.fused:
+        # Un graphe fusionné par niveau de dépendance, une transaction par niveau
+        result = run_fused(plans, open_storage)
+        for level in result["fused_levels"]:
+            print(f"Règles {level['rules']} : {level['variables']} variables lues, "
+                  f"{level['evaluated_blocks']}/{level['blocks']} blocs évalués, "
+                  f"{level['rows_written']} valeurs écrites, {level['qualified_rows']} lignes qualifiées")
+    else:
+        # Les règles indépendantes tournent en parallèle, chacune dans sa transaction
+        result = run_batch(
+            plans, open_storage, workers=args.workers,
+            incremental=args.incremental, chunk_rows=args.chunk_rows, pushdown=not args.no_pushdown,
+        )
+
+    for rule in result["rules"]:
+        details = rule["result"]
+        if rule["status"] == "success" and args.fused:
+            print(f"Règle {rule['rule_id']} : {details['output_values']} valeurs calculées ({rule['duration_ms']} ms)")
+        elif rule["status"] == "success":
+            print(f"Règle {rule['rule_id']} : {details['rows_written']} valeurs écrites, "
+                  f"{details['qualified_rows']} lignes qualifiées ({rule['duration_ms']} ms)")
         else:
-            raise ValueError(f"Type de bloc inconnu: {cls}")
-
-    # Lancer le calcul pour chaque WriteVar
-    end_blocks = [bid for bid, block in id_to_block.items() if block["class"] == "WriteVar"]
-    for end_bid in end_blocks:
-        evaluate_block(end_bid)
-
-    # Marquer les variables sources comme qualifiées
-    for date, _ in dated_values:
-        for var_id in variable_ids:
-            cursor.execute("""
-                UPDATE his_valeur
-                SET id_qualification = 1
-                WHERE id_variable = ? AND date_acquisition = ? AND id_qualification = 0
-            """, (var_id, date))
-
-    conn.commit()
-    print("Traitement terminé.")
-    cursor.close()
-    conn.close()
+            print(f"Règle {rule['rule_id']} : {rule['status']} - {details['error']}")
+    print(f"Traitement terminé en {result['duration_ms']} ms.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+from collections import defaultdict
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metrics:
+    """Process-wide counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(labels.items()))] += value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = (name, tuple(labels.items()))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def observe_profile(self, profile, mode, status):
+        """Aggregate a profiling.Profile of one rule execution"""
+        self.inc("rule_executions_total", mode=mode, status=status)
+        for stats in profile.blocks.values():
+            self.observe("rule_block_duration_seconds", stats["seconds"], block_class=stats["class"])
+            self.inc("rule_block_output_points_total", stats["output_points"], block_class=stats["class"])
+        for phase, stats in profile.phases.items():
+            self.observe("rule_phase_duration_seconds", stats["seconds"], phase=phase)
+            self.inc("rule_phase_queries_total", stats["queries"], phase=phase)
+
+    def render(self, gauges=None):
+        """Text exposition of every metric, plus `gauges` {name: value} read at scrape time"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = self._help.get(name, (kind, ""))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, value in sorted((gauges or {}).items()):
+            header(name, "gauge")
+            lines.append(f"{name} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
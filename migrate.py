@@ -0,0 +1,20 @@
+from contextlib import closing
+from database import ensure_history_version_column, ensure_rule_version_column, get_connection
+
+# Changements de schéma appliqués une fois, hors des requêtes de l'API (idempotents)
+MIGRATIONS = [
+    ("ref_regle.version_ligne (rowversion + index)", ensure_rule_version_column),
+    ("his_valeur.version_ligne (séquence + trigger)", ensure_history_version_column),
+]
+
+def main():
+    with closing(get_connection()) as conn:
+        cursor = conn.cursor()
+        for description, migration in MIGRATIONS:
+            migration(cursor)
+            conn.commit()
+            print(f"{description} : ok")
+        cursor.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from collections import defaultdict
+import json
+
+from engine import ARITHMETIC_CLASSES, RulePlan
+
+# Paramètres purement descriptifs, ignorés pour comparer deux blocs
+COSMETIC_PARAMETERS = ("Name", "fused_blocks")
+
+
+def _block_key(block, inputs):
+    parameters = {k: v for k, v in block["parameters"].items() if k not in COSMETIC_PARAMETERS}
+    return block["class"], json.dumps(parameters, sort_keys=True, default=str), tuple(inputs)
+
+
+def optimize_plan(plan):
+    """Optimized copy of a compiled RulePlan.
+
+    - dead blocks: computed blocks that reach no WriteVar are dropped;
+      unconnected ReadVars are kept, since their rows still add dates to
+      the union timeline and get qualified, so the output is unchanged;
+    - common subexpressions: blocks with the same class, parameters and
+      inputs are merged (WriteVars are always kept);
+    - arithmetic fusion: an arithmetic block consumed only by another
+      arithmetic block is inlined into it, the chain becoming a single
+      "Expression" block evaluated without intermediate Series.
+
+    The returned plan lists what was done in `optimizations`.
+    """
+    optimizations = []
+    needed = set(plan.order)
+    dead_reads = [bid for bid in plan.read_block_ids if bid not in needed]
+    removed = sorted(bid for bid in plan.id_to_block if bid not in needed and bid not in dead_reads)
+    if removed:
+        optimizations.append({"rule": "dead_blocks", "removed": removed})
+
+    # Élimination des sous-expressions communes, dans l'ordre topologique
+    canonical = {}
+    seen = {}
+    inputs_map = {}
+    for bid in plan.order:
+        block = plan.id_to_block[bid]
+        inputs = [canonical[parent] for parent in plan.inputs_map[bid]]
+        key = _block_key(block, inputs)
+        if block["class"] != "WriteVar" and key in seen:
+            canonical[bid] = seen[key]
+            optimizations.append({"rule": "merge", "block": bid, "into": seen[key]})
+            continue
+        seen[key] = canonical[bid] = bid
+        inputs_map[bid] = inputs
+    order = [bid for bid in plan.order if canonical[bid] == bid]
+
+    consumers = defaultdict(list)
+    for bid in order:
+        for parent in inputs_map[bid]:
+            consumers[parent].append(bid)
+
+    # Fusion des chaînes arithmétiques : un bloc arithmétique utilisé une seule
+    # fois, par un autre bloc arithmétique, est intégré à l'expression de celui-ci
+    # (les blocs qui joignent des entrées de timelines différentes ne sont pas fusionnés)
+    def arithmetic(bid):
+        return plan.id_to_block[bid]["class"] in ARITHMETIC_CLASSES and bid not in plan.join_specs
+
+    inlined = {
+        bid for bid in order
+        if arithmetic(bid) and len(consumers[bid]) == 1 and arithmetic(consumers[bid][0])
+    }
+
+    id_to_block = {bid: plan.id_to_block[bid] for bid in order}
+    for bid in order:
+        if bid in inlined or not arithmetic(bid):
+            continue
+        if not any(parent in inlined for parent in inputs_map[bid]):
+            continue
+
+        leaves, fused = [], []
+
+        def build(node):
+            fused.append(node)
+            children = []
+            for parent in inputs_map[node]:
+                if parent in inlined:
+                    children.append(build(parent))
+                else:
+                    children.append(["input", len(leaves)])
+                    leaves.append(parent)
+            return [plan.id_to_block[node]["class"], children]
+
+        expression = build(bid)
+        id_to_block[bid] = {
+            "class": "Expression",
+            "parameters": {"expression": expression, "fused_blocks": sorted(fused)},
+        }
+        inputs_map[bid] = leaves
+        optimizations.append({"rule": "fuse", "block": bid, "expression": format_expression(expression, leaves)})
+
+    # Les blocs intégrés à une expression fusionnée disparaissent du plan
+    order = [bid for bid in order if bid not in inlined]
+    id_to_block = {bid: id_to_block[bid] for bid in order}
+    # ReadVar non reliés : hors de l'ordre d'évaluation, mais chargés et qualifiés comme avant
+    id_to_block.update((bid, plan.id_to_block[bid]) for bid in dead_reads)
+    final_inputs = defaultdict(list, {bid: inputs_map[bid] for bid in order})
+    outputs_map = defaultdict(list)
+    for bid in order:
+        for parent in final_inputs[bid]:
+            outputs_map[parent].append(bid)
+
+    optimized = RulePlan(id_to_block, final_inputs, outputs_map, order)
+    optimized.optimizations = optimizations
+    return optimized
+
+
+def merge_plans(plans):
+    """One RulePlan evaluating several compiled rules {rule_id: RulePlan} at once.
+
+    Blocks with the same class, parameters and (merged) inputs are evaluated
+    once across rules. A ReadVar column depends on the union timeline of its
+    rule, so ReadVars are only shared between rules interpolating on the
+    same set of variables ("own" ReadVars between any rules). WriteVars are
+    never merged. Returns the plan and {(rule_id, block_id): merged block_id}.
+    """
+    id_to_block = {}
+    inputs_map = defaultdict(list)
+    seen = {}
+    mapping = {}
+    for rule_id in sorted(plans):
+        plan = plans[rule_id]
+        timeline = tuple(sorted(set(plan.timeline_variable_ids)))
+        for bid in plan.order:
+            block = plan.id_to_block[bid]
+            inputs = [mapping[(rule_id, parent)] for parent in plan.inputs_map[bid]]
+            key = _block_key(block, inputs)
+            if block["class"] == "ReadVar" and bid not in plan.own_timeline_block_ids:
+                key += (timeline,)
+            if block["class"] != "WriteVar" and key in seen:
+                mapping[(rule_id, bid)] = seen[key]
+                continue
+            merged = len(id_to_block) + 1
+            id_to_block[merged] = block
+            inputs_map[merged] = inputs
+            seen[key] = mapping[(rule_id, bid)] = merged
+
+    # Les blocs sont ajoutés dans l'ordre topologique de chaque règle
+    order = list(id_to_block)
+    outputs_map = defaultdict(list)
+    for bid in order:
+        for parent in inputs_map[bid]:
+            outputs_map[parent].append(bid)
+    return RulePlan(id_to_block, inputs_map, outputs_map, order), mapping
+
+
+def format_expression(expression, leaves):
+    """Readable form of an Expression tree, inputs shown as block IDs"""
+    if expression[0] == "input":
+        return f"#{leaves[expression[1]]}"
+    operator = f" {expression[0]} "
+    return "(" + operator.join(format_expression(child, leaves) for child in expression[1]) + ")"
+
+
+def describe_plan(plan):
+    """Debugging view of a plan: evaluation order, block inputs and applied optimizations"""
+    steps = []
+    for bid in plan.order:
+        block = plan.id_to_block[bid]
+        step = {"block_id": bid, "class": block["class"], "inputs": list(plan.inputs_map[bid])}
+        if block["class"] == "Expression":
+            step["expression"] = format_expression(block["parameters"]["expression"], plan.inputs_map[bid])
+            step["fused_blocks"] = block["parameters"]["fused_blocks"]
+        else:
+            step["parameters"] = block["parameters"]
+        steps.append(step)
+    return {
+        "order": steps,
+        "variable_ids": plan.variable_ids,
+        "optimizations": plan.optimizations,
+    }
@@ -0,0 +1,187 @@
+from collections import deque
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout"""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of DB-API connections.
+
+    Idle connections older than `max_lifetime` seconds are replaced, those
+    unused for more than `ping_after` seconds are checked with `SELECT 1`
+    before being handed out, and `acquire` waits at most `checkout_timeout`
+    seconds for a free slot before raising PoolTimeout. Connections are
+    rolled back when returned so uncommitted work never leaks between users.
+    """
+
+    def __init__(self, factory, max_size=10, max_lifetime=1800, checkout_timeout=30, ping_after=60):
+        self.factory = factory
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+
+        self._lock = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._opening = 0
+
+        self._created = 0
+        self._discarded = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self):
+        """Check out a healthy connection, opening one if the pool is not full"""
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+
+        while True:
+            with self._lock:
+                while True:
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        # Compté comme utilisé pendant sa vérification (ping), pour ne pas dépasser max_size
+                        self._in_use[id(pooled.conn)] = pooled
+                        break
+                    if len(self._in_use) + self._opening < self.max_size:
+                        pooled = None
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.checkout_timeout}s"
+                        )
+                    waited = True
+                    self._lock.wait(remaining)
+
+            if pooled is None:
+                try:
+                    pooled = _PooledConnection(self.factory())
+                finally:
+                    with self._lock:
+                        self._opening -= 1
+                        if pooled is None:
+                            self._lock.notify()
+                with self._lock:
+                    self._created += 1
+            elif not self._is_usable(pooled):
+                self._discard(pooled)
+                continue
+
+            wait = time.monotonic() - started
+            with self._lock:
+                self._in_use[id(pooled.conn)] = pooled
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            return pooled.conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool (rolled back), or close it if `discard`"""
+        with self._lock:
+            pooled = self._in_use.pop(id(conn))
+
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding pooled connection after failed rollback: {e}")
+                discard = True
+
+        if discard or self._expired(pooled):
+            self._discard(pooled)
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a `with` block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=not self._ping(conn))
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection (checked out ones are closed on release)"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "created": self._created,
+                "discarded": self._discarded,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(1000 * self._total_wait / self._checkouts, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(1000 * self._max_wait, 3),
+            }
+
+    def _expired(self, pooled):
+        return time.monotonic() - pooled.created_at > self.max_lifetime
+
+    def _is_usable(self, pooled):
+        if self._expired(pooled):
+            return False
+        if time.monotonic() - pooled.last_used > self.ping_after:
+            return self._ping(pooled.conn)
+        return True
+
+    def _ping(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._in_use.pop(id(pooled.conn), None)
+            self._discarded += 1
+            self._lock.notify()
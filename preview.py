@@ -0,0 +1,78 @@
+import numpy as np
+
+from series import Series
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+PREVIEW_POINTS = 500
+
+
+def lttb_indices(x, y, max_points):
+    """Indices kept by Largest-Triangle-Three-Buckets for a sorted series"""
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1][:max(max_points, 0)], dtype=np.int64)
+
+    x = (x - x[0]).astype(np.float64)
+    # Le premier et le dernier point sont toujours conservés
+    edges = np.r_[np.linspace(1, n - 1, max_points - 1).astype(np.int64), n]
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2]
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+
+        # Point du morceau formant le plus grand triangle avec le précédent et la moyenne du suivant
+        area = np.abs(
+            (x[previous] - avg_x) * (y[lo:hi] - y[previous])
+            - (x[previous] - x[lo:hi]) * (avg_y - y[previous])
+        )
+        previous = lo + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def minmax_indices(x, y, max_points):
+    """Indices of the minimum and maximum of max_points // 2 equal time buckets"""
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+    buckets = max(1, max_points // 2)
+
+    span = max(int(x[-1] - x[0]), 1)
+    bucket = np.minimum((x - x[0]) * buckets // span, buckets - 1)
+    order = np.lexsort((y, bucket))
+    starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    return np.unique(np.r_[order[starts], order[ends]])
+
+
+def downsample(series, max_points=PREVIEW_POINTS, method="lttb"):
+    """Valid points of a series reduced to at most `max_points` for display"""
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"Méthode de sous-échantillonnage inconnue : {method}")
+
+    timestamps = series.timestamps[series.valid]
+    values = series.values[series.valid]
+    if method == "lttb":
+        keep = lttb_indices(timestamps, values, max_points)
+    else:
+        keep = minmax_indices(timestamps, values, max_points)
+    return Series(timestamps[keep], values[keep])
+
+
+def series_preview(series, max_points=PREVIEW_POINTS, method="lttb"):
+    """JSON-ready preview of a block output: point counts and downsampled points"""
+    sample = downsample(series, max_points, method)
+    return {
+        "points": len(series),
+        "valid_points": series.valid_count(),
+        "returned_points": len(sample),
+        "series": [[date.isoformat(), float(value)] for date, value in sample.to_pairs()],
+    }
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+import time
+
+
+class Profile:
+    """Instrumentation of one rule execution: time, point counts and output
+    size per block, calls, SQL statements and time per storage phase"""
+
+    def __init__(self):
+        self.blocks = {}
+        self.phases = {}
+        self._current_phase = None
+
+    def wrap(self, storage):
+        return ProfiledStorage(storage, self)
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase; statements issued meanwhile are counted against it"""
+        stats = self.phases.setdefault(name, {"calls": 0, "queries": 0, "seconds": 0.0})
+        outer, self._current_phase = self._current_phase, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - started
+            self._current_phase = outer
+
+    def count_query(self):
+        if self._current_phase is not None:
+            self.phases[self._current_phase]["queries"] += 1
+
+    def record_block(self, block_id, cls, seconds, input_points, output):
+        """Add one evaluation of a block (several in chunked runs)"""
+        stats = self.blocks.setdefault(block_id, {
+            "class": cls, "evaluations": 0, "seconds": 0.0,
+            "input_points": 0, "output_points": 0, "output_bytes": 0,
+        })
+        stats["evaluations"] += 1
+        stats["seconds"] += seconds
+        stats["input_points"] += input_points
+        stats["output_points"] += len(output)
+        # Taille du plus gros résultat produit (mémoire tenue par le bloc)
+        stats["output_bytes"] = max(stats["output_bytes"], output.nbytes())
+
+    def to_dict(self):
+        return {
+            "blocks": {
+                str(block_id): {**stats, "seconds": round(stats["seconds"], 6)}
+                for block_id, stats in self.blocks.items()
+            },
+            "phases": {
+                name: {**stats, "seconds": round(stats["seconds"], 6)}
+                for name, stats in self.phases.items()
+            },
+        }
+
+
+class ProfiledStorage:
+    """Storage proxy running every storage call inside a phase of the profile"""
+
+    def __init__(self, storage, profile):
+        self._storage = storage
+        self._profile = profile
+        storage.instrument(profile.count_query)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self._profile.phase(name):
+                return attribute(*args, **kwargs)
+        return call
@@ -0,0 +1,114 @@
+from collections import deque
+
+import numpy as np
+
+from aggregation import MINUTE_US
+from series import Series
+
+ROLLING_OPERATIONS = ("moyenne", "somme", "maximum", "minimum", "ecart_type")
+
+
+class RollingSpec:
+    """Parsed parameters of a RollingCalc block"""
+
+    def __init__(self, operation, window_us, min_points=1):
+        self.operation = operation
+        self.window_us = window_us
+        self.min_points = min_points
+
+    def window_start(self, timestamps):
+        """Earliest input date (epoch µs) entering the window of each timestamp"""
+        return timestamps - self.window_us
+
+
+def rolling_spec(parameters):
+    """Read a RollingCalc block: operation, window (minutes) and min_points,
+    the number of valid points a window needs to produce a value"""
+    operation = parameters["operation"].lower().strip()
+    if operation not in ROLLING_OPERATIONS:
+        raise ValueError(f"Opération glissante inconnue : {operation}")
+
+    window_us = int(parameters.get("window", 60) * MINUTE_US)
+    if window_us <= 0:
+        raise ValueError("La fenêtre doit être strictement positive")
+    min_points = int(parameters.get("min_points", 1))
+    if min_points < 1:
+        raise ValueError("min_points doit être au moins 1")
+    return RollingSpec(operation, window_us, min_points)
+
+
+def _window_extreme(timestamps, values, valid, window_us, maximum):
+    """Max (or min) of the valid points of each window, with a monotonic deque.
+
+    The deque holds the indices of the valid points that can still be the
+    extreme of a later window, their values decreasing (increasing for the
+    min); every point enters and leaves it once.
+    """
+    timestamps, values, valid = timestamps.tolist(), values.tolist(), valid.tolist()
+    res = [np.nan] * len(timestamps)
+    window = deque()
+    for i, timestamp in enumerate(timestamps):
+        if valid[i]:
+            value = values[i]
+            while window and (values[window[-1]] <= value if maximum else values[window[-1]] >= value):
+                window.pop()
+            window.append(i)
+        limit = timestamp - window_us
+        while window and timestamps[window[0]] <= limit:
+            window.popleft()
+        if window:
+            res[i] = values[window[0]]
+    return np.array(res, dtype=np.float64)
+
+
+def rolling(series, spec):
+    """Time-based sliding window over a series, one output per input point.
+
+    The window of a point at t covers the points in (t - window, t], up to
+    and including the point itself. Sums and means come from running sums
+    (window bounds found by searchsorted), min/max from a monotonic deque,
+    so the cost is linear in the number of points whatever the window
+    length. A window with fewer than `min_points` valid points is invalid.
+    """
+    if not len(series):
+        return Series.empty()
+
+    timestamps, values, valid = series.timestamps, series.values, series.valid
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values, valid = timestamps[order], values[order], valid[order]
+
+    # Premier point de la fenêtre de chaque point
+    starts = np.searchsorted(timestamps, spec.window_start(timestamps), side="right")
+    ends = np.arange(1, len(timestamps) + 1)
+    running_counts = np.r_[0, np.cumsum(valid)]
+    counts = running_counts[ends] - running_counts[starts]
+
+    operation = spec.operation
+    samples = np.where(valid, values, 0.0)
+    if operation in ("moyenne", "somme"):
+        running_sums = np.r_[0.0, np.cumsum(samples)]
+        sums = running_sums[ends] - running_sums[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if operation == "moyenne":
+            res = sums / counts
+        elif operation == "somme":
+            res = sums
+        elif operation == "maximum":
+            res = _window_extreme(timestamps, values, valid, spec.window_us, maximum=True)
+        elif operation == "minimum":
+            res = _window_extreme(timestamps, values, valid, spec.window_us, maximum=False)
+        elif operation == "ecart_type":
+            # Écart type de population (ddof=0), à partir des sommes des carrés des
+            # écarts à la moyenne globale (limite les pertes de précision)
+            centered = np.where(valid, samples - samples[valid].mean(), 0.0) if valid.any() else samples
+            running_centered = np.r_[0.0, np.cumsum(centered)]
+            running_squares = np.r_[0.0, np.cumsum(centered * centered)]
+            mean = (running_centered[ends] - running_centered[starts]) / counts
+            variance = (running_squares[ends] - running_squares[starts]) / counts - mean * mean
+            res = np.sqrt(np.where(counts > 1, np.maximum(variance, 0.0), 0.0))
+        else:
+            raise ValueError(f"Opération glissante inconnue : {operation}")
+
+    keep = counts >= spec.min_points
+    return Series(timestamps, np.where(keep, res, np.nan), keep)
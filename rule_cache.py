@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from engine import compile_rule
+from optimizer import optimize_plan
+
+
+class RuleCache:
+    """In-process LRU cache of compiled rule plans.
+
+    Entries are keyed by (id_regle, sha256 of text_json), so an edited rule
+    never reuses a stale plan even if invalidation was missed. With
+    `optimize`, cached plans go through optimizer.optimize_plan.
+    """
+
+    def __init__(self, max_size=128, optimize=False):
+        self.max_size = max_size
+        self.optimize = optimize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def content_hash(json_text):
+        return hashlib.sha256(json_text.encode("utf-8")).hexdigest()
+
+    def get_plan(self, rule_id, json_text):
+        """Return the compiled plan of a rule, compiling it on a miss"""
+        key = (rule_id, self.content_hash(json_text))
+        with self._lock:
+            plan = self._entries.get(key)
+            if plan is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = compile_rule(json.loads(json_text))
+        if self.optimize:
+            plan = optimize_plan(plan)
+
+        with self._lock:
+            # Une seule version compilée par règle
+            for stale in [k for k in self._entries if k[0] == rule_id and k != key]:
+                del self._entries[stale]
+                self.invalidations += 1
+            self._entries[key] = plan
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return plan
+
+    def invalidate(self, rule_id):
+        """Drop every cached version of a rule"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == rule_id]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def to_epoch_us(dates):
+    """Convert naive datetimes to int64 epoch microseconds"""
+    return np.array(dates, dtype="datetime64[us]").astype(np.int64)
+
+
+def from_epoch_us(timestamps):
+    """Convert int64 epoch microseconds back to naive datetimes"""
+    return np.asarray(timestamps, dtype=np.int64).astype("datetime64[us]").tolist()
+
+
+def to_float_array(values):
+    """Convert raw SQL values (Decimal, int, None...) to float64, None becoming NaN"""
+    return np.array(values, dtype=np.float64)
+
+
+class Series:
+    """Columnar time series flowing between blocks.
+
+    `timestamps` are int64 epoch microseconds, `values` float64 and `valid`
+    a boolean mask; invalid entries (None in the old list form) hold NaN.
+    """
+
+    __slots__ = ("timestamps", "values", "valid")
+
+    def __init__(self, timestamps, values, valid=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if valid is None:
+            valid = ~np.isnan(self.values)
+        self.valid = np.asarray(valid, dtype=bool)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty(0))
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build a series from a list of (datetime, value or None)"""
+        return cls(
+            to_epoch_us([date for date, _ in pairs]),
+            np.array([value for _, value in pairs], dtype=np.float64),
+        )
+
+    @classmethod
+    def concat(cls, series_list):
+        """Concatenate time-ordered series end to end"""
+        return cls(
+            np.concatenate([s.timestamps for s in series_list]),
+            np.concatenate([s.values for s in series_list]),
+            np.concatenate([s.valid for s in series_list]),
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def head(self, length):
+        return Series(self.timestamps[:length], self.values[:length], self.valid[:length])
+
+    def since(self, timestamp):
+        """Points at or after `timestamp` (epoch µs)"""
+        keep = self.timestamps >= timestamp
+        return Series(self.timestamps[keep], self.values[keep], self.valid[keep])
+
+    def before(self, timestamp):
+        """Points strictly before `timestamp` (epoch µs)"""
+        keep = self.timestamps < timestamp
+        return Series(self.timestamps[keep], self.values[keep], self.valid[keep])
+
+    def valid_count(self):
+        return int(np.count_nonzero(self.valid))
+
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + self.valid.nbytes
+
+    def dates(self):
+        return from_epoch_us(self.timestamps)
+
+    def to_pairs(self):
+        """List of (datetime, value or None), the historical block output format"""
+        values = np.where(self.valid, self.values, None).tolist()
+        return list(zip(self.dates(), values))
@@ -0,0 +1,554 @@
+from datetime import datetime
+import sqlite3
+
+import numpy as np
+
+from aggregation import SQL_AGGREGATES
+import database
+from database import CHUNK_ROWS, IN_LIST_CHUNK_SIZE, WRITE_BATCH_SIZE
+from series import from_epoch_us, to_epoch_us, to_float_array
+
+
+class Storage:
+    """Data access used by the engine: rules, history reads, result writes and qualification.
+
+    Dates cross the interface as naive datetimes and histories as
+    {var_id: (timestamps, values)} arrays (epoch µs, float64 with NaN for NULL).
+    """
+
+    def get_rule_json(self, rule_id):
+        raise NotImplementedError
+
+    def load_histories(self, variable_ids, since=None, with_version=False):
+        """Unqualified rows, or every row acquired at or after `since`; with `with_version`,
+        (histories, {var_id: highest row version read, None without rows})"""
+        raise NotImplementedError
+
+    def has_history_versions(self):
+        """Whether his_valeur carries the row version column (see load_history_stats)"""
+        raise NotImplementedError
+
+    def load_history_chunk(self, variable_ids, after=None, chunk_rows=CHUNK_ROWS):
+        """(histories, last date read, exhausted) for the next time-ordered chunk"""
+        raise NotImplementedError
+
+    def load_last_values(self, variable_ids, before, inclusive=False):
+        """Last non-null sample of each variable before (or at) `before`"""
+        raise NotImplementedError
+
+    def load_next_values(self, variable_ids, after):
+        """First non-null unqualified sample of each variable after `after`"""
+        raise NotImplementedError
+
+    def load_history_stats(self, variable_ids, since=None, with_version=False):
+        """{var_id: (count, first date, last date)} of the rows load_histories would return;
+        with `with_version`, followed by the highest row version of these rows, a
+        marker that grows whenever one of them is inserted or its value changes
+        (qualifying a row leaves it unchanged)"""
+        raise NotImplementedError
+
+    def aggregate_history(self, var_id, specs):
+        """Aggregate the unqualified rows of one variable per period of each PeriodicSpec
+        in the database, then qualify them; returns ([(bucket index, row count,
+        non-null count, aggregate) rows per spec], qualified row count)"""
+        raise NotImplementedError
+
+    def load_new_row_stats(self, watermarks):
+        """{var_id: (count, first date, last date)} of the rows acquired after the
+        watermark of their variable ({var_id: date}) or still unqualified"""
+        raise NotImplementedError
+
+    def get_watermark(self, rule_id):
+        raise NotImplementedError
+
+    def set_watermark(self, rule_id, date):
+        raise NotImplementedError
+
+    def get_variable_watermarks(self, rule_id):
+        """{var_id: latest acquisition date of that variable processed by the rule}"""
+        raise NotImplementedError
+
+    def set_variable_watermarks(self, rule_id, watermarks):
+        raise NotImplementedError
+
+    def write_series(self, var_id, series, batch_size=WRITE_BATCH_SIZE, replace=False):
+        """Insert (or with `replace` overwrite) the valid points; returns the rows changed"""
+        raise NotImplementedError
+
+    def write_many(self, outputs, batch_size=WRITE_BATCH_SIZE, replace=False):
+        """write_series for a list of (var_id, series) in one go; returns the rows changed"""
+        return sum(self.write_series(var_id, series, batch_size, replace) for var_id, series in outputs)
+
+    def qualify_histories(self, histories, batch_size=WRITE_BATCH_SIZE):
+        """Flag the given rows as qualified; returns the rows changed"""
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def instrument(self, on_query):
+        """Call on_query() for every statement sent to the database"""
+
+
+class _CountingProxy:
+    """Forwards everything to `target`, calling on_query() before execute/executemany"""
+
+    def __init__(self, target, on_query):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_on_query", on_query)
+
+    def execute(self, *args, **kwargs):
+        self._on_query()
+        return self._target.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._on_query()
+        return self._target.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class SqlServerStorage(Storage):
+    """Storage on a pyodbc SQL Server connection (the functions of database.py)"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self._has_history_versions = None
+
+    def get_rule_json(self, rule_id):
+        return database.get_rule_json(self.cursor, rule_id)
+
+    def load_histories(self, variable_ids, since=None, with_version=False):
+        return database.load_histories(self.cursor, variable_ids, since=since, with_version=with_version)
+
+    def has_history_versions(self):
+        # Colonne ajoutée par migrate.py : vérifiée une fois par connexion
+        if self._has_history_versions is None:
+            self._has_history_versions = database.has_column(
+                self.cursor, 'his_valeur', database.HISTORY_VERSION_COLUMN
+            )
+        return self._has_history_versions
+
+    def load_history_chunk(self, variable_ids, after=None, chunk_rows=CHUNK_ROWS):
+        return database.load_history_chunk(self.cursor, variable_ids, after, chunk_rows)
+
+    def load_last_values(self, variable_ids, before, inclusive=False):
+        return database.load_last_values(self.cursor, variable_ids, before, inclusive=inclusive)
+
+    def load_next_values(self, variable_ids, after):
+        return database.load_next_values(self.cursor, variable_ids, after)
+
+    def load_history_stats(self, variable_ids, since=None, with_version=False):
+        return database.load_history_stats(self.cursor, variable_ids, since=since, with_version=with_version)
+
+    def aggregate_history(self, var_id, specs):
+        return database.aggregate_history(self.cursor, var_id, specs)
+
+    def load_new_row_stats(self, watermarks):
+        return database.load_new_row_stats(self.cursor, watermarks)
+
+    def get_watermark(self, rule_id):
+        return database.get_watermark(self.cursor, rule_id)
+
+    def set_watermark(self, rule_id, date):
+        database.set_watermark(self.cursor, rule_id, date)
+
+    def get_variable_watermarks(self, rule_id):
+        return database.get_variable_watermarks(self.cursor, rule_id)
+
+    def set_variable_watermarks(self, rule_id, watermarks):
+        database.set_variable_watermarks(self.cursor, rule_id, watermarks)
+
+    def write_series(self, var_id, series, batch_size=WRITE_BATCH_SIZE, replace=False):
+        return database.write_series(self.cursor, var_id, series, batch_size, replace)
+
+    def write_many(self, outputs, batch_size=WRITE_BATCH_SIZE, replace=False):
+        return database.write_many(self.cursor, outputs, batch_size, replace)
+
+    def qualify_histories(self, histories, batch_size=WRITE_BATCH_SIZE):
+        return database.qualify_histories(self.cursor, histories, batch_size)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.cursor.close()
+
+    def instrument(self, on_query):
+        self.cursor = _CountingProxy(self.cursor, on_query)
+
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ref_regle (
+        id_regle INTEGER PRIMARY KEY AUTOINCREMENT,
+        lib_nom TEXT,
+        est_modele INTEGER NOT NULL DEFAULT 0,
+        text_json TEXT
+    );
+    CREATE TABLE IF NOT EXISTS his_valeur (
+        id_variable INTEGER NOT NULL,
+        date_acquisition INTEGER NOT NULL,
+        id_qualification INTEGER NOT NULL DEFAULT 0,
+        date_insertion TEXT,
+        val_brute REAL,
+        val_valide REAL,
+        version_ligne INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_variable, date_acquisition)
+    );
+    CREATE INDEX IF NOT EXISTS ix_his_valeur_date ON his_valeur (date_acquisition);
+    CREATE TABLE IF NOT EXISTS ref_regle_watermark (
+        id_regle INTEGER NOT NULL PRIMARY KEY,
+        date_watermark INTEGER NOT NULL,
+        date_maj TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS ref_regle_watermark_variable (
+        id_regle INTEGER NOT NULL,
+        id_variable INTEGER NOT NULL,
+        date_watermark INTEGER NOT NULL,
+        date_maj TEXT NOT NULL,
+        PRIMARY KEY (id_regle, id_variable)
+    );
+"""
+
+
+def _epoch_us(date):
+    return int(to_epoch_us([date])[0])
+
+
+# Version de ligne de his_valeur (comme la séquence SQL Server) : la plus grande
+# version existante plus un, posée à chaque insertion ou changement de valeur
+NEXT_VERSION = "(SELECT COALESCE(MAX(version_ligne), 0) + 1 FROM his_valeur)"
+
+
+def _empty_history():
+    return to_epoch_us([]), to_float_array([])
+
+
+class SqliteStorage(Storage):
+    """Embedded storage (file or ":memory:") with the ref_regle / his_valeur semantics
+    of SQL Server; date_acquisition is stored as epoch microseconds"""
+
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SQLITE_SCHEMA)
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(his_valeur)")]
+        if "version_ligne" not in columns:
+            self.connection.execute("ALTER TABLE his_valeur ADD COLUMN version_ligne INTEGER NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_his_valeur_version ON his_valeur (version_ligne)")
+
+    def _histories(self, variable_ids, rows):
+        """Group (id_variable, date_acquisition, val_valide) rows ordered by variable then date"""
+        histories = {}
+        if rows:
+            ids = np.array([row[0] for row in rows])
+            timestamps = np.array([row[1] for row in rows], dtype=np.int64)
+            values = to_float_array([row[2] for row in rows])
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            for start, end in zip(starts, np.r_[starts[1:], len(ids)]):
+                histories[ids[start].item()] = (timestamps[start:end], values[start:end])
+        for var_id in variable_ids:
+            if var_id not in histories:
+                histories[var_id] = _empty_history()
+        return histories
+
+    def get_rule_json(self, rule_id):
+        row = self.connection.execute(
+            "SELECT text_json FROM ref_regle WHERE id_regle = ?", (rule_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_rule(self, json_text, name="", rule_id=None):
+        """Insert or replace a rule; returns its id_regle"""
+        cursor = self.connection.execute(
+            "INSERT OR REPLACE INTO ref_regle (id_regle, lib_nom, est_modele, text_json) VALUES (?, ?, 0, ?)",
+            (rule_id, name, json_text),
+        )
+        return cursor.lastrowid if rule_id is None else rule_id
+
+    def insert_history(self, var_id, timestamps, values, qualification=0):
+        """Bulk insert raw samples (epoch µs timestamps, NaN for NULL) for one variable"""
+        inserted = datetime.now().isoformat(sep=" ")
+        values = np.where(np.isnan(values), None, values).tolist()
+        self.connection.executemany(
+            f"""
+                INSERT OR IGNORE INTO his_valeur (
+                    id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide,
+                    version_ligne
+                )
+                VALUES (?, ?, ?, ?, ?, ?, {NEXT_VERSION})
+            """,
+            ((var_id, ts, qualification, inserted, value, value)
+             for ts, value in zip(np.asarray(timestamps, dtype=np.int64).tolist(), values)),
+        )
+
+    def load_histories(self, variable_ids, since=None, with_version=False):
+        unique_ids = list(dict.fromkeys(variable_ids))
+        version = ", version_ligne" if with_version else ""
+        rows = []
+        for start in range(0, len(unique_ids), IN_LIST_CHUNK_SIZE):
+            chunk = unique_ids[start:start + IN_LIST_CHUNK_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            if since is None:
+                condition, params = "id_qualification = 0", chunk
+            else:
+                condition, params = "date_acquisition >= ?", chunk + [_epoch_us(since)]
+            rows.extend(self.connection.execute(f"""
+                SELECT id_variable, date_acquisition, val_valide{version}
+                FROM his_valeur
+                WHERE id_variable IN ({placeholders}) AND {condition}
+                ORDER BY id_variable, date_acquisition
+            """, params))
+        histories = self._histories(unique_ids, rows)
+        if not with_version:
+            return histories
+        versions = dict.fromkeys(unique_ids)
+        for var_id, _, _, row_version in rows:
+            if versions[var_id] is None or row_version > versions[var_id]:
+                versions[var_id] = row_version
+        return histories, versions
+
+    def has_history_versions(self):
+        return True
+
+    def load_history_chunk(self, variable_ids, after=None, chunk_rows=CHUNK_ROWS):
+        unique_ids = list(dict.fromkeys(variable_ids))
+        if len(unique_ids) > IN_LIST_CHUNK_SIZE:
+            raise ValueError(f"Chunked execution supports at most {IN_LIST_CHUNK_SIZE} variables")
+
+        placeholders = ", ".join("?" for _ in unique_ids)
+        condition = f"id_variable IN ({placeholders}) AND id_qualification = 0"
+        params = list(unique_ids)
+        if after is not None:
+            condition += " AND date_acquisition > ?"
+            params.append(_epoch_us(after))
+
+        # Équivalent de TOP (n) WITH TIES : date de la n-ième ligne, puis tout jusqu'à elle
+        limit = self.connection.execute(f"""
+            SELECT date_acquisition FROM his_valeur WHERE {condition}
+            ORDER BY date_acquisition LIMIT 1 OFFSET ?
+        """, params + [int(chunk_rows) - 1]).fetchone()
+        if limit is not None:
+            condition += " AND date_acquisition <= ?"
+            params.append(limit[0])
+        rows = self.connection.execute(f"""
+            SELECT id_variable, date_acquisition, val_valide
+            FROM his_valeur WHERE {condition}
+            ORDER BY id_variable, date_acquisition
+        """, params).fetchall()
+
+        last_date = from_epoch_us([max(row[1] for row in rows)])[0] if rows else None
+        return self._histories(unique_ids, rows), last_date, len(rows) < chunk_rows
+
+    def load_last_values(self, variable_ids, before, inclusive=False):
+        unique_ids = list(dict.fromkeys(variable_ids))
+        operator = "<=" if inclusive else "<"
+        rows = []
+        for start in range(0, len(unique_ids), IN_LIST_CHUNK_SIZE):
+            chunk = unique_ids[start:start + IN_LIST_CHUNK_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows.extend(self.connection.execute(f"""
+                SELECT id_variable, date_acquisition, val_valide
+                FROM (
+                    SELECT id_variable, date_acquisition, val_valide,
+                           ROW_NUMBER() OVER (PARTITION BY id_variable ORDER BY date_acquisition DESC) AS rang
+                    FROM his_valeur
+                    WHERE id_variable IN ({placeholders})
+                      AND date_acquisition {operator} ? AND val_valide IS NOT NULL
+                ) t
+                WHERE rang = 1
+                ORDER BY id_variable
+            """, chunk + [_epoch_us(before)]))
+        return self._histories(unique_ids, rows)
+
+    def load_next_values(self, variable_ids, after):
+        unique_ids = list(dict.fromkeys(variable_ids))
+        rows = []
+        for start in range(0, len(unique_ids), IN_LIST_CHUNK_SIZE):
+            chunk = unique_ids[start:start + IN_LIST_CHUNK_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows.extend(self.connection.execute(f"""
+                SELECT id_variable, date_acquisition, val_valide
+                FROM (
+                    SELECT id_variable, date_acquisition, val_valide,
+                           ROW_NUMBER() OVER (PARTITION BY id_variable ORDER BY date_acquisition) AS rang
+                    FROM his_valeur
+                    WHERE id_variable IN ({placeholders})
+                      AND date_acquisition > ? AND id_qualification = 0 AND val_valide IS NOT NULL
+                ) t
+                WHERE rang = 1
+                ORDER BY id_variable
+            """, chunk + [_epoch_us(after)]))
+        return self._histories(unique_ids, rows)
+
+    def load_history_stats(self, variable_ids, since=None, with_version=False):
+        unique_ids = list(dict.fromkeys(variable_ids))
+        stats = {var_id: (0, None, None) + ((None,) if with_version else ()) for var_id in unique_ids}
+        version = ", MAX(version_ligne)" if with_version else ""
+        for start in range(0, len(unique_ids), IN_LIST_CHUNK_SIZE):
+            chunk = unique_ids[start:start + IN_LIST_CHUNK_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            if since is None:
+                condition, params = "id_qualification = 0", chunk
+            else:
+                condition, params = "date_acquisition >= ?", chunk + [_epoch_us(since)]
+            for var_id, count, first, last, *marker in self.connection.execute(f"""
+                SELECT id_variable, COUNT(*), MIN(date_acquisition), MAX(date_acquisition){version}
+                FROM his_valeur
+                WHERE id_variable IN ({placeholders}) AND {condition}
+                GROUP BY id_variable
+            """, params):
+                stats[var_id] = (count, *from_epoch_us([first, last]), *marker)
+        return stats
+
+    def load_new_row_stats(self, watermarks):
+        items = list(watermarks.items())
+        stats = {var_id: (0, None, None) for var_id, _ in items}
+        for start in range(0, len(items), IN_LIST_CHUNK_SIZE // 2):
+            chunk = items[start:start + IN_LIST_CHUNK_SIZE // 2]
+            values = ", ".join("(?, ?)" for _ in chunk)
+            for var_id, count, first, last in self.connection.execute(f"""
+                WITH w (id_variable, date_watermark) AS (VALUES {values})
+                SELECT h.id_variable, COUNT(*), MIN(h.date_acquisition), MAX(h.date_acquisition)
+                FROM his_valeur h
+                JOIN w ON w.id_variable = h.id_variable
+                WHERE h.date_acquisition > w.date_watermark OR h.id_qualification = 0
+                GROUP BY h.id_variable
+            """, [param for var_id, date in chunk for param in (var_id, _epoch_us(date))]):
+                stats[var_id] = (count, *from_epoch_us([first, last]))
+        return stats
+
+    def aggregate_history(self, var_id, specs):
+        # Clés figées dans une table temporaire : seules les lignes agrégées sont qualifiées
+        self.connection.execute("DROP TABLE IF EXISTS temp.his_valeur_agg_keys")
+        self.connection.execute("""
+            CREATE TEMP TABLE his_valeur_agg_keys AS
+            SELECT date_acquisition FROM his_valeur
+            WHERE id_variable = ? AND id_qualification = 0
+        """, (var_id,))
+
+        results = []
+        for spec in specs:
+            results.append(self.connection.execute(f"""
+                SELECT (h.date_acquisition - ?) / ? AS bucket,
+                       COUNT(*), COUNT(h.val_valide), {SQL_AGGREGATES[spec.operation]}(h.val_valide)
+                FROM his_valeur h
+                JOIN temp.his_valeur_agg_keys k ON k.date_acquisition = h.date_acquisition
+                WHERE h.id_variable = ?
+                GROUP BY bucket
+                ORDER BY bucket
+            """, (spec.offset_us, spec.period_us, var_id)).fetchall())
+
+        before = self.connection.total_changes
+        self.connection.execute("""
+            UPDATE his_valeur SET id_qualification = 1
+            WHERE id_variable = ? AND id_qualification = 0
+              AND date_acquisition IN (SELECT date_acquisition FROM temp.his_valeur_agg_keys)
+        """, (var_id,))
+        qualified = self.connection.total_changes - before
+        self.connection.execute("DROP TABLE temp.his_valeur_agg_keys")
+        return results, qualified
+
+    def get_watermark(self, rule_id):
+        row = self.connection.execute(
+            "SELECT date_watermark FROM ref_regle_watermark WHERE id_regle = ?", (rule_id,)
+        ).fetchone()
+        return from_epoch_us([row[0]])[0] if row else None
+
+    def set_watermark(self, rule_id, date):
+        self.connection.execute("""
+            INSERT INTO ref_regle_watermark (id_regle, date_watermark, date_maj)
+            VALUES (?, ?, datetime('now', 'localtime'))
+            ON CONFLICT (id_regle) DO UPDATE
+            SET date_watermark = excluded.date_watermark, date_maj = excluded.date_maj
+        """, (rule_id, _epoch_us(date)))
+
+    def get_variable_watermarks(self, rule_id):
+        return {
+            var_id: from_epoch_us([date])[0]
+            for var_id, date in self.connection.execute(
+                "SELECT id_variable, date_watermark FROM ref_regle_watermark_variable WHERE id_regle = ?",
+                (rule_id,),
+            )
+        }
+
+    def set_variable_watermarks(self, rule_id, watermarks):
+        self.connection.executemany("""
+            INSERT INTO ref_regle_watermark_variable (id_regle, id_variable, date_watermark, date_maj)
+            VALUES (?, ?, ?, datetime('now', 'localtime'))
+            ON CONFLICT (id_regle, id_variable) DO UPDATE
+            SET date_watermark = excluded.date_watermark, date_maj = excluded.date_maj
+        """, [(rule_id, var_id, _epoch_us(date)) for var_id, date in watermarks.items()])
+
+    def write_series(self, var_id, series, batch_size=WRITE_BATCH_SIZE, replace=False):
+        return self.write_many([(var_id, series)], batch_size, replace)
+
+    def write_many(self, outputs, batch_size=WRITE_BATCH_SIZE, replace=False):
+        rows = []
+        for var_id, timestamps, values in database.unique_points(outputs):
+            rows.extend((var_id, ts, value, value) for ts, value in zip(timestamps.tolist(), values.tolist()))
+        if not rows:
+            return 0
+
+        if replace:
+            statement = f"""
+                INSERT INTO his_valeur (
+                    id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide,
+                    version_ligne
+                )
+                VALUES (?, ?, 1, datetime('now', 'localtime'), ?, ?, {NEXT_VERSION})
+                ON CONFLICT (id_variable, date_acquisition) DO UPDATE
+                SET val_brute = excluded.val_valide, val_valide = excluded.val_valide,
+                    date_insertion = excluded.date_insertion, version_ligne = {NEXT_VERSION}
+                WHERE his_valeur.val_valide IS NULL OR his_valeur.val_valide <> excluded.val_valide
+            """
+        else:
+            statement = f"""
+                INSERT OR IGNORE INTO his_valeur (
+                    id_variable, date_acquisition, id_qualification, date_insertion, val_brute, val_valide,
+                    version_ligne
+                )
+                VALUES (?, ?, 1, datetime('now', 'localtime'), ?, ?, {NEXT_VERSION})
+            """
+        before = self.connection.total_changes
+        for start in range(0, len(rows), batch_size):
+            self.connection.executemany(statement, rows[start:start + batch_size])
+        return self.connection.total_changes - before
+
+    def qualify_histories(self, histories, batch_size=WRITE_BATCH_SIZE):
+        rows = []
+        for var_id, (timestamps, _) in histories.items():
+            rows.extend(zip([var_id] * len(timestamps), timestamps.tolist()))
+
+        before = self.connection.total_changes
+        for start in range(0, len(rows), batch_size):
+            self.connection.executemany("""
+                UPDATE his_valeur SET id_qualification = 1
+                WHERE id_variable = ? AND date_acquisition = ? AND id_qualification = 0
+            """, rows[start:start + batch_size])
+        return self.connection.total_changes - before
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+    def instrument(self, on_query):
+        self.connection = _CountingProxy(self.connection, on_query)
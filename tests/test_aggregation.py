@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from aggregation import MINUTE_US, aggregate, periodic_spec
+from series import Series
+
+
+def sample_series(seed=0, points=2000):
+    """Irregular timestamps over ~3 days, 15 % of invalid points"""
+    rng = np.random.default_rng(seed)
+    timestamps = np.sort(rng.choice(3 * 24 * 60, points, replace=False)).astype(np.int64) * MINUTE_US
+    values = 1000 + rng.normal(size=points)
+    valid = rng.random(points) > 0.15
+    return Series(timestamps, np.where(valid, values, np.nan), valid)
+
+
+def reference(series, spec):
+    """Per-period loop with NumPy reductions"""
+    buckets = spec.bucket_start(series.timestamps)
+    out_ts, out = [], []
+    for start in np.unique(buckets):
+        in_bucket = buckets == start
+        valid = in_bucket & series.valid
+        if not valid.any() or valid.sum() * 100 < spec.validity_rate * in_bucket.sum():
+            continue
+        ts, vals = series.timestamps[valid], series.values[valid]
+        operation = spec.operation
+        if operation == "moyenne":
+            res = vals.mean()
+        elif operation == "somme":
+            res = vals.sum()
+        elif operation == "maximum":
+            res = vals.max()
+        elif operation == "minimum":
+            res = vals.min()
+        elif operation == "premiere":
+            res = vals[0]
+        elif operation == "derniere":
+            res = vals[-1]
+        elif operation == "mediane":
+            res = np.median(vals)
+        elif operation == "ecart_type":
+            res = vals.std()
+        elif operation == "percentile":
+            res = np.percentile(vals, spec.percentile)
+        elif operation == "moyenne_ponderee":
+            weights = np.diff(np.r_[ts, start + spec.period_us]).astype(np.float64)
+            res = np.average(vals, weights=weights)
+        out_ts.append(start)
+        out.append(res)
+    return np.array(out_ts, dtype=np.int64), np.array(out)
+
+
+@pytest.mark.parametrize("parameters", [
+    {"operation": "moyenne"},
+    {"operation": "somme", "period": 15},
+    {"operation": "maximum"},
+    {"operation": "minimum", "offset": 7},
+    {"operation": "premiere"},
+    {"operation": "derniere"},
+    {"operation": "mediane", "period": 30},
+    {"operation": "ecart_type", "period": 120},
+    {"operation": "percentile", "percentile": 90},
+    {"operation": "p5", "period": 240},
+    {"operation": "moyenne_ponderee", "period": 45, "offset": 10},
+    {"operation": "moyenne", "validity_rate": 95},
+])
+def test_aggregate_matches_reference_loop(parameters):
+    series = sample_series()
+    spec = periodic_spec(parameters)
+    result = aggregate(series, spec)
+
+    expected_ts, expected = reference(series, spec)
+    np.testing.assert_array_equal(result.timestamps, expected_ts)
+    np.testing.assert_allclose(result.values, expected, rtol=1e-12, atol=1e-9)
+
+
+def test_aggregate_unsorted_input():
+    series = sample_series(seed=1, points=300)
+    order = np.random.default_rng(2).permutation(len(series.timestamps))
+    shuffled = Series(series.timestamps[order], series.values[order], series.valid[order])
+    spec = periodic_spec({"operation": "mediane"})
+    np.testing.assert_allclose(aggregate(shuffled, spec).values, aggregate(series, spec).values)
@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+import json
+
+import pytest
+
+import app as app_module
+from app import app
+from pool import ConnectionPool
+from storage import SqliteStorage
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+class FakeRulesConnection:
+    """Connection answering the queries of /api/get-rules on two fixed rules"""
+
+    statements = []
+    has_version_column = True
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, *params):
+        FakeRulesConnection.statements.append(query)
+        self.query = query
+        if "TOP 0" in query:
+            self.description = [("id_regle",), ("lib_nom",), ("text_json",), ("version_ligne",)]
+
+    def fetchone(self):
+        if "COL_LENGTH" in self.query:
+            return (8 if FakeRulesConnection.has_version_column else None,)
+        if "COUNT(*)" in self.query:
+            return (2, bytes.fromhex("00000000000007d1"))
+        return (1,)
+
+    def fetchall(self):
+        if "TOP 0" in self.query:
+            return []
+        return [(1, "a", None), (2, "b", None)]
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def rules_db(monkeypatch):
+    FakeRulesConnection.statements = []
+    FakeRulesConnection.has_version_column = True
+    monkeypatch.setattr(app_module, "connection_pool", ConnectionPool(FakeRulesConnection))
+    return FakeRulesConnection
+
+
+def test_unchanged_rule_listings_share_an_etag(client, rules_db):
+    first = client.get("/api/get-rules")
+    second = client.get("/api/get-rules")
+    assert first.status_code == second.status_code == 200
+    assert first.headers["ETag"] and first.headers["ETag"] == second.headers["ETag"]
+
+    cached = client.get("/api/get-rules", headers={"If-None-Match": first.headers["ETag"]})
+    assert cached.status_code == 304
+    # Aucun changement de schéma pendant une lecture
+    assert not [q for q in rules_db.statements if "ALTER" in q or "CREATE" in q]
+
+
+def test_rule_listing_without_version_column_has_no_etag(client, rules_db):
+    rules_db.has_version_column = False
+    response = client.get("/api/get-rules")
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert not [q for q in rules_db.statements if "ALTER" in q or "CREATE" in q]
+
+
+@pytest.mark.parametrize("value", ["0", "-5", "abc", "1.5"])
+def test_execute_rule_rejects_invalid_chunk_rows(client, value):
+    response = client.post(f"/api/execute-rule/1?chunk_rows={value}")
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "chunk_rows must be a positive integer"
+
+
+@pytest.mark.parametrize("value", [0, -5, "abc", 1.5, True])
+def test_execute_rules_batch_rejects_invalid_chunk_rows(client, value):
+    response = client.post("/api/execute-rules", json={"rule_ids": [1, 2], "chunk_rows": value})
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "chunk_rows must be a positive integer"
+
+
+def test_execute_rules_batch_honours_rule_pushdown(client, monkeypatch):
+    storage = SqliteStorage()
+    rule = {
+        "blocks": [
+            {"class": "ReadVar", "parameters": {"Id": 1}},
+            {"class": "PeriodicCalc", "parameters": {"operation": "somme", "period": 60}},
+            {"class": "WriteVar", "parameters": {"Id": 100}},
+        ],
+        "links": [{"parent": 1, "child": 2}, {"parent": 2, "child": 3}],
+    }
+    storage.save_rule(json.dumps(rule), rule_id=1)
+
+    calls = []
+
+    @contextmanager
+    def db_storage():
+        yield storage
+
+    def run_batch(plans, open_storage, **options):
+        calls.append(options)
+        return {"success": True, "duration_ms": 0}
+
+    monkeypatch.setattr(app_module, "db_storage", db_storage)
+    monkeypatch.setattr(app_module, "run_batch", run_batch)
+    monkeypatch.setattr(app_module, "RULE_PUSHDOWN", False)
+    response = client.post("/api/execute-rules", json={"rule_ids": [1]})
+    assert response.status_code == 200
+    assert calls[0]["pushdown"] is False
@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+import json
+import random
+import time
+
+import numpy as np
+
+from batch import rule_conflicts, rule_dependencies, execution_levels, run_batch
+from engine import compile_rule
+from main import storage_opener
+from storage import SqliteStorage
+
+MINUTE_US = 60 * 1_000_000
+
+
+def sum_rule(read_ids, write_id):
+    blocks = [{"class": "ReadVar", "parameters": {"Id": var_id}} for var_id in read_ids]
+    blocks += [{"class": "+", "parameters": {}}, {"class": "WriteVar", "parameters": {"Id": write_id}}]
+    plus = len(read_ids) + 1
+    links = [{"parent": i, "child": plus} for i in range(1, plus)] + [{"parent": plus, "child": plus + 1}]
+    return {"blocks": blocks, "links": links}
+
+
+# Les règles 1 à 4 lisent toutes la variable 1 ; la 5 est indépendante
+RULES = {
+    1: sum_rule([1, 2], 101),
+    2: sum_rule([1, 3], 102),
+    3: sum_rule([1], 103),
+    4: sum_rule([101, 2], 104),
+    5: sum_rule([3], 105),
+}
+
+
+def load(path):
+    storage = SqliteStorage(str(path))
+    rng = np.random.default_rng(0)
+    for var_id in (1, 2, 3):
+        timestamps = np.sort(rng.choice(100_000, 500, replace=False)).astype(np.int64) * MINUTE_US
+        storage.insert_history(var_id, timestamps, rng.normal(size=500))
+    storage.commit()
+    storage.close()
+
+
+def snapshot(path):
+    storage = SqliteStorage(str(path))
+    try:
+        return storage.connection.execute(
+            "SELECT id_variable, date_acquisition, val_valide, id_qualification FROM his_valeur ORDER BY 1, 2"
+        ).fetchall()
+    finally:
+        storage.close()
+
+
+def jittered(open_storage, seed):
+    """Storage opener starting each rule after a random delay, to vary the interleaving"""
+    delays = random.Random(seed)
+
+    @contextmanager
+    def open_jittered():
+        time.sleep(delays.random() * 0.05)
+        with open_storage() as storage:
+            yield storage
+    return open_jittered
+
+
+def test_rules_sharing_a_variable_are_ordered():
+    plans = {rule_id: compile_rule(rule) for rule_id, rule in RULES.items()}
+    dependencies = rule_dependencies(plans)
+    conflicts = rule_conflicts(plans, execution_levels(dependencies))
+    assert dependencies[4] == {1}
+    assert conflicts == {1: set(), 2: {1}, 3: {2}, 4: {1}, 5: {2}}
+
+
+def test_parallel_batch_is_deterministic(tmp_path):
+    results = []
+    for run in range(4):
+        path = tmp_path / f"run{run}.db"
+        load(path)
+        plans = {rule_id: compile_rule(json.loads(json.dumps(rule))) for rule_id, rule in RULES.items()}
+        outcome = run_batch(plans, jittered(storage_opener(str(path)), run), workers=3)
+        assert outcome["success"]
+        results.append(snapshot(path))
+    assert all(result == results[0] for result in results[1:])
@@ -0,0 +1,88 @@
+import numpy as np
+
+import engine
+from alignment import align_chunk
+from engine import compile_rule, execute_plan
+from series import Series
+from storage import SqliteStorage
+
+MINUTE_US = 60 * 1_000_000
+
+
+def read_var(var_id):
+    return {"class": "ReadVar", "parameters": {"Id": var_id}}
+
+
+def write_var(var_id):
+    return {"class": "WriteVar", "parameters": {"Id": var_id}}
+
+
+def link(parent, child):
+    return {"parent": parent, "child": child}
+
+
+# 1 + 2 -> 100 et 9 -> 101 : la variable 2 est creuse, la variable 9 n'a aucune ligne
+RULE = {
+    "blocks": [
+        read_var(1), read_var(2), {"class": "+", "parameters": {}}, write_var(100),
+        read_var(9), write_var(101),
+    ],
+    "links": [link(1, 3), link(2, 3), link(3, 4), link(5, 6)],
+}
+
+
+def storage_with_data():
+    storage = SqliteStorage()
+    timestamps = np.arange(20_000, dtype=np.int64) * MINUTE_US
+    storage.insert_history(1, timestamps, np.sin(np.arange(20_000) / 100))
+    # Quelques points valides très espacés, des NULL entre eux
+    sparse = np.full(200, np.nan)
+    sparse[::50] = np.arange(4, dtype=np.float64)
+    storage.insert_history(2, timestamps[::100] + 30 * 1_000_000, sparse)
+    return storage
+
+
+def outputs(storage):
+    return storage.connection.execute(
+        "SELECT id_variable, date_acquisition, val_valide FROM his_valeur WHERE id_variable >= 100 ORDER BY 1, 2"
+    ).fetchall()
+
+
+def test_chunked_stream_stays_bounded_with_lagging_sources(monkeypatch):
+    buffered = []
+    pop_ready = engine.TimelineStream.pop_ready
+
+    def recording_pop_ready(self, *args, **kwargs):
+        buffered.append(sum(len(timestamps) for timestamps, _ in self.buffers.values()))
+        return pop_ready(self, *args, **kwargs)
+
+    monkeypatch.setattr(engine.TimelineStream, "pop_ready", recording_pop_ready)
+    plan = compile_rule(RULE)
+    chunked = storage_with_data()
+    result = execute_plan(chunked, plan, chunk_rows=100)
+
+    full = storage_with_data()
+    execute_plan(full, plan)
+
+    assert result["chunks"] >= 150
+    assert max(buffered) <= 300
+    assert outputs(chunked) == outputs(full)
+    unqualified = chunked.connection.execute("SELECT COUNT(*) FROM his_valeur WHERE id_qualification = 0")
+    assert unqualified.fetchone()[0] == 0
+
+
+def test_outer_join_chunks_stay_bounded_when_an_input_is_empty():
+    empty = Series(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=bool))
+    pending = None
+    released = 0
+    for chunk in range(50):
+        timestamps = (np.arange(100, dtype=np.int64) + 100 * chunk) * MINUTE_US
+        left = Series(timestamps, np.ones(100), np.ones(100, dtype=bool))
+        timeline, _, pending = align_chunk(
+            [left, empty], "outer", pending=pending, final=False, max_lookahead=60 * MINUTE_US,
+        )
+        released += len(timeline)
+        assert len(pending[0][0]) <= 161
+
+    timeline, _, _ = align_chunk([empty, empty], "outer", pending=pending, final=True)
+    assert released + len(timeline) == 5000
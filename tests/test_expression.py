@@ -0,0 +1,37 @@
+import numpy as np
+
+from engine import apply_arithmetic, apply_expression
+from series import Series
+
+
+def random_tree(rng, depth, leaves):
+    if depth == 0 or rng.random() < 0.2:
+        leaves.append(len(leaves))
+        return ["input", leaves[-1]]
+    operator = str(rng.choice(["+", "-", "*", "/"]))
+    return [operator, [random_tree(rng, depth - 1, leaves) for _ in range(rng.integers(2, 4))]]
+
+
+def nested(tree, inputs):
+    if tree[0] == "input":
+        return inputs[tree[1]]
+    return apply_arithmetic(tree[0], [nested(child, inputs) for child in tree[1]])
+
+
+def test_fused_expression_matches_chained_blocks():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        leaves = []
+        tree = random_tree(rng, 4, leaves)
+        inputs = []
+        for _ in leaves:
+            length = int(rng.integers(1, 40))
+            values = rng.normal(size=length)
+            values[rng.random(length) < 0.3] = np.nan
+            values[rng.random(length) < 0.1] = 0.0
+            inputs.append(Series(np.arange(length), values))
+
+        fused, chained = apply_expression(tree, inputs), nested(tree, inputs)
+        np.testing.assert_array_equal(fused.timestamps, chained.timestamps)
+        np.testing.assert_array_equal(fused.valid, chained.valid)
+        np.testing.assert_array_equal(fused.values, chained.values)
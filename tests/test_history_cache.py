@@ -0,0 +1,77 @@
+import numpy as np
+
+from history_cache import CachedStorage, HistoryCache
+from series import Series, from_epoch_us
+from storage import SqliteStorage
+
+MINUTE_US = 60 * 1_000_000
+
+
+def test_in_place_correction_is_not_served_from_the_cache(tmp_path):
+    path = str(tmp_path / "his.db")
+    timestamps = np.arange(100, dtype=np.int64) * MINUTE_US
+    writer = SqliteStorage(path)
+    writer.insert_history(1, timestamps, np.arange(100, dtype=np.float64))
+    writer.commit()
+
+    cache = HistoryCache()
+    reader = CachedStorage(SqliteStorage(path), cache)
+    since = from_epoch_us([0])[0]
+    reader.load_histories([1], since=since)
+    assert reader.load_histories([1], since=since)[1][1][50] == 50.0
+    assert cache.hits == 1
+
+    # Correction d'une valeur par un autre processus : nombre de lignes et bornes inchangés
+    correction = Series(timestamps[50:51], np.array([-1.0]), np.array([True]))
+    assert writer.write_series(1, correction, replace=True) == 1
+    writer.commit()
+
+    _, values = reader.load_histories([1], since=since)[1]
+    assert values[50] == -1.0
+    assert cache.stale == 1
+    assert reader.load_histories([1], since=since)[1][1][50] == -1.0
+    assert cache.hits == 2
+
+
+def test_qualification_keeps_cached_rows_valid():
+    storage = SqliteStorage()
+    timestamps = np.arange(100, dtype=np.int64) * MINUTE_US
+    storage.insert_history(1, timestamps, np.arange(100, dtype=np.float64))
+    storage.commit()
+
+    cache = HistoryCache()
+    since = from_epoch_us([0])[0]
+    reader = CachedStorage(storage, cache)
+    history = reader.load_histories([1], since=since)
+    reader.qualify_histories(history)
+    reader.commit()
+
+    # La qualification ne change pas les versions de ligne : l'entrée reste servie
+    reader.load_histories([1], since=since)
+    assert cache.hits == 1
+    assert cache.stale == 0
+
+
+class UnversionedStorage(SqliteStorage):
+    """his_valeur without the version column (migration not applied)"""
+
+    def has_history_versions(self):
+        return False
+
+
+def test_cache_without_version_column_compares_count_and_dates(tmp_path):
+    path = str(tmp_path / "his.db")
+    writer = SqliteStorage(path)
+    writer.insert_history(1, np.arange(10, dtype=np.int64) * MINUTE_US, np.arange(10, dtype=np.float64))
+    writer.commit()
+
+    cache = HistoryCache()
+    reader = CachedStorage(UnversionedStorage(path), cache)
+    reader.load_histories([1])
+    reader.load_histories([1])
+    assert cache.hits == 1
+
+    writer.insert_history(1, np.array([10 * MINUTE_US]), np.array([10.0]))
+    writer.commit()
+    assert len(reader.load_histories([1])[1][0]) == 11
+    assert cache.stale == 1
@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+
+from engine import compile_rule, execute_plan
+from storage import SqliteStorage
+
+MINUTE_US = 60 * 1_000_000
+
+
+def read_var(var_id):
+    return {"class": "ReadVar", "parameters": {"Id": var_id}}
+
+
+def write_var(var_id):
+    return {"class": "WriteVar", "parameters": {"Id": var_id}}
+
+
+def link(parent, child):
+    return {"parent": parent, "child": child}
+
+
+# Moyenne horaire de la variable 1 jointe (outer / asof) à la variable 2
+def periodic_join_rule(join):
+    return {
+        "blocks": [
+            read_var(1),
+            {"class": "PeriodicCalc", "parameters": {"operation": "moyenne", "period": 60}},
+            read_var(2),
+            {"class": "-", "parameters": {"join": join}},
+            write_var(100),
+        ],
+        "links": [link(1, 2), link(2, 4), link(3, 4), link(4, 5)],
+    }
+
+
+def histories(seed=0, points=3000):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for var_id in (1, 2):
+        timestamps = np.sort(rng.choice(20 * 24 * 60, points, replace=False)).astype(np.int64) * MINUTE_US
+        data[var_id] = (timestamps, rng.normal(size=points))
+    return data
+
+
+def outputs(storage):
+    return storage.connection.execute(
+        "SELECT id_variable, date_acquisition, val_valide FROM his_valeur WHERE id_variable >= 100 ORDER BY 1, 2"
+    ).fetchall()
+
+
+def run(rule, data, cuts):
+    """Outputs of the rule after one incremental run per slice of the data between `cuts`"""
+    storage = SqliteStorage()
+    plan = compile_rule(rule)
+    bounds = [None] + list(cuts) + [None]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        for var_id, (timestamps, values) in data.items():
+            keep = np.ones(len(timestamps), dtype=bool)
+            if start is not None:
+                keep &= timestamps >= start
+            if end is not None:
+                keep &= timestamps < end
+            storage.insert_history(var_id, timestamps[keep], values[keep])
+        storage.commit()
+        execute_plan(storage, plan, rule_id=1, incremental=True)
+        storage.commit()
+    return outputs(storage)
+
+
+def assert_same(actual, expected):
+    assert [row[:2] for row in actual] == [row[:2] for row in expected]
+    np.testing.assert_allclose(
+        [np.nan if row[2] is None else row[2] for row in actual],
+        [np.nan if row[2] is None else row[2] for row in expected],
+        rtol=1e-9, atol=1e-12,
+    )
+
+
+@pytest.mark.parametrize("join", ["outer", "asof"])
+def test_incremental_periodic_join_matches_full_run(join):
+    rule = periodic_join_rule(join)
+    data = histories()
+    # Coupures en milieu de période : la dernière période reste ouverte entre deux exécutions
+    cuts = [(day * 24 * 60 + 37) * MINUTE_US for day in (3, 7, 11, 16)]
+    assert_same(run(rule, data, cuts), run(rule, data, []))
+
+
+def sum_rule():
+    return {
+        "blocks": [read_var(1), read_var(2), {"class": "+", "parameters": {}}, write_var(100)],
+        "links": [link(1, 3), link(2, 3), link(3, 4)],
+    }
+
+
+def full_run(rule, data):
+    storage = SqliteStorage()
+    for var_id, (timestamps, values) in data.items():
+        storage.insert_history(var_id, timestamps, values)
+    execute_plan(storage, compile_rule(rule))
+    return outputs(storage)
+
+
+def test_late_rows_are_processed_and_qualified():
+    rule = sum_rule()
+    data = histories(seed=1)
+    timestamps, values = data[1]
+    late = np.zeros(len(timestamps), dtype=bool)
+    late[100:3000:97] = True
+
+    storage = SqliteStorage()
+    plan = compile_rule(rule)
+    storage.insert_history(1, timestamps[~late], values[~late])
+    storage.insert_history(2, *data[2])
+    execute_plan(storage, plan, rule_id=1, incremental=True)
+
+    # Lignes arrivées après coup, datées avant le filigrane
+    storage.insert_history(1, timestamps[late], values[late])
+    result = execute_plan(storage, plan, rule_id=1, incremental=True)
+
+    assert result["mode"] == "incremental"
+    assert result["qualified_rows"] == late.sum()
+    unqualified = storage.connection.execute("SELECT COUNT(*) FROM his_valeur WHERE id_qualification = 0")
+    assert unqualified.fetchone()[0] == 0
+    assert_same(outputs(storage), full_run(rule, data))
+
+
+def test_silent_variable_does_not_hold_back_the_rewrite():
+    rule = sum_rule()
+    data = histories(seed=2)
+    # La variable 2 ne reçoit plus rien après le premier jour
+    data[2] = tuple(array[data[2][0] < 24 * 60 * MINUTE_US] for array in data[2])
+    cut = 15 * 24 * 60 * MINUTE_US
+
+    storage = SqliteStorage()
+    plan = compile_rule(rule)
+    for var_id, (timestamps, values) in data.items():
+        storage.insert_history(var_id, timestamps[timestamps < cut], values[timestamps < cut])
+    execute_plan(storage, plan, rule_id=1, incremental=True)
+
+    timestamps, values = data[1]
+    storage.insert_history(1, timestamps[timestamps >= cut], values[timestamps >= cut])
+    result = execute_plan(storage, plan, rule_id=1, incremental=True)
+
+    # Seules les dates depuis le dernier point connu de la variable 1 sont recalculées
+    assert result["processed_dates"] <= (timestamps >= cut).sum() + 3
+    assert_same(outputs(storage), full_run(rule, data))
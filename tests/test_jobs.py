@@ -0,0 +1,27 @@
+import threading
+
+from jobs import JobManager
+
+
+def blocking_run(release):
+    def run(progress):
+        release.wait(5)
+        return {"success": True}
+    return run
+
+
+def test_submissions_coalesce_only_with_the_same_options():
+    manager = JobManager(workers=2)
+    release = threading.Event()
+    try:
+        full, coalesced = manager.submit(7, blocking_run(release), {"incremental": False, "chunk_rows": None})
+        assert not coalesced
+        again, coalesced = manager.submit(7, blocking_run(release), {"chunk_rows": None, "incremental": False})
+        assert coalesced and again is full
+        incremental, coalesced = manager.submit(7, blocking_run(release), {"incremental": True, "chunk_rows": None})
+        assert not coalesced and incremental is not full
+        assert incremental.to_dict()["options"] == {"incremental": True, "chunk_rows": None}
+    finally:
+        release.set()
+        manager._executor.shutdown(wait=True)
+
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from engine import compile_rule, execute_plan
+from optimizer import optimize_plan
+from storage import SqliteStorage
+
+MINUTE_US = 60 * 1_000_000
+
+
+def read_var(var_id):
+    return {"class": "ReadVar", "parameters": {"Id": var_id}}
+
+
+def write_var(var_id):
+    return {"class": "WriteVar", "parameters": {"Id": var_id}}
+
+
+def link(parent, child):
+    return {"parent": parent, "child": child}
+
+
+RULES = {
+    # ReadVar 2 non relié : ses dates entrent dans la timeline et ses lignes sont qualifiées
+    "dead_readvar": {
+        "blocks": [
+            read_var(1),
+            {"class": "PeriodicCalc", "parameters": {"operation": "somme", "period": 60}},
+            write_var(100),
+            read_var(2),
+        ],
+        "links": [link(1, 2), link(2, 3)],
+    },
+    # Sous-expressions communes, chaîne arithmétique fusionnée et bloc calculé mort
+    "merge_and_fuse": {
+        "blocks": [
+            read_var(1),
+            read_var(2),
+            {"class": "+", "parameters": {}},
+            {"class": "+", "parameters": {}},
+            {"class": "*", "parameters": {}},
+            {"class": "-", "parameters": {}},
+            write_var(100),
+            {"class": "*", "parameters": {}},
+        ],
+        "links": [
+            link(1, 3), link(2, 3), link(1, 4), link(2, 4), link(3, 5), link(4, 5),
+            link(5, 6), link(1, 6), link(6, 7), link(1, 8), link(2, 8),
+        ],
+    },
+}
+
+
+def execute(plan):
+    storage = SqliteStorage()
+    rng = np.random.default_rng(0)
+    for var_id in (1, 2):
+        timestamps = np.sort(rng.choice(3 * 24 * 60, 500, replace=False)).astype(np.int64) * MINUTE_US
+        storage.insert_history(var_id, timestamps, rng.normal(size=500))
+    execute_plan(storage, plan)
+    written = storage.connection.execute(
+        "SELECT id_variable, date_acquisition, val_valide FROM his_valeur WHERE id_variable >= 100 ORDER BY 1, 2"
+    ).fetchall()
+    unqualified = storage.connection.execute("SELECT COUNT(*) FROM his_valeur WHERE id_qualification = 0")
+    return written, unqualified.fetchone()[0]
+
+
+@pytest.mark.parametrize("name, applied", [
+    ("dead_readvar", set()),
+    ("merge_and_fuse", {"dead_blocks", "merge", "fuse"}),
+])
+def test_optimized_plan_gives_the_same_output(name, applied):
+    plan = compile_rule(RULES[name])
+    optimized = optimize_plan(plan)
+    assert {step["rule"] for step in optimized.optimizations} == applied
+
+    expected, expected_unqualified = execute(plan)
+    actual, actual_unqualified = execute(optimized)
+    assert [row[:2] for row in actual] == [row[:2] for row in expected]
+    np.testing.assert_allclose([row[2] for row in actual], [row[2] for row in expected], rtol=1e-12)
+    assert actual_unqualified == expected_unqualified == 0
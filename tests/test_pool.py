@@ -0,0 +1,52 @@
+import threading
+import time
+
+from pool import ConnectionPool
+
+
+class FakeConnection:
+    """Connection whose SELECT 1 is slow, counting the connections open at once"""
+
+    open_now = 0
+    max_open = 0
+    lock = threading.Lock()
+
+    def __init__(self):
+        with FakeConnection.lock:
+            FakeConnection.open_now += 1
+            FakeConnection.max_open = max(FakeConnection.max_open, FakeConnection.open_now)
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        time.sleep(0.01)
+
+    def fetchone(self):
+        return (1,)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        with FakeConnection.lock:
+            FakeConnection.open_now -= 1
+
+
+def test_pool_never_exceeds_max_size_while_pinging():
+    # ping_after=0 : chaque connexion inactive est vérifiée avant d'être rendue
+    pool = ConnectionPool(FakeConnection, max_size=3, ping_after=0, checkout_timeout=10)
+
+    def worker():
+        for _ in range(20):
+            with pool.connection():
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert FakeConnection.max_open <= 3
+    assert pool.stats()["in_use"] == 0
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from aggregation import MINUTE_US
+from rolling import rolling, rolling_spec
+from series import Series
+
+
+def sample_series(seed=0, points=1500):
+    """Irregular timestamps with runs of invalid points and a large offset (variance precision)"""
+    rng = np.random.default_rng(seed)
+    timestamps = np.sort(rng.choice(2 * 24 * 60, points, replace=False)).astype(np.int64) * MINUTE_US
+    values = 1e6 + rng.normal(scale=3, size=points)
+    valid = rng.random(points) > 0.2
+    valid[200:260] = False
+    return Series(timestamps, np.where(valid, values, np.nan), valid)
+
+
+def reference(series, spec):
+    """Window (t - window, t] of every point, reduced with NumPy"""
+    out = np.full(len(series.timestamps), np.nan)
+    for i, timestamp in enumerate(series.timestamps):
+        in_window = (series.timestamps > timestamp - spec.window_us) & (series.timestamps <= timestamp)
+        vals = series.values[in_window & series.valid]
+        if len(vals) < spec.min_points:
+            continue
+        out[i] = {
+            "moyenne": np.mean, "somme": np.sum, "maximum": np.max, "minimum": np.min, "ecart_type": np.std,
+        }[spec.operation](vals)
+    return out
+
+
+@pytest.mark.parametrize("parameters", [
+    {"operation": "moyenne", "window": 30},
+    {"operation": "somme", "window": 90},
+    {"operation": "maximum", "window": 60},
+    {"operation": "minimum", "window": 240},
+    {"operation": "maximum", "window": 1},
+    {"operation": "ecart_type", "window": 45},
+    {"operation": "ecart_type", "window": 120, "min_points": 5},
+    {"operation": "moyenne", "window": 20, "min_points": 3},
+])
+def test_rolling_matches_reference_loop(parameters):
+    series = sample_series()
+    spec = rolling_spec(parameters)
+    result = rolling(series, spec)
+
+    expected = reference(series, spec)
+    np.testing.assert_array_equal(result.timestamps, series.timestamps)
+    np.testing.assert_array_equal(result.valid, ~np.isnan(expected))
+    np.testing.assert_allclose(result.values[result.valid], expected[result.valid], rtol=1e-9, atol=1e-6)